@@ -1,11 +1,12 @@
-from typing import List
+from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from elasticsearch import Elasticsearch
 
-from app.api.v1.schemas.agents import AgentCreate, AgentOut, AgentUpdate
+from app.api.v1.schemas.agents import AgentCreate, AgentListOut, AgentOut, AgentUpdate
 from app.services.agent_es_service import AgentService
 from app.core.dependencies import get_es_client
+from app.utils.pagination import InvalidCursorError
 
 router = APIRouter(prefix="/agents", tags=["agents"])
 
@@ -89,15 +90,18 @@ def create_agent(
 
 @router.get(
     "",
-    response_model=List[AgentOut],
+    response_model=AgentListOut,
     summary="List AI Agents",
-    description="Retrieve a paginated list of agents, including all their metadata and settings.",
+    description=(
+        "Retrieve a page of agents (newest first), including all their metadata and settings. "
+        "Pass `next_cursor` back as `cursor` to get the next page."
+    ),
     responses={
         200: {
-            "description": "A list of agents.",
+            "description": "A page of agents.",
             "content": {
                 "application/json": {
-                    "example": [
+                    "example": {"agents": [
                         {
                             "id": "123e4567-e89b-12d3-a456-426614174000",
                             "name": "Support Bot",
@@ -121,22 +125,27 @@ def create_agent(
                             "created_at": "2025-05-07T12:00:00Z",
                             "updated_at": "2025-05-07T12:00:00Z"
                         }
-                    ]
+                    ], "next_cursor": "eyJwaXQiOiIuLi4iLCJhZnRlciI6Wy4uLl19"}
                 }
             }
-        }
+        },
+        400: {"description": "Invalid cursor"}
     }
 )
 def list_agents(
     size: int = 10,
-    from_: int = 0,
+    cursor: Optional[str] = None,
     service: AgentService = Depends(get_agent_service)
 ):
     """
     - **size**: maximum number of agents to return  
-    - **from_**: pagination offset  
+    - **cursor**: `next_cursor` of the previous page  
     """
-    return service.list_agents(size=size, from_=from_)
+    try:
+        agents, next_cursor = service.list_agents(size=size, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    return AgentListOut(agents=agents, next_cursor=next_cursor)
 
 
 @router.get(
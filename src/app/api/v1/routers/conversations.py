@@ -1,37 +1,48 @@
 # POST /conversations
 # POST /conversations/{conv_id}/messages
+# POST /conversations/{conv_id}/messages/stream
 # GET /conversations
 # GET /conversations/{conv_id}
 # GET /conversations/{conv_id}/messages
 # GET /conversations/{conv_id}/tokens
 
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from minio import Minio
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 
 from app.api.v1.schemas.conversation import (
-    ConversationCreate, ConversationOut, ConversationWithMessages,
-    MessageCreate, MessageOut
+    ConversationCreate, ConversationListOut, ConversationOut, ConversationWithMessages,
+    MessageCreate, MessageListOut, TokenUsage
+)
+from app.services.conversation_service import (
+    ConversationService, LLMCallFailedError, MessageWriteError, TurnCancelledError
 )
-from app.services.conversation_service import ConversationService
 from app.services.agent_es_service import AgentService
-from app.core.dependencies import get_es_client, get_llm_client, get_minio_client
+from app.core.dependencies import get_es_client, get_async_es_client, get_llm_client, get_minio_client
 from app.services.file_service import FileService
+from app.utils.pagination import InvalidCursorError
 
 router = APIRouter(prefix="/conversations", tags=["conversations"])
 
+# nginx: «client closed request»؛ کلاینت دیگر پاسخی دریافت نمی‌کند
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
 
-def get_agent_svc(es: Elasticsearch = Depends(get_es_client)) -> AgentService:
-    return AgentService(es)
+def get_agent_svc(
+    es: Elasticsearch = Depends(get_es_client),
+    async_es: AsyncElasticsearch = Depends(get_async_es_client)
+) -> AgentService:
+    return AgentService(es, async_es)
 
 
 def get_file_service(minio_client: Minio = Depends(get_minio_client)):
-    return FileService(minio_client)
+    return FileService()
 
 
 def get_conv_service(
-    es=Depends(get_es_client),
+    es=Depends(get_async_es_client),
     llm=Depends(get_llm_client),
     agent_svc=Depends(get_agent_svc),
     file_svc: FileService = Depends(get_file_service)
@@ -60,14 +71,14 @@ def get_conv_service(
         }
     }
 )
-def create_conversation(
+async def create_conversation(
     payload: ConversationCreate,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **agent_id**: UUID of the agent to chat with  
     """
-    conv = svc.create_conversation(payload)
+    conv = await svc.create_conversation(payload)
     return conv
 
 
@@ -76,90 +87,182 @@ def create_conversation(
     response_model=ConversationWithMessages,
     status_code=status.HTTP_201_CREATED,
     summary="Send a message and receive LLM response",
-    description="Add a user message to the conversation, call the LLM, and return the updated history.",
+    description=(
+        "Add a user message to the conversation, call the LLM, and return the updated history "
+        "(the most recent messages, plus this turn). "
+        "With `refresh=true` the new messages are searchable before the response returns."
+    ),
     responses={
         201: {"description": "Message posted and assistant replied"},
-        404: {"description": "Conversation or Agent not found"}
+        404: {"description": "Conversation or Agent not found"},
+        499: {"description": "Client disconnected; the LLM call was cancelled"},
+        502: {"description": "LLM call failed"},
+        503: {"description": "With refresh=true: the messages of this turn could not be stored"}
     }
 )
-def post_message(
+async def post_message(
     conv_id: str,
     payload: MessageCreate,
+    request: Request,
+    refresh: bool = False,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **conv_id**: ID of the conversation  
     - **content**: user message text  
     - **attachments**: optional file attachments  
+    - **refresh**: wait for Elasticsearch refresh (read-your-writes for a following list call)  
     """
-    convo = svc.send_message(conv_id, payload)
+    try:
+        convo = await svc.send_message(
+            conv_id, payload, is_disconnected=request.is_disconnected, refresh=refresh
+        )
+    except TurnCancelledError:
+        raise HTTPException(HTTP_499_CLIENT_CLOSED_REQUEST, "Client closed request")
+    except LLMCallFailedError as e:
+        code = status.HTTP_429_TOO_MANY_REQUESTS if e.result.status_code == 429 else status.HTTP_502_BAD_GATEWAY
+        raise HTTPException(code, f"LLM call failed: {e.result.message}")
+    except MessageWriteError as e:
+        raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, str(e))
     if convo is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Conversation or Agent not found")
     return convo
 
 
+@router.post(
+    "/{conv_id}/messages/stream",
+    summary="Send a message and stream the LLM response (SSE)",
+    description=(
+        "Add a user message to the conversation and stream the assistant reply as Server-Sent Events. "
+        "Events: `delta` ({content}) per token chunk, `tool` ({names}) while the agent's tools run, "
+        "then `done` ({message_id, usage, metrics}) once the reply is queued for storage, or `error` ({detail}). "
+        "If the client disconnects, generation is cancelled and the partial reply is stored with status `cancelled`."
+    ),
+    responses={
+        200: {"description": "text/event-stream of the assistant reply", "content": {"text/event-stream": {}}},
+        404: {"description": "Conversation or Agent not found"},
+        502: {"description": "LLM call failed"}
+    }
+)
+async def post_message_stream(
+    conv_id: str,
+    payload: MessageCreate,
+    request: Request,
+    svc: ConversationService = Depends(get_conv_service)
+):
+    """
+    - **conv_id**: ID of the conversation  
+    - **content**: user message text  
+    - **attachments**: optional file attachments  
+    """
+    try:
+        events = await svc.stream_message(conv_id, payload, is_disconnected=request.is_disconnected)
+    except TurnCancelledError:
+        raise HTTPException(HTTP_499_CLIENT_CLOSED_REQUEST, "Client closed request")
+    except LLMCallFailedError as e:
+        code = status.HTTP_429_TOO_MANY_REQUESTS if e.result.status_code == 429 else status.HTTP_502_BAD_GATEWAY
+        raise HTTPException(code, f"LLM call failed: {e.result.message}")
+    if events is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Conversation or Agent not found")
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get(
     "",
-    response_model=List[ConversationOut],
+    response_model=ConversationListOut,
     summary="List conversations",
-    description="Retrieve a paginated list of conversations across all agents.",
-    responses={200: {"description": "A list of conversations"}}
+    description=(
+        "Retrieve a page of conversations across all agents (newest first). "
+        "Pass `next_cursor` back as `cursor` to get the next page."
+    ),
+    responses={
+        200: {"description": "A page of conversations"},
+        400: {"description": "Invalid cursor"}
+    }
 )
-def list_conversations(
+async def list_conversations(
     size: int = 10,
-    from_: int = 0,
+    cursor: Optional[str] = None,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **size**: number of conversations to return  
-    - **from_**: pagination offset  
+    - **cursor**: `next_cursor` of the previous page  
     """
-    return svc.list_conversations(size=size, from_=from_)
+    try:
+        convs, next_cursor = await svc.list_conversations(size=size, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    return ConversationListOut(conversations=convs, next_cursor=next_cursor)
 
 
 @router.get(
     "/{conv_id}",
     response_model=ConversationWithMessages,
-    summary="Get conversation with full history",
-    description="Retrieve a conversation and all its messages.",
+    summary="Get conversation with its history",
+    description=(
+        "Retrieve a conversation and the first page of its messages (oldest first). "
+        "If `next_cursor` is set, fetch the rest from `/conversations/{conv_id}/messages?cursor=...`."
+    ),
     responses={
         200: {"description": "Conversation returned"},
         404: {"description": "Conversation not found"}
     }
 )
-def get_conversation(
+async def get_conversation(
     conv_id: str,
+    size: int = 100,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **conv_id**: ID of the conversation to fetch  
+    - **size**: number of messages in the first page  
     """
-    conv = svc.get_conversation(conv_id)
+    conv = await svc.get_conversation(conv_id)
     if not conv:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Conversation not found")
-    msgs = svc.list_messages(conv_id)
-    return ConversationWithMessages(**conv.dict(), messages=msgs)
+    msgs, next_cursor = await svc.list_messages(conv_id, size=size)
+    return ConversationWithMessages(**conv.dict(), messages=msgs, next_cursor=next_cursor)
 
 
 @router.get(
     "/{conv_id}/messages",
-    response_model=List[MessageOut],
+    response_model=MessageListOut,
     summary="List messages in a conversation",
-    description="Retrieve only the messages for the given conversation.",
-    responses={200: {"description": "List of messages"}}
+    description=(
+        "Retrieve a page of messages for the given conversation (oldest first). "
+        "Pass `next_cursor` back as `cursor` to get the next page."
+    ),
+    responses={
+        200: {"description": "A page of messages"},
+        400: {"description": "Invalid cursor"}
+    }
 )
-def list_messages(
+async def list_messages(
     conv_id: str,
+    size: int = 100,
+    cursor: Optional[str] = None,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **conv_id**: ID of the conversation  
+    - **size**: number of messages to return  
+    - **cursor**: `next_cursor` of the previous page  
     """
-    return svc.list_messages(conv_id)
+    try:
+        msgs, next_cursor = await svc.list_messages(conv_id, size=size, cursor=cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, str(e))
+    return MessageListOut(messages=msgs, next_cursor=next_cursor)
 
 
 @router.get(
     "/{conv_id}/tokens",
+    response_model=TokenUsage,
     summary="Get total token usage",
     description="Return total prompt, completion, and combined token usage for a conversation.",
     responses={
@@ -168,6 +271,8 @@ def list_messages(
             "content": {
                 "application/json": {
                     "example": {
+                        "prompt_tokens": 120,
+                        "completion_tokens": 80,
                         "total_tokens": 200
                     }
                 }
@@ -176,15 +281,15 @@ def list_messages(
         404: {"description": "Conversation not found"}
     }
 )
-def token_calculator(
+async def token_calculator(
     conv_id: str,
     svc: ConversationService = Depends(get_conv_service)
 ):
     """
     - **conv_id**: ID of the conversation  
     """
-    conv = svc.get_conversation(conv_id)
-    if not conv:
+    # شمارنده‌های توکن روی سند مکالمه (یک get، بدون aggregation روی پیام‌ها)
+    usage = await svc.token_usage(conv_id)
+    if usage is None:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Conversation not found")
-    total_tokens_usage = svc.total_token_usage(conv_id)
-    return total_tokens_usage
\ No newline at end of file
+    return usage
\ No newline at end of file
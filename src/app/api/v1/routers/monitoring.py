@@ -0,0 +1,94 @@
+# GET /monitoring/llm
+
+from fastapi import APIRouter
+
+from app.llm.response_cache import response_cache
+from app.llm.resilience import resilience
+from app.llm.governor import governor
+from app.llm.single_flight import single_flight
+from app.llm.hedging import hedger
+from app.llm.stream_metrics import stream_stats
+from app.services.prompt_cache import prompt_header_cache
+from app.services.context_window import summarizer
+from app.services.conversation_manager import conversation_manager
+from app.services.message_writer import message_writer
+from app.llm.model_catalog import model_catalog
+from app.llm.timeouts import adaptive_timeouts
+
+router = APIRouter(prefix="/monitoring", tags=["monitoring"])
+
+
+@router.get(
+    "/llm",
+    summary="LLM client statistics",
+    description="In-process counters of the LLM client layer (per worker process).",
+    responses={
+        200: {
+            "description": "LLM statistics",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "cache": {"backend": "memory", "size": 12, "hits": 40, "misses": 12, "hit_ratio": 0.7692},
+                        "resilience": {
+                            "calls": 120, "retries": 4, "retries_by_reason": {"RateLimitError": 4},
+                            "gave_up": 0, "rejected_open": 0,
+                            "breakers": {"https://api.avalai.ir/v1": {"state": "closed", "consecutive_failures": 0}}
+                        },
+                        "governor": {
+                            "gpt-4o-mini": {"in_flight": 3, "queued": 0, "max_concurrency": 32, "admitted": 118}
+                        },
+                        "single_flight": {"in_flight": 1, "leaders": 118, "coalesced": 9},
+                        "hedging": {
+                            "enabled": True, "calls": 118, "hedged": 6, "hedge_wins": 4, "failovers": 1,
+                            "latency": {"https://api.avalai.ir/v1": {"gpt-4o-mini": {"samples": 118, "p50": 0.61, "p95": 1.9}}}
+                        },
+                        "streams": {
+                            "gpt-4o-mini": {"streams": 80, "ttft_p50_ms": 410.0, "ttft_p95_ms": 1250.0, "avg_tokens_per_second": 61.3}
+                        },
+                        "prompt_headers": {"size": 14, "max_entries": 512, "hits": 230, "misses": 14, "hit_ratio": 0.9426},
+                        "context_summaries": {"in_flight": 0, "completed": 31, "failed": 0},
+                        "conversations": {
+                            "conversations": 40, "max_entries": 1000, "hits": 210, "misses": 40, "revalidations": 12,
+                            "hit_ratio": 0.8077, "agents": 6, "agent_hit_ratio": 0.95
+                        },
+                        "message_writer": {
+                            "running": True, "pending": 0, "bulks": 35, "operations": 412,
+                            "avg_batch": 11.77, "retries": 0, "failed": 0
+                        },
+                        "models": {
+                            "gpt-4o-mini": {"tier": 1, "ttft": 0.41, "tokens_per_second": 61.3, "routed": 52},
+                            "gpt-4o": {"tier": 3, "ttft": 0.7, "tokens_per_second": 60.0, "routed": 3}
+                        },
+                        "timeouts": {
+                            "enabled": True,
+                            "models": {
+                                "gpt-4o-mini": {
+                                    "<=4000": {
+                                        "samples": 140, "first_token_samples": 90,
+                                        "first_token_p99": 2.1, "total_p99": 9.8,
+                                        "timeouts": {"connect": 5.0, "first_token": 10.0, "total": 19.6}
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+)
+async def llm_stats():
+    return {
+        "cache": response_cache.stats(),
+        "resilience": resilience.stats(),
+        "governor": governor.stats(),
+        "single_flight": single_flight.stats(),
+        "hedging": hedger.stats(),
+        "streams": stream_stats.stats(),
+        "prompt_headers": prompt_header_cache.stats(),
+        "context_summaries": summarizer.stats(),
+        "conversations": conversation_manager.stats(),
+        "message_writer": message_writer.stats(),
+        "models": model_catalog.stats(),
+        "timeouts": adaptive_timeouts.stats(),
+    }
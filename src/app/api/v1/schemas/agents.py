@@ -55,6 +55,16 @@ class LanguageEnum(str, Enum):
     # language: Optional[str] = "en"
 
 
+class RoutingPolicy(str, Enum):
+    fixed   = "fixed"     # همیشه llm_model_name
+    fastest = "fastest"   # سریع‌ترین مدل کافی برای این نوبت (از کاتالوگ مدل‌ها)
+
+
+class AgentToolName(str, Enum):
+    file_lookup      = "file_lookup"       # فایل‌های agent و ضمیمه‌های مکالمه (FileService)
+    knowledge_search = "knowledge_search"  # جستجو در indices خود agent
+
+
 class CreativityLevel(float, Enum):
     low    = 0.2
     medium = 0.5
@@ -121,6 +131,21 @@ class ResponseSettings(BaseModel):
         alias="language"
     )
 
+    cache_responses: bool = Field(
+        False,
+        example=True,
+        description="Opt-in: reuse cached LLM answers for deterministic requests (low creativity)",
+        alias="cache_responses"
+    )
+
+    routing_policy: RoutingPolicy = Field(
+        RoutingPolicy.fixed,
+        example=RoutingPolicy.fastest,
+        description="fixed: always llm_model_name; fastest: per turn, the fastest model that is adequate "
+                    "for the prompt size and response_length",
+        alias="routing_policy"
+    )
+
 
 #
 # 3) مدل‌های ورودی/خروجی
@@ -175,7 +200,13 @@ class AgentBase(BaseModel):
     files: List[str] = Field(
         default_factory=list,
         example=["file1.py", "notebook.ipynb"],
-        description="List of file paths associated with this agent"
+        description="Object keys of the agent's files in the files bucket (relative to the upload prefix)"
+    )
+
+    tools: List[AgentToolName] = Field(
+        default_factory=list,
+        example=[AgentToolName.knowledge_search],
+        description="Built-in tools the model may call during a turn"
     )
 
     role: RoleEnum = Field(
@@ -224,6 +255,9 @@ class AgentUpdate(BaseModel):
     files: Optional[List[str]] = Field(
         None, example=["module.py", "analysis.ipynb"]
     )
+    tools: Optional[List[AgentToolName]] = Field(
+        None, example=["file_lookup"]
+    )
 
 
 class AgentOut(AgentBase):
@@ -234,6 +268,12 @@ class AgentOut(AgentBase):
     updated_at: datetime = Field(
         ..., example="2024-10-12T08:30:00Z"
     )
+    # شمارنده‌های توکن همه مکالمه‌های agent؛ None برای agentهای ساخته‌شده پیش از شمارنده‌ها
+    # تا اولین پاسخ بعدی، و از آن پس شمارش از counters_since
+    prompt_tokens: Optional[int] = Field(None, example=18200)
+    completion_tokens: Optional[int] = Field(None, example=6400)
+    total_tokens: Optional[int] = Field(None, example=24600)
+    counters_since: Optional[datetime] = Field(None, example=None)
 
     class Config(AgentBase.Config):
         pass
@@ -248,4 +288,10 @@ class AgentInDB(AgentBase):
         ..., example="2024-10-12T08:30:00Z"
     )
     class Config(AgentBase.Config):
-        pass
\ No newline at end of file
+        pass
+
+
+class AgentListOut(BaseModel):
+    agents: List[AgentOut]
+    # برای صفحه بعد به صورت ?cursor= ارسال شود؛ None یعنی صفحه آخر
+    next_cursor: Optional[str] = Field(None, example="eyJwaXQiOiIuLi4iLCJhZnRlciI6Wy4uLl19")
\ No newline at end of file
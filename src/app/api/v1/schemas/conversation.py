@@ -1,12 +1,13 @@
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 from pydantic import BaseModel, Field
 
 # ---- Conversation ----
-# class TokenUsage(BaseModel):
-#     prompt_tokens: int
-#     completion_tokens: int
-#     total_tokens: int
+class TokenUsage(BaseModel):
+    prompt_tokens: int = Field(0, example=120)
+    completion_tokens: int = Field(0, example=80)
+    total_tokens: int = Field(0, example=200)
 
 class FileAttachment(BaseModel):
     id: str = Field(..., example="file-uuid")
@@ -24,7 +25,15 @@ class ConversationInDB(BaseModel):
     created_at: datetime = Field(..., example="2024-10-10T14:30:00")
 
 class ConversationOut(ConversationInDB):
-    pass
+    # خلاصه غلتان پیام‌هایی که دیگر به صورت کامل در prompt نمی‌آیند
+    summary: Optional[str] = Field(None, example="- User is planning a trip to Shiraz in May")
+    summary_upto: Optional[datetime] = Field(None, example="2024-10-10T14:40:00")
+    # شمارنده‌های توکن کل مکالمه؛ None برای مکالمه‌های ساخته‌شده پیش از شمارنده‌ها
+    prompt_tokens: Optional[int] = Field(None, example=1820)
+    completion_tokens: Optional[int] = Field(None, example=640)
+    total_tokens: Optional[int] = Field(None, example=2460)
+    # مکالمه‌های قدیمی: شمارنده‌ها فقط از این زمان‌اند تا GET /tokens پیام‌های پیش از آن را fold کند
+    counters_since: Optional[datetime] = Field(None, example=None)
 
 # ---- Message ----
 class MessageBase(BaseModel):
@@ -38,6 +47,18 @@ class MessageCreate(BaseModel):
         example=[{"id":"uuid","filename":"invoice.pdf","url":"http://example.com/files/invoice.pdf"}]
     )
 
+class MessageStatus(str, Enum):
+    completed = "completed"
+    cancelled = "cancelled"   # کلاینت قبل از پایان پاسخ قطع شد؛ content ناقص است
+
+class StreamMetrics(BaseModel):
+    ttft_ms: Optional[float] = Field(None, example=420.5)
+    inter_token_ms: Optional[float] = Field(None, example=18.2)
+    tokens_per_second: Optional[float] = Field(None, example=54.9)
+    duration_ms: Optional[float] = Field(None, example=2310.0)
+    chunks: Optional[int] = Field(None, example=96)
+    completion_tokens: Optional[int] = Field(None, example=104)
+
 class MessageInDB(BaseModel):
     id: str = Field(..., example="uuid-of-message")
     conversation_id: str = Field(..., example="uuid-of-conversation")
@@ -45,10 +66,24 @@ class MessageInDB(BaseModel):
     content: str = Field(..., example="Sure! I can help with that.")
     attachments: List[FileAttachment] = Field(default_factory=list)
     created_at: datetime = Field(..., example="2024-10-10T14:31:00")
+    prompt_tokens: Optional[int] = Field(0, example=42)
+    completion_tokens: Optional[int] = Field(0, example=14)
     token_usage: Optional[int] = Field(0, example=56)
+    stream_metrics: Optional[StreamMetrics] = None
+    status: MessageStatus = Field(MessageStatus.completed, example="completed")
 
 class MessageOut(MessageInDB):
     pass
 
 class ConversationWithMessages(ConversationOut):
     messages: List[MessageOut] = Field(default_factory=list)
+    # پیام‌های بیشتر: GET /conversations/{id}/messages?cursor=...
+    next_cursor: Optional[str] = Field(None, example="eyJwaXQiOiIuLi4iLCJhZnRlciI6Wy4uLl19")
+
+class ConversationListOut(BaseModel):
+    conversations: List[ConversationOut]
+    next_cursor: Optional[str] = Field(None, example="eyJwaXQiOiIuLi4iLCJhZnRlciI6Wy4uLl19")
+
+class MessageListOut(BaseModel):
+    messages: List[MessageOut]
+    next_cursor: Optional[str] = Field(None, example="eyJwaXQiOiIuLi4iLCJhZnRlciI6Wy4uLl19")
@@ -13,7 +13,11 @@ class LLMCallResult:
                  full_response_data: Optional[Dict[str, Any]] = None,  # دیکشنری کامل پاسخ API (در صورت درخواست)
                  stream_data: Optional[AsyncGenerator[str, None]] = None,  # ژنراتور برای حالت stream
                  error_detail: Optional[str] = None, # جزئیات خطا
-                 usage: Optional[Dict[str, Any]] = None):  # اطلاعات مصرف توکن (usage)
+                 usage: Optional[Dict[str, Any]] = None,  # اطلاعات مصرف توکن (usage)؛ در حالت stream پس از اتمام ژنراتور پر می‌شود
+                 cached: bool = False,  # آیا پاسخ از LLM response cache آمده است
+                 provider: Optional[str] = None,  # base_url ای که پاسخ را داده (hedge/failover)
+                 stream_metrics: Optional[Dict[str, Any]] = None,  # TTFT، inter-token و tokens/s؛ پس از اتمام stream پر می‌شود
+                 tool_calls: Optional[List[Dict[str, Any]]] = None):  # درخواست‌های tool مدل (OpenAI tool_calls)؛ در stream پس از اتمام پر می‌شود
         self.success = success
         self.status_code = status_code
         self.message = message        
@@ -22,6 +26,10 @@ class LLMCallResult:
         self.stream_data = stream_data
         self.error_detail = error_detail
         self.usage = usage
+        self.cached = cached
+        self.provider = provider
+        self.stream_metrics = stream_metrics
+        self.tool_calls = tool_calls
 
     def __repr__(self):
         return (f"LLMCallResult(success={self.success}, status_code={self.status_code}, "
@@ -29,4 +37,5 @@ class LLMCallResult:
                 f"has_content={self.content is not None}, "
                 f"has_full_response={self.full_response_data is not None}, "
                 f"is_streaming={self.stream_data is not None}, "
-                f"usage={self.usage})")
\ No newline at end of file
+                f"usage={self.usage}, cached={self.cached}, provider={self.provider}, "
+                f"tool_calls={len(self.tool_calls) if self.tool_calls else 0})")
\ No newline at end of file
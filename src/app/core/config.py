@@ -1,3 +1,5 @@
+from typing import Any, Dict, List
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -32,6 +34,98 @@ class Settings(BaseSettings):
     MINIO_REGION: str = "us-east-1"
     # OpenAI
     OPENAI_API_KEY: str = Field(..., env="OPENAI_API_KEY")
+    OPENAI_BASE_URL: str = Field("https://api.avalai.ir/v1", env="OPENAI_BASE_URL")
     # TEMPERATURE: float = Field(0.7, env="TEMPERATURE")
 
+    # LLM HTTP connection pool (یک pool مشترک برای کل پروسه)
+    LLM_HTTP2: bool = Field(True, env="LLM_HTTP2")
+    LLM_POOL_MAX_CONNECTIONS: int = Field(200, env="LLM_POOL_MAX_CONNECTIONS")
+    LLM_POOL_MAX_KEEPALIVE: int = Field(50, env="LLM_POOL_MAX_KEEPALIVE")
+    LLM_POOL_KEEPALIVE_EXPIRY: float = Field(120.0, env="LLM_POOL_KEEPALIVE_EXPIRY")
+    LLM_POOL_PREWARM: bool = Field(True, env="LLM_POOL_PREWARM")
+    # pre-warm در پس‌زمینه اجرا می‌شود و پس از این مدت (ثانیه) رها می‌شود
+    LLM_POOL_PREWARM_TIMEOUT: float = Field(5.0, env="LLM_POOL_PREWARM_TIMEOUT")
+    LLM_TIMEOUT: float = Field(90.0, env="LLM_TIMEOUT")
+
+    # timeout تطبیقی هر درخواست: percentile تأخیرهای دیده‌شده (به ازای مدل و اندازه prompt) × factor
+    # LLM_TIMEOUT سقف است و تا جمع شدن نمونه کافی همان استفاده می‌شود
+    LLM_ADAPTIVE_TIMEOUTS: bool = Field(True, env="LLM_ADAPTIVE_TIMEOUTS")
+    LLM_TIMEOUT_QUANTILE: float = Field(0.99, env="LLM_TIMEOUT_QUANTILE")
+    LLM_TIMEOUT_FACTOR: float = Field(2.0, env="LLM_TIMEOUT_FACTOR")
+    LLM_TIMEOUT_MIN: float = Field(10.0, env="LLM_TIMEOUT_MIN")
+    LLM_TIMEOUT_MIN_SAMPLES: int = Field(30, env="LLM_TIMEOUT_MIN_SAMPLES")
+    LLM_TIMEOUT_WINDOW: int = Field(500, env="LLM_TIMEOUT_WINDOW")
+    LLM_CONNECT_TIMEOUT: float = Field(5.0, env="LLM_CONNECT_TIMEOUT")
+
+    # LLM response cache (فقط درخواست‌های قطعی: temperature پایین یا seed ثابت)
+    LLM_CACHE_MAX_ENTRIES: int = Field(1024, env="LLM_CACHE_MAX_ENTRIES")
+    LLM_CACHE_TTL_SECONDS: float = Field(86400.0, env="LLM_CACHE_TTL_SECONDS")
+    LLM_CACHE_MAX_TEMPERATURE: float = Field(0.2, env="LLM_CACHE_MAX_TEMPERATURE")
+    LLM_CACHE_BACKEND: str = Field("memory", env="LLM_CACHE_BACKEND")  # memory | disk | es
+    LLM_CACHE_DIR: str = Field("/tmp/llm_cache", env="LLM_CACHE_DIR")
+
+    # LLM retry / circuit breaker (per base_url)
+    LLM_MAX_RETRIES: int = Field(3, env="LLM_MAX_RETRIES")
+    LLM_RETRY_BASE_DELAY: float = Field(0.5, env="LLM_RETRY_BASE_DELAY")
+    LLM_RETRY_MAX_DELAY: float = Field(20.0, env="LLM_RETRY_MAX_DELAY")
+    LLM_BREAKER_FAILURE_THRESHOLD: int = Field(5, env="LLM_BREAKER_FAILURE_THRESHOLD")
+    LLM_BREAKER_RESET_TIMEOUT: float = Field(30.0, env="LLM_BREAKER_RESET_TIMEOUT")
+
+    # LLM admission control (per model): concurrency + requests/tokens per minute
+    LLM_MAX_CONCURRENCY_PER_MODEL: int = Field(32, env="LLM_MAX_CONCURRENCY_PER_MODEL")
+    LLM_RPM_LIMIT: int = Field(500, env="LLM_RPM_LIMIT")
+    LLM_TPM_LIMIT: int = Field(200000, env="LLM_TPM_LIMIT")
+    LLM_ADMISSION_MAX_WAIT: float = Field(30.0, env="LLM_ADMISSION_MAX_WAIT")
+    # مثال: {"gpt-4o": {"max_concurrency": 8, "rpm": 100, "tpm": 30000}}
+    LLM_MODEL_LIMITS: Dict[str, Dict[str, int]] = Field(default_factory=dict, env="LLM_MODEL_LIMITS")
+
+    # llm_batch_async: حداکثر فراخوانی هم‌زمان در یک batch
+    LLM_BATCH_CONCURRENCY: int = Field(8, env="LLM_BATCH_CONCURRENCY")
+
+    # Provider pool برای hedge/failover؛ خالی = فقط OPENAI_BASE_URL
+    # مثال: [{"name": "avalai", "base_url": "https://api.avalai.ir/v1"},
+    #        {"name": "openai", "base_url": "https://api.openai.com/v1", "api_key": "sk-...", "models": ["gpt-4o", "gpt-4o-mini"]}]
+    LLM_PROVIDERS: List[Dict[str, Any]] = Field(default_factory=list, env="LLM_PROVIDERS")
+    LLM_HEDGE_ENABLED: bool = Field(True, env="LLM_HEDGE_ENABLED")
+    LLM_HEDGE_PERCENTILE: float = Field(0.95, env="LLM_HEDGE_PERCENTILE")
+    LLM_HEDGE_DEFAULT_DELAY: float = Field(4.0, env="LLM_HEDGE_DEFAULT_DELAY")  # تا وقتی نمونه کافی نداریم
+    LLM_HEDGE_MIN_DELAY: float = Field(0.5, env="LLM_HEDGE_MIN_DELAY")
+    LLM_HEDGE_MAX_RATIO: float = Field(0.1, env="LLM_HEDGE_MAX_RATIO")  # حداکثر سهم درخواست‌های hedge شده
+
+    # کاتالوگ مدل‌ها (پنجره context، قیمت، tier، سرعت پیش‌فرض)؛ مثال: {"gpt-4o": {"input_price": 2.0}}
+    LLM_MODEL_CATALOG: Dict[str, Dict[str, Any]] = Field(default_factory=dict, env="LLM_MODEL_CATALOG")
+    # routing_policy=fastest: تا این اندازه prompt، پاسخ کوتاه/متوسط می‌تواند به مدل یک tier پایین‌تر برود
+    ROUTER_SMALL_PROMPT_TOKENS: int = Field(2000, env="ROUTER_SMALL_PROMPT_TOKENS")
+
+    # tool calling در نوبت‌های چت: حداکثر مراحل tool و timeout هر فراخوانی tool (ثانیه)
+    AGENT_MAX_TOOL_STEPS: int = Field(4, env="AGENT_MAX_TOOL_STEPS")
+    AGENT_TOOL_TIMEOUT: float = Field(10.0, env="AGENT_TOOL_TIMEOUT")
+
+    # header کامپایل‌شده هر agent (system prompt + تنظیمات پاسخ)، به ازای updated_at
+    PROMPT_HEADER_CACHE_SIZE: int = Field(512, env="PROMPT_HEADER_CACHE_SIZE")
+
+    # پنجره context هر نوبت: N نوبت آخر به صورت کامل + خلاصه غلتان نوبت‌های قدیمی‌تر
+    CONTEXT_MAX_TURNS: int = Field(10, env="CONTEXT_MAX_TURNS")
+    CONTEXT_HISTORY_TOKENS: int = Field(4000, env="CONTEXT_HISTORY_TOKENS")
+    # بودجه توکن تاریخچه به ازای مدل؛ مثال: {"gpt-4o": 8000}
+    CONTEXT_MODEL_BUDGETS: Dict[str, int] = Field(default_factory=dict, env="CONTEXT_MODEL_BUDGETS")
+    CONTEXT_SUMMARY_MODEL: str = Field("gpt-4o-mini", env="CONTEXT_SUMMARY_MODEL")
+    CONTEXT_SUMMARY_MAX_TOKENS: int = Field(400, env="CONTEXT_SUMMARY_MAX_TOKENS")
+
+    # مکالمه‌های فعال (metadata + تاریخچه سریال‌شده) در حافظه هر worker
+    CHAT_HISTORY_CACHE_SIZE: int = Field(1000, env="CHAT_HISTORY_CACHE_SIZE")
+    CHAT_HISTORY_MAX_MESSAGES: int = Field(200, env="CHAT_HISTORY_MAX_MESSAGES")
+    # پس از این مدت (ثانیه) مکالمه cache شده با ES هم‌سان می‌شود (نوبت‌های workerهای دیگر)
+    CONVERSATION_CACHE_TTL: float = Field(30.0, env="CONVERSATION_CACHE_TTL")
+    AGENT_CACHE_TTL: float = Field(30.0, env="AGENT_CACHE_TTL")
+    # ذخیره پیام‌ها با _bulk (write-behind): ارسال با پر شدن batch یا پس از max_delay ثانیه
+    MESSAGE_WRITER_ENABLED: bool = Field(True, env="MESSAGE_WRITER_ENABLED")
+    MESSAGE_WRITER_MAX_BATCH: int = Field(500, env="MESSAGE_WRITER_MAX_BATCH")
+    MESSAGE_WRITER_MAX_DELAY: float = Field(0.05, env="MESSAGE_WRITER_MAX_DELAY")
+    MESSAGE_WRITER_MAX_RETRIES: int = Field(3, env="MESSAGE_WRITER_MAX_RETRIES")
+    # تأخیر پیش از retry اول (ثانیه)؛ هر retry بعدی دو برابر
+    MESSAGE_WRITER_RETRY_BACKOFF: float = Field(0.2, env="MESSAGE_WRITER_RETRY_BACKOFF")
+    # هر چند ثانیه قطع شدن کلاینت در حین تولید پاسخ بررسی شود
+    CHAT_DISCONNECT_POLL_INTERVAL: float = Field(0.5, env="CHAT_DISCONNECT_POLL_INTERVAL")
+
 settings = Settings()
\ No newline at end of file
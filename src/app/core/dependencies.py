@@ -1,4 +1,4 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 from app.core.config import settings
 from functools import lru_cache
 import os
@@ -14,6 +14,19 @@ def get_es_client() -> Elasticsearch:
     )
     return es
 
+@lru_cache()
+def get_async_es_client() -> AsyncElasticsearch:
+    """
+    Async ES client shared by the async request path (chat turns).
+    Closed in the app lifespan.
+    """
+    es = AsyncElasticsearch(
+        hosts=[{"host": settings.ES_HOST, "port": settings.ES_PORT, "scheme": "http"}],
+        basic_auth=(settings.ES_USER, settings.ES_PASS) if settings.ES_USER else None,
+        verify_certs=False
+    )
+    return es
+
 def get_llm_client():
     return llm_async
 
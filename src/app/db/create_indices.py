@@ -1,4 +1,9 @@
+from app.core.config import settings
 from app.db.indices.agents import agent_index_name, agents_indices_set_mapp
+from app.db.indices.conversations import (
+    conversation_index_name, conversations_indices_set_mapp, message_index_name, messages_indices_set_mapp
+)
+from app.db.indices.llm_cache import llm_cache_index_name, llm_cache_indices_set_mapp
 
 def create_indices(es):
     # # Agents
@@ -88,4 +93,8 @@ def create_indices(es):
     #     },
     #     ignore=400
     # )
-    es.indices.create(index=agent_index_name, body=agents_indices_set_mapp(1), ignore=400)
\ No newline at end of file
+    es.indices.create(index=agent_index_name, body=agents_indices_set_mapp(1), ignore=400)
+    es.indices.create(index=conversation_index_name, body=conversations_indices_set_mapp(1), ignore=400)
+    es.indices.create(index=message_index_name, body=messages_indices_set_mapp(1), ignore=400)
+    if settings.LLM_CACHE_BACKEND == "es":
+        es.indices.create(index=llm_cache_index_name, body=llm_cache_indices_set_mapp(1), ignore=400)
\ No newline at end of file
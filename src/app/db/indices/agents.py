@@ -20,9 +20,17 @@ def agents_indices_set_mapp(es, number_of_shards=1):
                     "creativity": {"type": "keyword"},
                     "response_length": {"type": "keyword"},
                     "language": {"type": "keyword"},
+                    "routing_policy": {"type": "keyword"},
                     "exception_words": {"type": "keyword"},
                     "indices": {"type": "keyword"},
                     "files": {"type": "keyword"},
+                    "tools": {"type": "keyword"},
+                    # مجموع توکن همه مکالمه‌های agent (افزایش اتمی با هر پیام)
+                    "prompt_tokens": {"type": "long"},
+                    "completion_tokens": {"type": "long"},
+                    "total_tokens": {"type": "long"},
+                    "counters_since": {"type": "date"},
+                    "counted_messages": {"type": "keyword", "index": False, "doc_values": False},
                     "created_at": {
                         "type": "date",
                         "format": "strict_date_optional_time||EEE MMM dd HH:mm:ss Z yyyy"
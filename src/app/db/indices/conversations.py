@@ -1,31 +1,54 @@
-def create_indices(es):
+conversation_index_name = "conversations"
+def conversations_indices_set_mapp(number_of_shards=1):
     # Conversations
-    es.indices.create(
-        index="conversations",
-        body={
+    # prompt/completion/total_tokens: شمارنده‌هایی که با هر پیام به صورت اتمی (script) افزایش می‌یابند
+    # counted_messages: آخرین پیام‌های شمرده‌شده (جلوگیری از افزایش دوباره)؛ جستجو نمی‌شود
+    # counters_since: مکالمه‌های قدیمی؛ پیام‌های پیش از آن هنوز در شمارنده‌ها fold نشده‌اند
+    settings_and_mappings = {
             "mappings": {
                 "properties": {
                     "agent_id": {"type": "keyword"},
-                    "created_at": {"type": "date"}
+                    "title": {"type": "text"},
+                    "created_at": {"type": "date"},
+                    "summary": {"type": "text", "index": False},
+                    "summary_upto": {"type": "date"},
+                    "prompt_tokens": {"type": "long"},
+                    "completion_tokens": {"type": "long"},
+                    "total_tokens": {"type": "long"},
+                    "counters_since": {"type": "date"},
+                    "counted_messages": {"type": "keyword", "index": False, "doc_values": False}
                 }
+            },
+            "settings": {
+                "number_of_replicas": 0,
+                "number_of_shards": number_of_shards,
             }
-        },
-        ignore=400
-    )
+    }
+    return settings_and_mappings
+
+
+message_index_name = "messages"
+def messages_indices_set_mapp(number_of_shards=1):
     # Messages
-    es.indices.create(
-        index="messages",
-        body={
+    # token_usage = prompt_tokens + completion_tokens (عدد صحیح، نه nested)
+    settings_and_mappings = {
             "mappings": {
                 "properties": {
                     "conversation_id": {"type": "keyword"},
                     "role": {"type": "keyword"},
+                    "status": {"type": "keyword"},
                     "content": {"type": "text"},
-                    "token_usage": {
-                        "type": "nested",
+                    "prompt_tokens": {"type": "integer"},
+                    "completion_tokens": {"type": "integer"},
+                    "token_usage": {"type": "integer"},
+                    "stream_metrics": {
                         "properties": {
-                        "token_input":  { "type": "integer" },
-                        "token_output": { "type": "integer" }
+                        "ttft_ms":           { "type": "float" },
+                        "inter_token_ms":    { "type": "float" },
+                        "tokens_per_second": { "type": "float" },
+                        "duration_ms":       { "type": "float" },
+                        "chunks":            { "type": "integer" },
+                        "completion_tokens": { "type": "integer" }
                         }
                     },
                     "created_at": {"type": "date"},
@@ -38,7 +61,10 @@ def create_indices(es):
                         }
                     }
                 }
+            },
+            "settings": {
+                "number_of_replicas": 0,
+                "number_of_shards": number_of_shards,
             }
-        },
-        ignore=400
-    )
\ No newline at end of file
+    }
+    return settings_and_mappings
@@ -0,0 +1,19 @@
+llm_cache_index_name = "llm_response_cache"
+def llm_cache_indices_set_mapp(number_of_shards=1):
+    # LLM response cache (persistent tier)
+    # پاسخ در _source نگه داشته می‌شود ولی ایندکس نمی‌شود (dynamic: false)
+    settings_and_mappings = {
+            "mappings": {
+                "dynamic": False,
+                "properties": {
+                    "model": {"type": "keyword"},
+                    "created_at": {"type": "date"},
+                    "expires_at": {"type": "date"},
+                }
+            },
+            "settings": {
+                "number_of_replicas": 0,
+                "number_of_shards": number_of_shards,
+            }
+    }
+    return settings_and_mappings
@@ -1,31 +1,24 @@
 import openai
 import json
 import logging
-from typing import Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 from app.core.config import settings
 from app.llm.prompts.resume import RESUME_PROCESSING_PROMPT_TEMPLATE
-from app.llm.llm_client import llm_async
+from app.llm.llm_client import llm_async, llm_batch_async, BatchProgressCallback
+from app.llm.json_stream import JSONStreamError, aiter_json_events
 from app.api.v1.schemas.llm_result import LLMCallResult
+from app.api.v1.schemas.resume import ExtractedResumeData
+from pydantic import ValidationError
 import logging
 
 logger = logging.getLogger(__name__)
 
+ResumeData = Tuple[Optional[dict], Optional[dict]]
 
-async def process_resume_text(
-    resume_text: str,
-    input_model: str = "gpt-4o-mini" # gpt-4o
-) -> Tuple[Optional[dict], Optional[dict]]:
-    """
-    Sends resume text to LLM and expects two JSON objects in response:
-      { parsedResult: { extractedData:…, extractedData_persian:… } }
-    Returns a tuple: (extracted_data_english, extracted_data_persian)
-    """
-    if not resume_text.strip():
-        logger.warning("Resume text is empty. Skipping LLM processing.")
-        return None, None
 
+def _resume_llm_kwargs(resume_text: str, input_model: str) -> Dict[str, Any]:
     prompt = RESUME_PROCESSING_PROMPT_TEMPLATE.format(resume_text=resume_text)
-    llm_response: LLMCallResult = await llm_async(
+    return dict(
         prompt=prompt, # یا می‌توانید از پارامتر messages استفاده کنید
         system_message="You are an AI assistant that outputs JSON based on the user's resume text according to a specific schema.",
         llm_model_name=input_model, # یک متغیر جدید در settings برای نام مدل
@@ -34,8 +27,91 @@ async def process_resume_text(
         temperature=0.2, # برای دقت بیشتر در استخراج ساختاریافته
         max_tokens=5000, # ممکن است برای رزومه‌های طولانی و خروجی JSON بزرگ نیاز باشد
         response_format={"type": "json_object"}, # بسیار مهم برای دریافت JSON
+        use_cache=True, # پردازش دوباره همان رزومه از cache پاسخ داده می‌شود
         # سایر پارامترهای مورد نیاز ...
     )
+
+
+async def process_resume_text(
+    resume_text: str,
+    input_model: str = "gpt-4o-mini" # gpt-4o
+) -> ResumeData:
+    """
+    Streams the LLM answer and parses it incrementally. Expected document:
+      { parsedResult: { extractedData:…, extractedData_persian:… } }
+    - extractedData is validated against ExtractedResumeData as soon as it closes,
+      while extractedData_persian is still being generated
+    - A malformed document, an unexpected top-level key or an invalid extractedData
+      stops the stream at once, so the remaining tokens are not paid for
+    Returns a tuple: (extracted_data_english, extracted_data_persian)
+    """
+    if not resume_text.strip():
+        logger.warning("Resume text is empty. Skipping LLM processing.")
+        return None, None
+
+    llm_response: LLMCallResult = await llm_async(stream=True, **_resume_llm_kwargs(resume_text, input_model))
+    if not llm_response.success:
+        logger.error(f"LLM call failed: {llm_response.message} - {llm_response.error_detail}")
+        return None, None
+
+    extracted_data_english: Optional[dict] = None
+    extracted_data_persian: Optional[dict] = None
+    events = aiter_json_events(llm_response.stream_data, max_depth=2)
+    try:
+        async for event in events:
+            if event.kind == "key":
+                if event.path[0] != "parsedResult":
+                    logger.error(f"Unexpected top-level key {event.path[0]!r} in LLM output; aborting stream.")
+                    return None, None
+                continue
+            if event.path == ("parsedResult", "extractedData"):
+                # اعتبارسنجی زودهنگام؛ در صورت خطا بقیه خروجی تولید نمی‌شود
+                ExtractedResumeData(**event.value)
+                extracted_data_english = event.value
+            elif event.path == ("parsedResult", "extractedData_persian"):
+                extracted_data_persian = event.value
+    except JSONStreamError as e:
+        logger.error(f"Malformed JSON from LLM, stream aborted: {e}")
+        return None, None
+    except ValidationError as e:
+        logger.error(f"extractedData failed validation, stream aborted: {e}")
+        return None, None
+    except Exception as e:
+        logger.error(f"Error while streaming resume JSON from LLM: {e}", exc_info=True)
+        return None, None
+    finally:
+        await events.aclose()
+        await llm_response.stream_data.aclose()
+
+    if not extracted_data_english:
+        logger.error("Key 'extractedData' not found in parsedResult.")
+        return None, None
+    return extracted_data_english, extracted_data_persian
+
+
+async def process_resume_texts(
+    resume_texts: List[str],
+    input_model: str = "gpt-4o-mini",
+    concurrency: int = settings.LLM_BATCH_CONCURRENCY,
+    progress_callback: Optional[BatchProgressCallback] = None,
+) -> List[ResumeData]:
+    """
+    Bulk version of process_resume_text on top of llm_batch_async.
+    Results keep the input order; an empty or failed resume yields (None, None) for that item only.
+    """
+    results: List[ResumeData] = [(None, None)] * len(resume_texts)
+    indexes = [i for i, text in enumerate(resume_texts) if text.strip()]
+    responses = await llm_batch_async(
+        [_resume_llm_kwargs(resume_texts[i], input_model) for i in indexes],
+        concurrency=concurrency,
+        progress_callback=progress_callback,
+    )
+    for i, llm_response in zip(indexes, responses):
+        results[i] = _parse_resume_response(llm_response)
+    return results
+
+
+def _parse_resume_response(llm_response: LLMCallResult) -> ResumeData:
     logger.debug(f"LLM response: {llm_response}")
 
     if not llm_response.success:
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:  # HTTP/2 در httpx به پکیج h2 نیاز دارد
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+ClientKey = Tuple[str, str, Optional[float]]
+
+
+class LLMClientPool:
+    """
+    Process-wide registry of long-lived AsyncOpenAI clients.
+
+    - One client (and one httpx connection pool) per (base_url, api_key, timeout)
+    - Keep-alive and HTTP/2 multiplexing are shared by every call on the same key
+    - Opened/closed through the FastAPI lifespan (see app.main)
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 200,
+        max_keepalive_connections: int = 50,
+        keepalive_expiry: float = 120.0,
+        http2: bool = True,
+    ):
+        self._clients: Dict[ClientKey, AsyncOpenAI] = {}
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2 and not _HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested for LLM pool but 'h2' is not installed; falling back to HTTP/1.1.")
+        self._http2 = http2 and _HTTP2_AVAILABLE
+
+    def get_client(self, base_url: str, api_key: str, timeout: Optional[float]) -> AsyncOpenAI:
+        """
+        - Return the pooled client for this key, creating it on first use
+        """
+        key = (base_url, api_key, timeout)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                http2=self._http2,
+                limits=self._limits,
+                timeout=timeout,
+            )
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=timeout,
+                # retry/backoff در app.llm.resilience انجام می‌شود، نه در SDK
+                max_retries=0,
+                http_client=http_client,
+            )
+            self._clients[key] = client
+            logger.info(f"LLM client created for {base_url} (timeout={timeout}, http2={self._http2})")
+        return client
+
+    async def prewarm(
+        self, base_url: str, api_key: str, timeout: Optional[float], max_wait: Optional[float] = None
+    ) -> None:
+        """
+        - Open a connection (DNS + TCP + TLS) before the first user request
+        - Gives up after `max_wait` seconds (the client's own timeout/retries may be much longer)
+        - Failures are logged only; the app must start even if the provider is down
+        """
+        client = self.get_client(base_url, api_key, timeout)
+        try:
+            await asyncio.wait_for(client.models.list(), timeout=max_wait)
+            logger.info(f"LLM connection pre-warmed: {base_url}")
+        except asyncio.TimeoutError:
+            logger.warning(f"LLM pre-warm timed out after {max_wait}s for {base_url}")
+        except Exception as e:
+            logger.warning(f"LLM pre-warm failed for {base_url}: {e}")
+
+    async def aclose(self) -> None:
+        """
+        - Close every pooled client and drop the registry
+        """
+        clients = list(self._clients.values())
+        self._clients.clear()
+        results = await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+        for r in results:
+            if isinstance(r, Exception):
+                logger.warning(f"Error closing LLM client: {r}")
+
+
+client_pool = LLMClientPool(
+    max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+    keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY,
+    http2=settings.LLM_HTTP2,
+)
@@ -0,0 +1,39 @@
+import hashlib
+import json
+from typing import Any, Dict
+
+# پارامترهایی که خروجی مدل را تعیین می‌کنند (stream و timeout عمداً حذف شده‌اند)
+FINGERPRINT_FIELDS = (
+    "model",
+    "messages",
+    "temperature",
+    "max_tokens",
+    "top_p",
+    "n",
+    "stop",
+    "frequency_penalty",
+    "presence_penalty",
+    "seed",
+    "response_format",
+    # tool calling: پاسخ با tools می‌تواند tool_calls باشد، بدون آن متن
+    "tools",
+    "tool_choice",
+    "parallel_tool_calls",
+)
+
+
+def request_fingerprint(request_params: Dict[str, Any]) -> str:
+    """
+    Canonical hash of an LLM request.
+
+    - Only the fields in FINGERPRINT_FIELDS take part
+    - Keys are sorted and floats normalised, so equal requests always hash the same
+    """
+    canonical = {}
+    for field in FINGERPRINT_FIELDS:
+        value = request_params.get(field)
+        if isinstance(value, float):
+            value = round(value, 6)
+        canonical[field] = value
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
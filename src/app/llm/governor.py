@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.llm.tokenizer import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# اولویت کمتر = زودتر (ReleaseType.public قبل از private)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class GovernorTimeoutError(Exception):
+    """A call waited longer than the allowed queue time for admission."""
+
+    def __init__(self, model: str, waited: float):
+        super().__init__(f"LLM admission queue timeout for {model} after {waited:.1f}s")
+        self.model = model
+        self.waited = waited
+
+
+class TokenBucket:
+    """
+    Continuous-refill token bucket: `per_minute` units per minute, burst up to `per_minute`.
+    Balance may go negative after `adjust` (actual usage above estimate), which delays later calls.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 = available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class AdmissionTicket:
+    """Held by an admitted call; `release()` is idempotent."""
+
+    def __init__(self, governor: "ModelGovernor", estimated_tokens: int):
+        self._governor = governor
+        self.estimated_tokens = estimated_tokens
+        self._released = False
+
+    def settle(self, actual_tokens: Optional[int]) -> None:
+        """Correct the TPM bucket with the real token usage once known."""
+        if actual_tokens is not None:
+            self._governor.tokens.adjust(actual_tokens - self.estimated_tokens)
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._governor._release()
+
+
+class ModelGovernor:
+    """
+    Admission control for one model.
+
+    - At most `max_concurrency` calls in flight
+    - Requests-per-minute and tokens-per-minute token buckets
+    - Waiting calls are admitted strictly by (priority, arrival order)
+    """
+
+    def __init__(self, model: str, max_concurrency: int, rpm: int, tpm: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future, int]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self._waiters and self.in_flight < self.max_concurrency:
+            priority, seq, fut, est_tokens = self._waiters[0]
+            if fut.done():  # cancelled or timed out while queued
+                heapq.heappop(self._waiters)
+                continue
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(est_tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(est_tokens)
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def _wake(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    async def acquire(self, priority: int, estimated_tokens: int, max_wait: Optional[float]) -> AdmissionTicket:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut, estimated_tokens))
+        started = time.monotonic()
+        self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                # همزمان با لغو، پذیرش هم انجام شده بود: ظرفیت را پس بده
+                self._release()
+            else:
+                fut.cancel()
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                raise GovernorTimeoutError(self.model, time.monotonic() - started)
+            raise
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        if waited > 1.0:
+            logger.info(f"LLM call for {self.model} waited {waited:.2f}s for admission (priority={priority})")
+        return AdmissionTicket(self, estimated_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for w in self._waiters if not w[2].done()),
+            "max_concurrency": self.max_concurrency,
+            "requests_available": round(self.requests.tokens, 1),
+            "tokens_available": round(self.tokens.tokens, 1),
+            "admitted": self.admitted,
+            "timed_out": self.timed_out,
+            "avg_wait": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+        }
+
+
+class LLMGovernor:
+    """
+    Registry of per-model governors (limits from Settings, overridable per model via LLM_MODEL_LIMITS).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        rpm: int,
+        tpm: int,
+        max_wait: Optional[float],
+        model_limits: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.model_limits = model_limits or {}
+        self._models: Dict[str, ModelGovernor] = {}
+
+    def for_model(self, model: str) -> ModelGovernor:
+        gov = self._models.get(model)
+        if gov is None:
+            limits = self.model_limits.get(model, {})
+            gov = ModelGovernor(
+                model,
+                max_concurrency=limits.get("max_concurrency", self.max_concurrency),
+                rpm=limits.get("rpm", self.rpm),
+                tpm=limits.get("tpm", self.tpm),
+            )
+            self._models[model] = gov
+        return gov
+
+    async def acquire(self, model: str, priority: int, estimated_tokens: int) -> AdmissionTicket:
+        return await self.for_model(model).acquire(priority, estimated_tokens, self.max_wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: gov.stats() for model, gov in self._models.items()}
+
+
+def estimate_request_tokens(
+    messages: List[Dict[str, Any]], max_tokens: Optional[int], model: Optional[str] = None
+) -> int:
+    """
+    برآورد توکن برای TPM: توکن‌های ورودی (tokenizer مدل، memoized) + سقف خروجی.
+    مقدار واقعی پس از پاسخ با AdmissionTicket.settle اصلاح می‌شود.
+    """
+    return count_message_tokens(messages, model) + (max_tokens or 0)
+
+
+governor = LLMGovernor(
+    max_concurrency=settings.LLM_MAX_CONCURRENCY_PER_MODEL,
+    rpm=settings.LLM_RPM_LIMIT,
+    tpm=settings.LLM_TPM_LIMIT,
+    max_wait=settings.LLM_ADMISSION_MAX_WAIT,
+    model_limits=settings.LLM_MODEL_LIMITS,
+)
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from openai import RateLimitError
+
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.core.config import settings
+from app.llm.latency import LatencyTracker, latency_tracker
+from app.llm.resilience import CircuitBreaker, CircuitOpenError, is_endpoint_failure, resilience
+
+logger = logging.getLogger(__name__)
+
+Target = Tuple[str, str]  # (base_url, api_key)
+RunAttempt = Callable[[str, str], Awaitable[LLMCallResult]]
+
+
+class Provider:
+    """One OpenAI-compatible endpoint of the provider pool."""
+
+    def __init__(self, name: str, base_url: str, api_key: Optional[str] = None, models: Optional[List[str]] = None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = models or []
+
+    def supports(self, model: str) -> bool:
+        return not self.models or model in self.models
+
+
+class ProviderPool:
+    """
+    Endpoints that can serve the same chat completion request (Settings.LLM_PROVIDERS).
+
+    - The caller's base_url is always the primary
+    - Secondaries are the other providers that serve the model, healthy breakers first
+    """
+
+    def __init__(self, providers: List[Provider]):
+        self.providers = providers
+
+    @classmethod
+    def from_settings(cls) -> "ProviderPool":
+        providers = [
+            Provider(
+                name=p.get("name") or p["base_url"],
+                base_url=p["base_url"],
+                api_key=p.get("api_key"),
+                models=p.get("models"),
+            )
+            for p in settings.LLM_PROVIDERS
+        ]
+        if not providers:
+            providers = [Provider("default", settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY)]
+        return cls(providers)
+
+    def route(self, base_url: str, api_key: str, model: str) -> List[Target]:
+        secondaries = [
+            p for p in self.providers
+            if p.base_url != base_url and p.supports(model)
+        ]
+        # endpointهایی که breakerشان باز است آخر صف می‌روند
+        secondaries.sort(key=lambda p: resilience.breaker(p.base_url).state == CircuitBreaker.OPEN)
+        return [(base_url, api_key)] + [(p.base_url, p.api_key or api_key) for p in secondaries]
+
+
+def _should_fail_over(exc: BaseException) -> bool:
+    """خرابی/شلوغی endpoint ارزش امتحان provider دیگر را دارد؛ خطای درخواست (400، ...) نه."""
+    return isinstance(exc, (CircuitOpenError, RateLimitError)) or is_endpoint_failure(exc)
+
+
+async def _with_first_chunk(result: LLMCallResult) -> LLMCallResult:
+    """
+    - Wait for the first chunk of a stream (time-to-first-token) and put it back in front
+    """
+    stream = result.stream_data
+    try:
+        first: Optional[str] = await stream.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await stream.aclose()
+        raise
+
+    async def replay() -> AsyncGenerator[str, None]:
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    result.stream_data = replay()
+    return result
+
+
+async def _discard(task: asyncio.Task) -> None:
+    """بازنده را لغو می‌کند؛ اگر همزمان یک stream باز برگردانده بود، آن را می‌بندد."""
+    task.cancel()
+    try:
+        result = await task
+    except BaseException:
+        return
+    if result.stream_data is not None:
+        await result.stream_data.aclose()
+
+
+class HedgedCaller:
+    """
+    Hedged requests and failover across the provider pool.
+
+    - The primary is called first; if it has not answered (first token for streams) within
+      the hedge delay (observed p95 of that endpoint/model), the next provider is called too
+    - The first successful answer wins; the other attempts are cancelled
+    - An endpoint failure (5xx, connection, 429, open circuit) fails over to the next provider at once
+    - Hedges are capped at `max_ratio` of calls so a slow provider cannot double the load
+    """
+
+    def __init__(
+        self,
+        tracker: LatencyTracker,
+        enabled: bool = True,
+        percentile: float = 0.95,
+        default_delay: float = 4.0,
+        min_delay: float = 0.5,
+        max_ratio: float = 0.1,
+    ):
+        self.tracker = tracker
+        self.enabled = enabled
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.budget_exhausted = 0
+
+    def hedge_delay(self, base_url: str, model: str) -> float:
+        observed = self.tracker.percentile(base_url, model, self.percentile)
+        if observed is None:
+            return self.default_delay
+        return max(self.min_delay, observed)
+
+    def _hedge_allowed(self) -> bool:
+        if self.hedged < self.max_ratio * self.calls:
+            return True
+        self.budget_exhausted += 1
+        return False
+
+    async def call(self, model: str, targets: List[Target], run: RunAttempt, stream: bool) -> LLMCallResult:
+        """
+        - Run `run(base_url, api_key)` on `targets` (primary first) with hedging/failover
+        - Raises the primary's error if every attempt failed
+        """
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+
+        async def attempt(base_url: str, api_key: str) -> LLMCallResult:
+            started = loop.time()
+            try:
+                result = await run(base_url, api_key)
+                if stream and result.stream_data is not None:
+                    result = await _with_first_chunk(result)
+            except asyncio.CancelledError:
+                # بازنده hedge: پاسخ دست‌کم این‌قدر طول می‌کشید؛ حذفش p95 را به سمت سریع‌ها می‌برد
+                self.tracker.record(base_url, model, loop.time() - started, censored=True)
+                raise
+            self.tracker.record(base_url, model, loop.time() - started)
+            result.provider = base_url
+            return result
+
+        if not self.enabled or len(targets) == 1:
+            return await attempt(*targets[0])
+
+        pending: Dict[asyncio.Task, int] = {}
+        errors: Dict[int, BaseException] = {}  # اندیس target → خطا
+        next_target = 0
+        can_hedge = True
+
+        def launch() -> None:
+            nonlocal next_target
+            pending[asyncio.ensure_future(attempt(*targets[next_target]))] = next_target
+            next_target += 1
+
+        launch()
+        try:
+            while True:
+                timeout = None
+                if can_hedge and next_target < len(targets):
+                    timeout = self.hedge_delay(targets[next_target - 1][0], model)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if self._hedge_allowed():
+                        self.hedged += 1
+                        logger.info(
+                            f"LLM hedge: no answer from {targets[next_target - 1][0]} after {timeout:.2f}s, "
+                            f"also trying {targets[next_target][0]}"
+                        )
+                        launch()
+                    else:
+                        can_hedge = False
+                    continue
+
+                for task in done:
+                    index = pending.pop(task)
+                    if task.cancelled():
+                        continue
+                    exc = task.exception()
+                    if exc is None:
+                        if index > 0:
+                            self.hedge_wins += 1
+                        return task.result()
+                    if not _should_fail_over(exc):
+                        raise exc
+                    errors[index] = exc
+                    logger.warning(f"LLM attempt on {targets[index][0]} failed: {exc}")
+
+                if not pending:
+                    if next_target >= len(targets):
+                        # همه تلاش‌ها شکست خورده‌اند: خطای primary (اندیس 0)، نه اولین خطای رسیده
+                        raise errors[0]
+                    self.failovers += 1
+                    launch()
+        finally:
+            for task in list(pending):
+                await _discard(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "budget_exhausted": self.budget_exhausted,
+            "latency": self.tracker.stats(),
+        }
+
+
+provider_pool = ProviderPool.from_settings()
+
+hedger = HedgedCaller(
+    latency_tracker,
+    enabled=settings.LLM_HEDGE_ENABLED,
+    percentile=settings.LLM_HEDGE_PERCENTILE,
+    default_delay=settings.LLM_HEDGE_DEFAULT_DELAY,
+    min_delay=settings.LLM_HEDGE_MIN_DELAY,
+    max_ratio=settings.LLM_HEDGE_MAX_RATIO,
+)
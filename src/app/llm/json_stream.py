@@ -0,0 +1,238 @@
+import json
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+JSONPath = Tuple[Union[str, int], ...]
+
+# وضعیت‌های هر سطح (object / array) در حین پارس
+_KEY_OR_END = "key_or_end"    # بعد از '{'
+_KEY = "key"                  # بعد از ',' در object
+_COLON = "colon"
+_VALUE = "value"
+_VALUE_OR_END = "value_or_end"  # بعد از '['
+_COMMA_OR_END = "comma_or_end"
+
+_WHITESPACE = " \t\r\n"
+_SCALAR_CHARS = set("0123456789+-.eEtruefalsn")
+
+
+class JSONStreamError(ValueError):
+    """The streamed text is not (the prefix of) a valid JSON document."""
+
+    def __init__(self, message: str, position: int):
+        super().__init__(f"{message} at position {position}")
+        self.position = position
+
+
+class JSONEvent:
+    """
+    - kind="key": a key at depth <= max_depth was read (`path` ends with it, value is None)
+    - kind="value": the container at `path` just closed; `value` is the parsed object/array
+    """
+
+    __slots__ = ("kind", "path", "value")
+
+    def __init__(self, kind: str, path: JSONPath, value: Any = None):
+        self.kind = kind
+        self.path = path
+        self.value = value
+
+    def __repr__(self):
+        return f"JSONEvent({self.kind}, {self.path})"
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "state", "path", "key", "index")
+
+    def __init__(self, kind: str, start: int, path: JSONPath):
+        self.kind = kind
+        self.start = start
+        self.state = _KEY_OR_END if kind == "{" else _VALUE_OR_END
+        self.path = path
+        self.key: Optional[str] = None
+        self.index = 0
+
+    def child_path(self) -> JSONPath:
+        return self.path + ((self.key,) if self.kind == "{" else (self.index,))
+
+
+class IncrementalJSONParser:
+    """
+    Push parser for one JSON document arriving in chunks (e.g. LLM stream deltas).
+
+    - `feed(chunk)` returns the events completed by that chunk
+    - Objects/arrays at depth <= `max_depth` are emitted as soon as they close (root = depth 0)
+    - Any structural error raises JSONStreamError immediately, so the caller can stop the stream
+    """
+
+    def __init__(self, max_depth: int = 2):
+        self.max_depth = max_depth
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._root_done = False
+        self._in_string = False
+        self._escape = False
+        self._token_start: Optional[int] = None  # شروع رشته یا scalar جاری
+        self._in_scalar = False
+
+    @property
+    def done(self) -> bool:
+        return self._root_done
+
+    def feed(self, chunk: str) -> List[JSONEvent]:
+        self._buf += chunk
+        events: List[JSONEvent] = []
+        buf = self._buf
+        i = self._pos
+        end = len(buf)
+        while i < end:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._string_done(buf[self._token_start:i + 1], i, events)
+                i += 1
+                continue
+            if self._in_scalar:
+                if ch in _SCALAR_CHARS:
+                    i += 1
+                    continue
+                self._scalar_done(buf[self._token_start:i], i)
+                # کاراکتر جداکننده دوباره پردازش می‌شود
+            self._structural(ch, i, events)
+            i += 1
+        self._pos = end
+        return events
+
+    def close(self) -> List[JSONEvent]:
+        """End of stream: the document must be complete."""
+        events: List[JSONEvent] = []
+        if self._in_scalar:
+            self._scalar_done(self._buf[self._token_start:], len(self._buf))
+        if not self._root_done:
+            raise JSONStreamError("Unexpected end of JSON document", len(self._buf))
+        return events
+
+    # --- helpers ---
+
+    def _expecting_value(self) -> bool:
+        if not self._stack:
+            return not self._root_done
+        return self._stack[-1].state in (_VALUE, _VALUE_OR_END)
+
+    def _value_done(self) -> None:
+        if self._stack:
+            self._stack[-1].state = _COMMA_OR_END
+        else:
+            self._root_done = True
+
+    def _string_done(self, raw: str, i: int, events: List[JSONEvent]) -> None:
+        frame = self._stack[-1] if self._stack else None
+        if frame is not None and frame.state in (_KEY, _KEY_OR_END):
+            try:
+                frame.key = json.loads(raw)
+            except json.JSONDecodeError:
+                raise JSONStreamError("Invalid object key", i)
+            frame.state = _COLON
+            if len(frame.path) < self.max_depth:
+                events.append(JSONEvent("key", frame.child_path()))
+            return
+        self._value_done()
+
+    def _scalar_done(self, raw: str, i: int) -> None:
+        self._in_scalar = False
+        try:
+            json.loads(raw)
+        except json.JSONDecodeError:
+            raise JSONStreamError(f"Invalid literal {raw[:20]!r}", i)
+        self._value_done()
+
+    def _structural(self, ch: str, i: int, events: List[JSONEvent]) -> None:
+        if ch in _WHITESPACE:
+            return
+        frame = self._stack[-1] if self._stack else None
+
+        if self._expecting_value():
+            if ch in "{[":
+                path = frame.child_path() if frame is not None else ()
+                self._stack.append(_Frame(ch, i, path))
+                return
+            if ch == '"':
+                self._in_string = True
+                self._token_start = i
+                return
+            if ch in _SCALAR_CHARS:
+                self._in_scalar = True
+                self._token_start = i
+                return
+            if ch == "]" and frame is not None and frame.state == _VALUE_OR_END:
+                self._close(i, events)
+                return
+            raise JSONStreamError(f"Unexpected {ch!r}, expected a value", i)
+
+        if frame is None:
+            raise JSONStreamError(f"Unexpected {ch!r} after the end of the document", i)
+
+        if frame.state in (_KEY, _KEY_OR_END):
+            if ch == '"':
+                self._in_string = True
+                self._token_start = i
+                return
+            if ch == "}" and frame.state == _KEY_OR_END:
+                self._close(i, events)
+                return
+            raise JSONStreamError(f"Unexpected {ch!r}, expected an object key", i)
+
+        if frame.state == _COLON:
+            if ch != ":":
+                raise JSONStreamError(f"Unexpected {ch!r}, expected ':'", i)
+            frame.state = _VALUE
+            return
+
+        # _COMMA_OR_END
+        if ch == ",":
+            if frame.kind == "{":
+                frame.state = _KEY
+            else:
+                frame.index += 1
+                frame.state = _VALUE
+            return
+        if (ch == "}" and frame.kind == "{") or (ch == "]" and frame.kind == "["):
+            self._close(i, events)
+            return
+        raise JSONStreamError(f"Unexpected {ch!r}, expected ',' or closing bracket", i)
+
+    def _close(self, i: int, events: List[JSONEvent]) -> None:
+        frame = self._stack.pop()
+        if len(frame.path) <= self.max_depth:
+            try:
+                value = json.loads(self._buf[frame.start:i + 1])
+            except json.JSONDecodeError as e:
+                raise JSONStreamError(f"Invalid JSON value ({e.msg})", i)
+            events.append(JSONEvent("value", frame.path, value))
+        self._value_done()
+
+
+def iter_json_events(chunks: Iterator[str], max_depth: int = 2) -> Iterator[JSONEvent]:
+    """نسخه همگام: رویدادهای یک سند JSON از روی chunkهای متنی."""
+    parser = IncrementalJSONParser(max_depth)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+async def aiter_json_events(chunks: AsyncIterator[str], max_depth: int = 2) -> AsyncIterator[JSONEvent]:
+    """
+    - Events of one JSON document streamed as text chunks (e.g. LLMCallResult.stream_data)
+    - Raises JSONStreamError as soon as the structure is malformed
+    """
+    parser = IncrementalJSONParser(max_depth)
+    async for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
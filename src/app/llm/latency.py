@@ -0,0 +1,64 @@
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+LatencyKey = Tuple[str, str]  # (base_url, model)
+Sample = Tuple[float, bool]  # (seconds, censored)
+
+
+class LatencyTracker:
+    """
+    Sliding window of observed LLM latencies per (base_url, model).
+
+    - For streams the sample is time-to-first-token, otherwise time to the full response
+    - Attempts cancelled before answering (hedge losers) are censored samples: the latency was at least that long
+    - Percentiles are computed on demand over the last `window` samples (Kaplan-Meier with censored samples)
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[LatencyKey, Deque[Sample]] = {}
+
+    def record(self, base_url: str, model: str, seconds: float, censored: bool = False) -> None:
+        samples = self._samples.get((base_url, model))
+        if samples is None:
+            samples = deque(maxlen=self.window)
+            self._samples[(base_url, model)] = samples
+        samples.append((seconds, censored))
+
+    def percentile(self, base_url: str, model: str, q: float) -> Optional[float]:
+        """
+        - q-th percentile (0..1) of the window; None until `min_samples` samples were seen
+        """
+        samples = self._samples.get((base_url, model))
+        if not samples or len(samples) < self.min_samples:
+            return None
+        # در زمان برابر، پاسخ‌ها پیش از نمونه‌های سانسورشده می‌آیند (False < True)
+        ordered = sorted(samples)
+        at_risk = len(ordered)
+        survival = 1.0
+        for seconds, censored in ordered:
+            if not censored:
+                survival *= 1.0 - 1.0 / at_risk
+                if 1.0 - survival >= q - 1e-9:
+                    return seconds
+            at_risk -= 1
+        # بیشتر از 1-q نمونه‌ها سانسورشده‌اند: بزرگ‌ترین زمان دیده‌شده کران پایین percentile است
+        return ordered[-1][0]
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for (base_url, model), samples in self._samples.items():
+            out.setdefault(base_url, {})[model] = {
+                "samples": len(samples),
+                "p50": _round(self.percentile(base_url, model, 0.5)),
+                "p95": _round(self.percentile(base_url, model, 0.95)),
+            }
+        return out
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+latency_tracker = LatencyTracker()
@@ -1,7 +1,11 @@
 from openai import OpenAI
-from typing import List, Optional, Union, Dict, Any, AsyncGenerator
+from typing import List, Optional, Union, Dict, Any, AsyncGenerator, Awaitable, Callable, Sequence
+import asyncio
+import inspect
 import json
 import logging
+import time
+import weakref
 
 logger = logging.getLogger(__name__)
 ######################################## LLM v1 ######################################
@@ -28,187 +32,303 @@ def llm(prompt, llm_model_name = "gpt-4o-mini"):
 
 ######################################## LLM v2 ######################################
 from openai import (
-    AsyncOpenAI,
     APIError,
-    APIConnectionError,    RateLimitError,
+    APIConnectionError,    APITimeoutError,    RateLimitError,
     AuthenticationError,
     BadRequestError
 )
 import json # برای استفاده در مثال
+import httpx
 from app.api.v1.schemas.llm_result import LLMCallResult
+from app.core.config import settings
+from app.llm.client_pool import client_pool
+from app.llm.fingerprint import request_fingerprint
+from app.llm.response_cache import response_cache
+from app.llm.resilience import resilience, CircuitOpenError
+from app.llm.governor import governor, estimate_request_tokens, GovernorTimeoutError, PRIORITY_NORMAL, PRIORITY_LOW
+from app.llm.single_flight import single_flight
+from app.llm.hedging import hedger, provider_pool
+from app.llm.stream_metrics import StreamTimer, stream_stats
+from app.llm.timeouts import adaptive_timeouts, DeadlineExceededError, FIRST_TOKEN, TOTAL
+from app.llm.tokenizer import count_tokens, count_message_tokens
+
+
+def _result_from_response(
+    response_data: Dict[str, Any],
+    usage_data: Optional[Dict[str, Any]],
+    n: int,
+    return_full_response_dict: bool,
+    cached: bool = False,
+    provider: Optional[str] = None,
+) -> LLMCallResult:
+    """ساخت LLMCallResult از دیکشنری پاسخ API (مشترک بین پاسخ زنده و پاسخ cache شده)."""
+    message = "موفقیت‌آمیز (cache)" if cached else "موفقیت‌آمیز"
+    choices = response_data.get("choices") or []
+    # درخواست‌های tool اولین choice (OpenAI tool calling)
+    tool_calls = ((choices[0].get("message") or {}).get("tool_calls") or None) if choices else None
+    if return_full_response_dict:
+        return LLMCallResult(
+            success=True,
+            status_code=200,
+            message=message,
+            full_response_data=response_data,
+            usage=usage_data,
+            cached=cached,
+            provider=provider,
+            tool_calls=tool_calls
+        )
 
-async def llm_async(
-    # ورودی محتوا: یا لیست messages یا prompt + system_message
-    messages: Optional[List[Dict[str, str]]] = None,
-    prompt: Optional[str] = None,    
-    system_message: str = "شما یک دستیار هوشمند هستید که باید بر اساس ورودی کاربر پاسخ مناسب ارائه دهید.",
-
-    # تنظیمات مدل و API
-    llm_model_name: str = "gpt-4o-mini",  # مدل پیش‌فرض شما
-    api_key: Optional[str] = None, # "aa-..." مقدار پیش‌فرض شما بود، بهتر است از config خوانده شود
-    base_url: Optional[str] = "https://api.avalai.ir/v1", # base_url پیش‌فرض شما
+    # استخراج محتوا براساس n
+    if n == 1 and choices:
+        content_result = (choices[0].get("message") or {}).get("content")
+    else:
+        content_result = [
+            c["message"]["content"]
+            for c in choices
+            if c.get("message") and c["message"].get("content") is not None
+        ]
+
+    return LLMCallResult(
+        success=True,
+        status_code=200,
+        message=message,
+        content=content_result,
+        usage=usage_data,
+        cached=cached,
+        provider=provider,
+        tool_calls=tool_calls
+    )
 
-    # پارامترهای اصلی LLM
-    temperature: float = 0.7,
-    max_tokens: Optional[int] = 2048, # افزایش مقدار پیش‌فرض برای JSONهای طولانی‌تر    
-    top_p: float = 1.0,
-    n: int = 1,  # تعداد پاسخ‌های مورد نظر
-    stop: Optional[Union[str, List[str]]] = None,
-    frequency_penalty: float = 0.0,
-    presence_penalty: float = 0.0,    
-    seed: Optional[int] = None,  # برای نتایج قابل تکرار
-    response_format: Optional[Dict[str, str]] = None,  # مثال: {"type": "json_object"}
 
-    # Streaming
-    stream: bool = False,
-    stream_options: Optional[Dict[str, Any]] = None, # مثال: {"include_usage": True} برای دریافت usage در stream
+def _response_from_stream(
+    model: str,
+    content: str,
+    finish_reason: Optional[str],
+    usage: Optional[Dict[str, Any]],
+    tool_calls: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """دیکشنری پاسخ (هم‌شکل chat.completion) از متن کامل یک stream، برای ذخیره در cache."""
+    message: Dict[str, Any] = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": finish_reason,
+        }],
+        "usage": usage,
+    }
+
+
+def _merge_tool_call_deltas(acc: Dict[int, Dict[str, Any]], deltas: Sequence[Any]) -> None:
+    """تکه‌های tool_calls یک chunk از stream را (به ازای index) به tool callهای کامل اضافه می‌کند."""
+    for delta in deltas:
+        call = acc.setdefault(delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+        if delta.id:
+            call["id"] = delta.id
+        if delta.function is not None:
+            call["function"]["name"] += delta.function.name or ""
+            call["function"]["arguments"] += delta.function.arguments or ""
+
+
+def _cached_stream_result(cached_entry: Dict[str, Any]) -> LLMCallResult:
+    """پاسخ cache شده برای درخواست stream: کل متن در یک chunk."""
+    choices = cached_entry["full_response_data"].get("choices") or []
+    message = (choices[0].get("message") or {}) if choices else {}
+    content = message.get("content") or ""
+
+    async def replay() -> AsyncGenerator[str, None]:
+        if content:
+            yield content
+
+    return LLMCallResult(
+        success=True,
+        status_code=200,
+        message="Streaming آغاز شد (cache)",
+        stream_data=replay(),
+        usage=cached_entry.get("usage"),
+        cached=True,
+        tool_calls=message.get("tool_calls") or None
+    )
 
-    # تنظیمات کلاینت و درخواست
-    timeout: Optional[float] = 180.0,  # زمان وقفه برای درخواست API (ثانیه)
 
-    # کنترل خروجی
-    return_full_response_dict: bool = True  # اگر stream نباشد، آیا دیکشنری کامل پاسخ API برگردانده شود
-    ) -> LLMCallResult:    
+def _with_completion_callback(
+    result: LLMCallResult,
+    callback: Optional[Callable[[LLMCallResult], Union[None, Awaitable[None]]]],
+) -> LLMCallResult:
+    """stream_data را طوری می‌پیچد که پس از اتمام کامل stream، callback با همین result صدا زده شود."""
+    if callback is None or result.stream_data is None:
+        return result
+    stream = result.stream_data
+
+    async def notify() -> AsyncGenerator[str, None]:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        try:
+            ret = callback(result)
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception as e:
+            logger.warning(f"Stream completion callback failed: {e}")
+
+    result.stream_data = notify()
+    return result
+
+
+async def _execute_request(
+    client,
+    base_url: str,
+    request_params: Dict[str, Any],
+    priority: int,
+    cache_key: Optional[str],
+    timeout: Optional[float] = None,
+) -> LLMCallResult:
     """
-    یک تابع پیشرفته و جامع ناهمگام (asynchronous) برای فراخوانی مدل‌های زبان بزرگ (LLM)
-    سازگار با OpenAI API.
-
-    نکات:
-    - `api_key` و `base_url`: بهتر است این مقادیر از یک سیستم پیکربندی مرکزی (مانند settings در پروژه شما)
-      تامین شوند، اما برای انعطاف‌پذیری به عنوان پارامتر نیز پذیرفته می‌شوند.
-    - Streaming با `n > 1`: در حالت stream، این تابع به طور پیش‌فرض فقط محتوای اولین choice را stream می‌کند.
-      پردازش stream برای چندین choice به طور همزمان پیچیده‌تر است.
-    - `max_tokens`: اگر `None` باشد، مدل از مقدار پیش‌فرض خود استفاده می‌کند.
+    اجرای واقعی یک درخواست: فراخوانی با retry/circuit breaker؛ هر تلاش جداگانه در governor پذیرش می‌شود.
+    - ظرفیت governor در backoff و Retry-After بین تلاش‌ها آزاد است
+    - non-stream: full_response_data و usage (و ذخیره در cache در صورت وجود cache_key)
+    - stream: stream_data؛ ظرفیت governor تا پایان stream نگه داشته می‌شود و متن کامل در cache ذخیره می‌شود
+    - timeoutها (connect / first token / total) از تأخیرهای دیده‌شده همین مدل و اندازه prompt؛ `timeout` سقف است
     """
-    if not api_key: # یا بررسی کنید که مقدار placeholder نباشد
-        logger.error("کلید API (api_key) پیکربندی نشده است.")
-        return LLMCallResult(success=False, status_code=401, message="خطای پیکربندی", error_detail="کلید API تعریف نشده است.")
-
-    if not messages and not prompt:
-        logger.error("باید پارامتر 'messages' یا 'prompt' ارائه شود.")
-        return LLMCallResult(success=False, status_code=400, message="خطای ورودی", error_detail="هیچ ورودی ارائه نشده است.")
-
-    if messages and prompt:
-        logger.warning("هر دو پارامتر 'messages' و 'prompt' ارائه شده‌اند. از 'messages' استفاده خواهد شد.")
-
-    actual_messages: List[Dict[str, str]]
-    if messages:
-        actual_messages = messages
-    else:
-        actual_messages = [{"role": "system", "content": system_message}]
-        if prompt: # به دلیل بررسی قبلی، اگر messages نباشد، prompt حتما وجود دارد
-            actual_messages.append({"role": "user", "content": prompt})
-        else: # این حالت نباید رخ دهد، اما برای اطمینان
-            return LLMCallResult(success=False, status_code=400, message="خطای ورودی", error_detail="Prompt خالی است.")
-
-    try:        
-        client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            timeout=timeout
-        )
-
-        request_params = {
-            "model": llm_model_name,
-            "messages": actual_messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p,
-            "n": n,
-            "stop": stop,
-            "frequency_penalty": frequency_penalty,
-            "presence_penalty": presence_penalty,
-            "seed": seed,
-            "stream": stream,
-        }        
-        if response_format:
-            request_params["response_format"] = response_format
-        if stream and stream_options:
-            request_params["stream_options"] = stream_options
-        
-        # حذف کلیدهایی با مقدار None اگر API به آنها حساس است (معمولاً کلاینت OpenAI مدیریت می‌کند)
-        # request_params = {k: v for k, v in request_params.items() if v is not None}
-
-
-        logger.info(f"ارسال درخواست به LLM: model={llm_model_name}, stream={stream}, تعداد پیام‌ها={len(actual_messages)}")
-        # در محیط عملیاتی، لاگ کردن کامل پیام‌ها (prompt) باید با احتیاط انجام شود.
-        # logger.debug(f"پارامترهای درخواست LLM: {request_params}")
+    model = request_params["model"]
+    is_stream = bool(request_params.get("stream"))
+    prompt_tokens = count_message_tokens(request_params["messages"], model)
+    limits = adaptive_timeouts.limits(model, prompt_tokens, timeout, request_params.get("max_tokens"))
+    estimated_tokens = estimate_request_tokens(
+        request_params["messages"], request_params.get("max_tokens"), request_params["model"]
+    )
+    attempt_at = 0.0
+    ticket = None
+
+    async def attempt():
+        # زمان هر تلاش جداگانه (بدون backoff بین retryها) برای نمونه‌های timeout ثبت می‌شود
+        nonlocal attempt_at, ticket
+        # پذیرش در governor: هم‌روندی و RPM/TPM هر مدل، به ترتیب اولویت
+        ticket = await governor.acquire(model, priority, estimated_tokens)
+        attempt_at = time.monotonic()
+        try:
+            try:
+                return await client.chat.completions.create(  # type: ignore
+                    **request_params, timeout=adaptive_timeouts.http_timeout(limits, is_stream)
+                )
+            except APITimeoutError as e:
+                # timeout خواندن همان مهلتی است که خودمان گذاشته‌ایم؛ فقط connect timeout خرابی endpoint است
+                if isinstance(e.__cause__, httpx.ConnectTimeout):
+                    raise
+                limit = limits["first_token"] if is_stream else limits["total"]
+                raise DeadlineExceededError(model, limit, "first token" if is_stream else "response") from e
+        except BaseException as e:
+            # ظرفیت پیش از backoff آزاد می‌شود؛ خطای بدون پاسخ (نه timeout) رزرو TPM را هم برمی‌گرداند
+            if not isinstance(e, (APITimeoutError, DeadlineExceededError)):
+                ticket.settle(0)
+            ticket.release()
+            raise
+
+    ticket_owned_by_stream = False
+    try:
+        # فراخوانی API (retry با backoff و circuit breaker برای هر base_url)
+        completion = await resilience.call(base_url, attempt)
 
-        completion = await client.chat.completions.create(**request_params) # type: ignore
+        if is_stream:
+            result = LLMCallResult(
+                success=True,
+                status_code=200,
+                message="Streaming آغاز شد"
+            )
 
-        if stream:
-            async def stream_generator() -> AsyncGenerator[str, None, None]:
-                accumulated_content = ""
-                usage_from_stream = None
+            async def stream_generator() -> AsyncGenerator[str, None]:
+                parts: List[str] = []
+                tool_parts: Dict[int, Dict[str, Any]] = {}
+                finish_reason = None
+                timer = StreamTimer(attempt_at)
+                first_chunk_seen = False
                 try:
-                    async for chunk in completion: # type: ignore
-                        if stream_options and stream_options.get("include_usage") and hasattr(chunk, 'usage') and chunk.usage:
-                            usage_from_stream = chunk.usage.model_dump()
-                            # logger.debug(f"اطلاعات Usage از stream دریافت شد: {usage_from_stream}")
-                            # توجه: اطلاعات usage معمولا در آخرین chunk می‌آید.
-                            # این تابع ژنراتور فقط رشته‌های محتوا را yield می‌کند،
-                            # بنابراین usage باید توسط مصرف‌کننده ژنراتور جداگانه بررسی شود یا پس از اتمام استریم.
-
-                        if chunk.choices:
-                            content_delta = chunk.choices[0].delta.content
-                            if content_delta:
-                                accumulated_content += content_delta                                
-                                yield content_delta
-
-                    # logger.debug(f"محتوای کامل stream شده (اولیه): {accumulated_content[:200]}")
+                    async for chunk in completion:  # type: ignore
+                        elapsed = time.monotonic() - attempt_at
+                        if not first_chunk_seen:
+                            first_chunk_seen = True
+                            adaptive_timeouts.record(model, prompt_tokens, FIRST_TOKEN, elapsed)
+                        if elapsed > limits["total"]:
+                            # stream که قطره‌قطره ادامه دارد هم worker را نگه می‌دارد
+                            raise DeadlineExceededError(model, limits["total"], "stream")
+                        # usage (با include_usage) در آخرین chunk و بدون choices می‌آید
+                        if getattr(chunk, "usage", None):
+                            result.usage = chunk.usage.model_dump()
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if chunk.choices[0].delta.tool_calls:
+                            _merge_tool_call_deltas(tool_parts, chunk.choices[0].delta.tool_calls)
+                        # استخراج دلتا
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            timer.on_chunk()
+                            parts.append(delta)
+                            yield delta
+                    if tool_parts:
+                        result.tool_calls = [tool_parts[i] for i in sorted(tool_parts)]
+                    # زمان‌بندی stream؛ توکن خروجی از usage آخرین chunk، وگرنه با tokenizer
+                    completion_tokens = (result.usage or {}).get("completion_tokens")
+                    if completion_tokens is None:
+                        completion_tokens = count_tokens("".join(parts), request_params["model"])
+                    result.stream_metrics = timer.finish(completion_tokens)
+                    adaptive_timeouts.record(model, prompt_tokens, TOTAL, time.monotonic() - attempt_at)
+                    stream_stats.record(request_params["model"], result.stream_metrics)
+                    if cache_key:
+                        # فقط stream کامل (نه رهاشده) در cache ذخیره می‌شود
+                        await response_cache.set(cache_key, {
+                            "full_response_data": _response_from_stream(
+                                request_params["model"], "".join(parts), finish_reason, result.usage,
+                                result.tool_calls
+                            ),
+                            "usage": result.usage,
+                        })
                 except Exception as e_stream:
-                    logger.error(f"خطا در حین پردازش stream از LLM: {e_stream}", exc_info=True)
-                    raise # خطا مجددا ارسال می‌شود تا توسط مصرف‌کننده ژنراتور مدیریت شود
-
-            logger.info("فراخوانی LLM موفقیت‌آمیز بود، پاسخ به صورت stream ارائه می‌شود.")
-            # برای سادگی، اطلاعات usage مستقیماً از طریق LLMCallResult برای stream برگردانده نمی‌شود.            # مصرف‌کننده می‌تواند آخرین chunk را برای usage بررسی کند اگر stream_options فعال باشد.
-            return LLMCallResult(success=True, status_code=200, message="Streaming آغاز شد", stream_data=stream_generator())
-
-        else:  # حالت غیر stream
-            usage_data = completion.usage.model_dump() if completion.usage else None
-            logger.info(f"فراخوانی LLM موفقیت‌آمیز بود. Usage: {usage_data}")
-
-            if return_full_response_dict:
-                return LLMCallResult(success=True, status_code=200, message="موفقیت‌آمیز",
-                                     full_response_data=completion.model_dump(), usage=usage_data)
-            else:
-                if n == 1 and completion.choices:
-                    content_result = completion.choices[0].message.content
-                elif n > 1 and completion.choices:
-                    content_result = [choice.message.content for choice in completion.choices if choice.message and choice.message.content is not None]
-                else:
-                    content_result = None # یا یک رشته خالی اگر هیچ محتوایی وجود نداشت
-                    if not completion.choices:
-                         logger.warning("پاسخ LLM شامل هیچ choice ای نبود.")
-
-
-                return LLMCallResult(success=True, status_code=200, message="موفقیت‌آمیز",
-                                     content=content_result, usage=usage_data)
-
-    except APIConnectionError as e:
-        logger.error(f"خطای اتصال به OpenAI API: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=getattr(e, 'status_code', 503), message="خطای اتصال به API", error_detail=str(e))
-    except RateLimitError as e:
-        logger.error(f"خطای محدودیت تعداد درخواست (Rate Limit) OpenAI API: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=getattr(e, 'status_code', 429), message="محدودیت تعداد درخواست", error_detail=str(e))
-    except AuthenticationError as e:
-        logger.error(f"خطای احراز هویت OpenAI API: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=getattr(e, 'status_code', 401), message="خطای احراز هویت", error_detail=str(e))
-    except BadRequestError as e: # شامل مواردی مانند مدل نامعتبر، طول زمینه بیش از حد و ...
-        logger.error(f"خطای درخواست نامعتبر (Bad Request) OpenAI API: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=getattr(e, 'status_code', 400), message="درخواست نامعتبر", error_detail=str(e))
-    except APIError as e:  # خطای عمومی OpenAI API
-        logger.error(f"خطای OpenAI API: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=getattr(e, 'status_code', 500), message="خطای API", error_detail=str(e))
-    except Exception as e:  # گرفتن سایر خطاهای پیش‌بینی نشده
-        logger.error(f"یک خطای پیش‌بینی نشده رخ داد: {e}", exc_info=True)
-        return LLMCallResult(success=False, status_code=500, message="خطای پیش‌بینی نشده", error_detail=str(e))
-
-
+                    logger.error(
+                        f"خطا در حین پردازش stream از LLM: {e_stream}",
+                        exc_info=True
+                    )
+                    raise
+                finally:
+                    # بستن اتصال upstream حتی اگر مصرف‌کننده زودتر رها کند
+                    await completion.close()
+                    ticket.settle((result.usage or {}).get("total_tokens"))
+                    ticket.release()
+
+            result.stream_data = stream_generator()
+            # اگر ژنراتور هرگز مصرف نشود، ظرفیت governor هنگام GC آزاد می‌شود
+            weakref.finalize(result.stream_data, ticket.release)
+            ticket_owned_by_stream = True
+            logger.info("Streaming response ready.")
+            return result
 
+        adaptive_timeouts.record(model, prompt_tokens, TOTAL, time.monotonic() - attempt_at)
+        usage_data = None
+        if getattr(completion, "usage", None):
+            usage_data = completion.usage.model_dump()
+        ticket.settle((usage_data or {}).get("total_tokens"))
+    finally:
+        if ticket is not None and not ticket_owned_by_stream:
+            ticket.release()
+
+    response_data = completion.model_dump()
+    if cache_key:
+        await response_cache.set(cache_key, {"full_response_data": response_data, "usage": usage_data})
+    return LLMCallResult(
+        success=True,
+        status_code=200,
+        message="موفقیت‌آمیز",
+        full_response_data=response_data,
+        usage=usage_data
+    )
 
 
-##########################################
 async def llm_async(
     # ورودی محتوا: یا لیست messages یا prompt + system_message
     messages: Optional[List[Dict[str, str]]] = None,
@@ -218,7 +338,7 @@ async def llm_async(
     # تنظیمات مدل و API
     llm_model_name: str = "gpt-4o-mini",  # مدل پیش‌فرض شما
     api_key: Optional[str] = None, # "aa-..." مقدار پیش‌فرض شما بود، بهتر است از config خوانده شود
-    base_url: Optional[str] = "https://api.avalai.ir/v1", # base_url پیش‌فرض شما
+    base_url: Optional[str] = settings.OPENAI_BASE_URL,
 
     # پارامترهای اصلی LLM
     temperature: float = 0.7,
@@ -231,15 +351,34 @@ async def llm_async(
     seed: Optional[int] = None,  # برای نتایج قابل تکرار
     response_format: Optional[Dict[str, str]] = None,  # مثال: {"type": "json_object"}
 
+    # Tool calling (OpenAI): tools=[{"type": "function", "function": {...}}]؛ درخواست‌های مدل در result.tool_calls
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[Union[str, Dict[str, Any]]] = None,  # "auto" / "none" / "required" / یک tool مشخص
+    parallel_tool_calls: Optional[bool] = None,
+
     # Streaming
     stream: bool = False,
-    stream_options: Optional[Dict[str, Any]] = None, # مثال: {"include_usage": True} برای دریافت usage در stream
+    stream_options: Optional[Dict[str, Any]] = None, # پیش‌فرض در stream: {"include_usage": True} برای دریافت usage
+    # پس از اتمام کامل stream با همان LLMCallResult (usage و stream_metrics پر شده) صدا زده می‌شود؛ sync یا async
+    on_stream_complete: Optional[Callable[["LLMCallResult"], Union[None, Awaitable[None]]]] = None,
 
     # تنظیمات کلاینت و درخواست
-    timeout: Optional[float] = 90.0,  # زمان وقفه برای درخواست API (ثانیه)
+    timeout: Optional[float] = settings.LLM_TIMEOUT,  # سقف زمان وقفه (ثانیه)؛ مقدار واقعی از app.llm.timeouts
 
     # کنترل خروجی
-    return_full_response_dict: bool = True  # اگر stream نباشد، آیا دیکشنری کامل پاسخ API برگردانده شود
+    return_full_response_dict: bool = True,  # اگر stream نباشد، آیا دیکشنری کامل پاسخ API برگردانده شود
+
+    # Cache (opt-in): فقط درخواست‌های قطعی (temperature پایین یا seed ثابت) cache می‌شوند
+    use_cache: bool = False,
+
+    # اولویت در صف governor (کمتر = زودتر)؛ مثلاً agentهای public با PRIORITY_HIGH
+    priority: int = PRIORITY_NORMAL,
+
+    # درخواست‌های یکسانِ هم‌زمان (همان fingerprint) یک فراخوانی upstream را به اشتراک بگذارند
+    coalesce: bool = True,
+
+    # hedge/failover روی provider pool (Settings.LLM_PROVIDERS)؛ base_url همیشه primary است
+    hedge: bool = True
 ) -> "LLMCallResult":
     """
     یک تابع پیشرفته و جامع ناهمگام (asynchronous) برای فراخوانی مدل‌های زبان بزرگ (LLM)
@@ -284,12 +423,10 @@ async def llm_async(
         actual_messages.append({"role": "user", "content": prompt or ""})
 
     try:
-        # ۴. ساخت کلاینت ناهمگام
-        client = AsyncOpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            timeout=timeout
-        )
+        # ۴. endpointها: primary (base_url) و در صورت hedge، سایر providerهای این مدل
+        targets = provider_pool.route(base_url, api_key, llm_model_name)
+        if not hedge:
+            targets = targets[:1]
 
         # ۵. آماده‌سازی پارامترهای درخواست
         request_params: Dict[str, Any] = {
@@ -307,76 +444,91 @@ async def llm_async(
         }
         if response_format:
             request_params["response_format"] = response_format
-        if stream and stream_options:
-            request_params["stream_options"] = stream_options
+        if tools:
+            request_params["tools"] = tools
+            if tool_choice is not None:
+                request_params["tool_choice"] = tool_choice
+            if parallel_tool_calls is not None:
+                request_params["parallel_tool_calls"] = parallel_tool_calls
+        if stream:
+            request_params["stream_options"] = stream_options or {"include_usage": True}
+
+        # کش پاسخ‌های قطعی (قبل از هر فراخوانی شبکه)
+        cache_key: Optional[str] = None
+        if use_cache and response_cache.is_cacheable(request_params):
+            cache_key = request_fingerprint(request_params)
+            cached_entry = await response_cache.get(cache_key)
+            if cached_entry is not None:
+                logger.info(f"LLM cache hit: model={llm_model_name}, key={cache_key[:12]}")
+                if stream:
+                    return _with_completion_callback(_cached_stream_result(cached_entry), on_stream_complete)
+                return _result_from_response(
+                    cached_entry["full_response_data"],
+                    cached_entry.get("usage"),
+                    n,
+                    return_full_response_dict,
+                    cached=True
+                )
 
         logger.info(
             f"ارسال درخواست به LLM: model={llm_model_name}, stream={stream}, "
             f"messages={len(actual_messages)}"
         )
 
-        # ۶. فراخوانی API
-        completion = await client.chat.completions.create(**request_params)  # type: ignore
+        # ۶. اجرای درخواست؛ درخواست‌های یکسانِ هم‌زمان یک فراخوانی upstream را به اشتراک می‌گذارند
+        async def run_on(target_url: str, target_key: str) -> LLMCallResult:
+            # کلاینت ناهمگام از pool مشترک (بدون handshake جدید در هر فراخوانی)
+            client = client_pool.get_client(target_url, target_key, timeout)
+            return await _execute_request(client, target_url, request_params, priority, cache_key, timeout)
+
+        async def execute() -> LLMCallResult:
+            return await hedger.call(llm_model_name, targets, run_on, stream)
+
+        if coalesce:
+            flight_key = f"{base_url}|{'stream' if stream else 'full'}|{request_fingerprint(request_params)}"
+            raw_result = await single_flight.do(flight_key, execute)
+        else:
+            raw_result = await execute()
 
         # ۷. حالت stream
         if stream:
-            async def stream_generator() -> AsyncGenerator[str, None]:
-                try:
-                    async for chunk in completion:  # type: ignore
-                        # استخراج دلتا
-                        delta = chunk.choices[0].delta.content
-                        if delta:
-                            yield delta
-                except Exception as e_stream:
-                    logger.error(
-                        f"خطا در حین پردازش stream از LLM: {e_stream}",
-                        exc_info=True
-                    )
-                    raise
-
-            logger.info("Streaming response ready.")
-            return LLMCallResult(
-                success=True,
-                status_code=200,
-                message="Streaming آغاز شد",
-                stream_data=stream_generator()
-            )
+            return _with_completion_callback(raw_result, on_stream_complete)
 
         # ۸. حالت non-stream
-        usage_data = None
-        if getattr(completion, "usage", None):
-            usage_data = completion.usage.model_dump()
-
-        logger.info(f"LLM call succeeded. Usage: {usage_data}")
-
-        if return_full_response_dict:
-            return LLMCallResult(
-                success=True,
-                status_code=200,
-                message="موفقیت‌آمیز",
-                full_response_data=completion.model_dump(),
-                usage=usage_data
-            )
-
-        # استخراج محتوا براساس n
-        if n == 1 and completion.choices:
-            content_result = completion.choices[0].message.content
-        else:
-            content_result = [
-                c.message.content
-                for c in completion.choices
-                if c.message and c.message.content is not None
-            ]
-
-        return LLMCallResult(
-            success=True,
-            status_code=200,
-            message="موفقیت‌آمیز",
-            content=content_result,
-            usage=usage_data
+        logger.info(f"LLM call succeeded. Usage: {raw_result.usage}")
+        return _result_from_response(
+            raw_result.full_response_data,
+            raw_result.usage,
+            n,
+            return_full_response_dict,
+            provider=raw_result.provider
         )
 
     # ۹. هندل کردن خطاهای مختلف OpenAI
+    except GovernorTimeoutError as e:
+        logger.error(f"LLM admission timeout: {e}")
+        return LLMCallResult(
+            success=False,
+            status_code=429,
+            message="صف فراخوانی LLM پر است",
+            error_detail=str(e)
+        )
+    except DeadlineExceededError as e:
+        logger.error(f"LLM deadline exceeded: {e}")
+        return LLMCallResult(
+            success=False,
+            status_code=504,
+            message="پاسخ LLM در مهلت مقرر نرسید",
+            error_detail=str(e)
+        )
+    except CircuitOpenError as e:
+        logger.error(f"LLM endpoint unavailable (circuit open): {e}")
+        return LLMCallResult(
+            success=False,
+            status_code=503,
+            message="سرویس LLM موقتاً در دسترس نیست",
+            error_detail=str(e)
+        )
     except APIConnectionError as e:
         logger.error(f"خطای اتصال به OpenAI API: {e}", exc_info=True)
         return LLMCallResult(
@@ -424,4 +576,66 @@ async def llm_async(
             status_code=500,
             message="خطای پیش‌بینی نشده",
             error_detail=str(e)
-        )
\ No newline at end of file
+        )
+
+
+# callback پیشرفت: (تعداد تمام‌شده، کل، اندیس درخواست، نتیجه آن)؛ sync یا async
+BatchProgressCallback = Callable[[int, int, int, "LLMCallResult"], Union[None, Awaitable[None]]]
+
+
+async def llm_batch_async(
+    requests: Sequence[Dict[str, Any]],
+    concurrency: int = settings.LLM_BATCH_CONCURRENCY,
+    progress_callback: Optional[BatchProgressCallback] = None,
+    **defaults: Any
+) -> List["LLMCallResult"]:
+    """
+    اجرای دسته‌ای چند فراخوانی llm_async با هم‌روندی محدود.
+
+    - `requests`: لیستی از kwargsهای llm_async؛ `defaults` برای همه آیتم‌ها اعمال می‌شود (آیتم اولویت دارد)
+    - خروجی به ترتیب ورودی است؛ خطای هر آیتم فقط همان آیتم را ناموفق می‌کند (LLMCallResult با success=False)
+    - اولویت پیش‌فرض در governor، PRIORITY_LOW است تا کارهای دسته‌ای جلوی درخواست‌های تعاملی را نگیرند
+    - stream در حالت دسته‌ای پشتیبانی نمی‌شود
+    """
+    total = len(requests)
+    results: List[Optional[LLMCallResult]] = [None] * total
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    completed = 0
+
+    async def run_one(index: int, item: Dict[str, Any]) -> None:
+        nonlocal completed
+        kwargs = {"priority": PRIORITY_LOW, **defaults, **item}
+        if kwargs.get("stream"):
+            result = LLMCallResult(
+                success=False,
+                status_code=400,
+                message="درخواست نامعتبر",
+                error_detail="stream در llm_batch_async پشتیبانی نمی‌شود."
+            )
+        else:
+            async with semaphore:
+                try:
+                    result = await llm_async(**kwargs)
+                except Exception as e:  # مثلاً پارامتر نامعتبر؛ فقط همین آیتم ناموفق می‌شود
+                    logger.error(f"Batch item {index} failed: {e}", exc_info=True)
+                    result = LLMCallResult(
+                        success=False,
+                        status_code=500,
+                        message="خطای پیش‌بینی نشده",
+                        error_detail=str(e)
+                    )
+        results[index] = result
+        completed += 1
+
+        if progress_callback is not None:
+            try:
+                ret = progress_callback(completed, total, index, result)
+                if inspect.isawaitable(ret):
+                    await ret
+            except Exception as e:
+                logger.warning(f"Batch progress callback failed: {e}")
+
+    await asyncio.gather(*(run_one(i, item) for i, item in enumerate(requests)))
+    failed = sum(1 for r in results if not r.success)
+    logger.info(f"LLM batch finished: total={total}, failed={failed}, concurrency={concurrency}")
+    return results  # type: ignore[return-value]
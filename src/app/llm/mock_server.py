@@ -0,0 +1,325 @@
+"""
+Offline OpenAI-compatible LLM server for load tests and benchmarks.
+
+    python -m app.llm.mock_server --port 8100 --ttft 0.4 --tps 60 --error-429 0.02 --models gpt-4o-mini,gpt-4o
+    OPENAI_BASE_URL=http://localhost:8100/v1 uvicorn app.main:app
+
+Modes:
+- synthetic: deterministic text derived from the request (no network)
+- record: answers from the upstream provider, saved as cassettes (once per request fingerprint)
+- replay: answers only from cassettes; unknown requests get 404
+
+Standalone: does not read the app Settings, so no production secrets are needed to run it.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.llm.fingerprint import request_fingerprint
+from app.llm.tokenizer import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+MODES = ("synthetic", "record", "replay")
+# مدل‌های /v1/models به صورت پیش‌فرض (هم‌نام DEFAULT_MODELS کاتالوگ)؛ با --models عوض می‌شود
+DEFAULT_MOCK_MODELS = ("gpt-4o-mini", "gpt-4o", "deepseek-chat")
+
+_WORDS = (
+    "the agent answers your question with a short and helpful reply based on the conversation "
+    "context and the instructions of its system prompt while keeping the tone friendly and clear"
+).split()
+
+
+class MockLLMConfig:
+    def __init__(
+        self,
+        ttft: float = 0.3,                 # ثانیه تا اولین توکن
+        tokens_per_second: float = 50.0,
+        error_429_rate: float = 0.0,
+        error_503_rate: float = 0.0,
+        retry_after: float = 1.0,          # هدر Retry-After در پاسخ‌های 429
+        response_tokens: int = 120,        # طول پاسخ synthetic (اگر max_tokens کمتر نباشد)
+        mode: str = "synthetic",
+        cassette_dir: str = "./cassettes",
+        upstream_base_url: Optional[str] = None,
+        upstream_api_key: Optional[str] = None,
+        seed: Optional[int] = None,        # برای تکرارپذیری تزریق خطا
+        models: Optional[List[str]] = None,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if mode == "record" and not upstream_base_url:
+            raise ValueError("record mode needs upstream_base_url")
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_429_rate = error_429_rate
+        self.error_503_rate = error_503_rate
+        self.retry_after = retry_after
+        self.response_tokens = response_tokens
+        self.mode = mode
+        self.cassette_dir = cassette_dir
+        self.upstream_base_url = upstream_base_url
+        self.upstream_api_key = upstream_api_key
+        self.seed = seed
+        self.models = list(models) if models else list(DEFAULT_MOCK_MODELS)
+
+
+def _error(status_code: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": status_code}},
+        headers=headers,
+    )
+
+
+def _split_tokens(text: str) -> List[str]:
+    """تکه‌های stream: هر کلمه با فاصله بعدش یک «توکن» شبیه‌سازی شده است."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def _synthetic_text(body: Dict[str, Any], n_tokens: int) -> str:
+    digest = hashlib.sha256(json.dumps(body.get("messages"), sort_keys=True).encode("utf-8")).digest()
+    rng = random.Random(digest)
+    return " ".join(rng.choice(_WORDS) for _ in range(n_tokens)) + "."
+
+
+class MockLLMServer:
+    def __init__(self, config: MockLLMConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._http: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.injected_errors = 0
+
+    # --- cassettes ---
+
+    def _cassette_path(self, key: str) -> str:
+        return os.path.join(self.config.cassette_dir, f"{key}.json")
+
+    def _read_cassette(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._cassette_path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_cassette(self, key: str, cassette: Dict[str, Any]) -> None:
+        os.makedirs(self.config.cassette_dir, exist_ok=True)
+        tmp = self._cassette_path(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cassette, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._cassette_path(key))
+
+    async def _record(self, key: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=120.0)
+        upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        resp = await self._http.post(
+            f"{self.config.upstream_base_url.rstrip('/')}/chat/completions",
+            json=upstream_body,
+            headers={"Authorization": f"Bearer {self.config.upstream_api_key}"},
+        )
+        resp.raise_for_status()
+        cassette = {"request": upstream_body, "response": resp.json()}
+        await asyncio.to_thread(self._write_cassette, key, cassette)
+        logger.info(f"Cassette recorded: {key[:12]}")
+        return cassette
+
+    # --- answer ---
+
+    async def _answer(self, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """{content, finish_reason, completion_tokens} یا None اگر در حالت replay cassette نباشد."""
+        if self.config.mode == "synthetic":
+            limit = body.get("max_tokens") or self.config.response_tokens
+            n_tokens = min(self.config.response_tokens, limit)
+            content = _synthetic_text(body, n_tokens)
+            return {
+                "content": content,
+                "finish_reason": "stop" if n_tokens < limit else "length",
+                "completion_tokens": len(_split_tokens(content)),
+            }
+
+        key = request_fingerprint(body)
+        cassette = await asyncio.to_thread(self._read_cassette, key)
+        if cassette is None:
+            if self.config.mode == "replay":
+                return None
+            cassette = await self._record(key, body)
+        response = cassette["response"]
+        choice = (response.get("choices") or [{}])[0]
+        content = (choice.get("message") or {}).get("content") or ""
+        usage = response.get("usage") or {}
+        return {
+            "content": content,
+            "finish_reason": choice.get("finish_reason") or "stop",
+            "completion_tokens": usage.get("completion_tokens") or len(_split_tokens(content)),
+        }
+
+    def _injected_error(self) -> Optional[JSONResponse]:
+        roll = self._rng.random()
+        if roll < self.config.error_429_rate:
+            self.injected_errors += 1
+            return _error(
+                429, "Rate limit reached (injected by mock server)", "rate_limit_exceeded",
+                headers={"retry-after": str(self.config.retry_after)},
+            )
+        if roll < self.config.error_429_rate + self.config.error_503_rate:
+            self.injected_errors += 1
+            return _error(503, "Service unavailable (injected by mock server)", "server_error")
+        return None
+
+    async def chat_completions(self, request: Request):
+        self.requests += 1
+        body = await request.json()
+        error = self._injected_error()
+        if error is not None:
+            return error
+
+        answer = await self._answer(body)
+        if answer is None:
+            return _error(404, "No cassette recorded for this request (replay mode)", "cassette_not_found")
+
+        model = body.get("model", "mock")
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        prompt_tokens = count_message_tokens(body.get("messages") or [], model)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": answer["completion_tokens"],
+            "total_tokens": prompt_tokens + answer["completion_tokens"],
+        }
+        pieces = _split_tokens(answer["content"])
+        delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.config.ttft + delay * max(0, len(pieces) - 1))
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer["content"]},
+                    "finish_reason": answer["finish_reason"],
+                }],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(choices: List[Dict[str, Any]], with_usage: bool = False) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+            }
+            if with_usage:
+                data["usage"] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events() -> AsyncGenerator[str, None]:
+            await asyncio.sleep(self.config.ttft)
+            yield chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(delay)
+                yield chunk([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            yield chunk([{"index": 0, "delta": {}, "finish_reason": answer["finish_reason"]}])
+            if include_usage:
+                yield chunk([], with_usage=True)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+
+
+def create_mock_app(config: Optional[MockLLMConfig] = None) -> FastAPI:
+    server = MockLLMServer(config or MockLLMConfig())
+    app = FastAPI(title="Mock LLM (OpenAI-compatible)", docs_url=None, redoc_url=None)
+    app.state.mock = server
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {
+            "object": "list",
+            "data": [
+                {"id": m, "object": "model", "created": 0, "owned_by": "mock"}
+                for m in server.config.models
+            ],
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await server.chat_completions(request)
+
+    @app.get("/stats")
+    async def stats():
+        return {"mode": server.config.mode, "requests": server.requests, "injected_errors": server.injected_errors}
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await server.aclose()
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tps", type=float, default=50.0, help="tokens per second")
+    parser.add_argument("--error-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--error-503", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--response-tokens", type=int, default=120)
+    parser.add_argument("--mode", choices=MODES, default="synthetic")
+    parser.add_argument("--cassette-dir", default="./cassettes")
+    parser.add_argument("--upstream-base-url", default=os.getenv("OPENAI_BASE_URL"))
+    parser.add_argument("--upstream-api-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--models", default=",".join(DEFAULT_MOCK_MODELS), help="comma-separated model ids listed by /v1/models"
+    )
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_mock_app(MockLLMConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tps,
+        error_429_rate=args.error_429,
+        error_503_rate=args.error_503,
+        retry_after=args.retry_after,
+        response_tokens=args.response_tokens,
+        mode=args.mode,
+        cassette_dir=args.cassette_dir,
+        upstream_base_url=args.upstream_base_url,
+        upstream_api_key=args.upstream_api_key,
+        seed=args.seed,
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+    ))
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
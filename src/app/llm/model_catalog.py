@@ -0,0 +1,194 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.api.v1.schemas.agents import ResponseLengthEnum
+from app.core.config import settings
+from app.llm.stream_metrics import StreamStats, stream_stats
+
+logger = logging.getLogger(__name__)
+
+# سقف توکن خروجی به ازای response_length agent
+RESPONSE_MAX_TOKENS: Dict[ResponseLengthEnum, int] = {
+    ResponseLengthEnum.short: 300,
+    ResponseLengthEnum.medium: 1000,
+    ResponseLengthEnum.long: 4000,
+}
+
+
+class ModelSpec:
+    """
+    Static facts about one chat model.
+
+    - `tier`: relative answer quality (higher is better); the router never goes below the required tier
+    - `ttft` / `tokens_per_second`: priors used until enough streams of the model were measured
+    - Prices are USD per 1M tokens
+    """
+
+    def __init__(
+        self,
+        name: str,
+        context_window: int,
+        max_output_tokens: int,
+        input_price: float,
+        output_price: float,
+        tier: int,
+        ttft: float,
+        tokens_per_second: float,
+    ):
+        self.name = name
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        self.input_price = input_price
+        self.output_price = output_price
+        self.tier = tier
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.input_price + completion_tokens * self.output_price) / 1_000_000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "context_window": self.context_window,
+            "max_output_tokens": self.max_output_tokens,
+            "input_price": self.input_price,
+            "output_price": self.output_price,
+            "tier": self.tier,
+            "ttft": self.ttft,
+            "tokens_per_second": self.tokens_per_second,
+        }
+
+
+DEFAULT_MODELS: List[ModelSpec] = [
+    ModelSpec("gpt-4o-mini", 128000, 16384, input_price=0.15, output_price=0.60, tier=1, ttft=0.5, tokens_per_second=80.0),
+    ModelSpec("gpt-4o", 128000, 16384, input_price=2.50, output_price=10.00, tier=3, ttft=0.7, tokens_per_second=60.0),
+    ModelSpec("deepseek-chat", 64000, 8192, input_price=0.27, output_price=1.10, tier=2, ttft=1.5, tokens_per_second=25.0),
+]
+
+# مدل ناشناخته: پنجره کوچک و محافظه‌کارانه
+UNKNOWN_CONTEXT_WINDOW = 16000
+
+
+class ModelCatalog:
+    """
+    Model facts + measured speed, used for context budgeting and latency-aware routing.
+
+    - Measured TTFT (p50) and decode speed come from stream_stats once a model has `min_samples` streams
+    - Expected latency of a turn = TTFT + max_tokens / tokens_per_second
+    """
+
+    def __init__(
+        self,
+        models: Iterable[ModelSpec],
+        stats: StreamStats,
+        small_prompt_tokens: int = 2000,
+        min_samples: int = 10,
+    ):
+        self._models: Dict[str, ModelSpec] = {m.name: m for m in models}
+        self.stats_source = stats
+        self.small_prompt_tokens = small_prompt_tokens
+        self.min_samples = min_samples
+        self.routed: Dict[str, int] = {}
+
+    @classmethod
+    def from_settings(cls) -> "ModelCatalog":
+        """
+        - DEFAULT_MODELS, overridden/extended by LLM_MODEL_CATALOG
+          (e.g. {"gpt-4o": {"input_price": 2.0}} or a full entry for a new model)
+        """
+        specs = {m.name: m.to_dict() for m in DEFAULT_MODELS}
+        for name, overrides in settings.LLM_MODEL_CATALOG.items():
+            specs[name] = {**specs.get(name, {}), **overrides}
+        models: List[ModelSpec] = []
+        for name, spec in specs.items():
+            try:
+                models.append(ModelSpec(name, **spec))
+            except TypeError as e:
+                logger.error(f"Invalid LLM_MODEL_CATALOG entry for {name}: {e}")
+        return cls(models, stream_stats, small_prompt_tokens=settings.ROUTER_SMALL_PROMPT_TOKENS)
+
+    def names(self) -> List[str]:
+        return list(self._models)
+
+    def get(self, model: str) -> Optional[ModelSpec]:
+        return self._models.get(model)
+
+    def context_window(self, model: str) -> int:
+        spec = self._models.get(model)
+        return spec.context_window if spec else UNKNOWN_CONTEXT_WINDOW
+
+    def max_tokens_for(self, model: str, response_length: ResponseLengthEnum) -> int:
+        """سقف توکن خروجی یک نوبت: از response_length، محدود به سقف خروجی مدل."""
+        limit = RESPONSE_MAX_TOKENS.get(response_length, RESPONSE_MAX_TOKENS[ResponseLengthEnum.medium])
+        spec = self._models.get(model)
+        return min(limit, spec.max_output_tokens) if spec else limit
+
+    def speed(self, model: str) -> Dict[str, Optional[float]]:
+        """(ttft ثانیه، tokens/s): اندازه‌گیری‌شده در صورت وجود نمونه کافی، وگرنه prior کاتالوگ."""
+        spec = self._models.get(model)
+        ttft = spec.ttft if spec else None
+        tps = spec.tokens_per_second if spec else None
+        measured = self.stats_source.for_model(model)
+        if measured and measured["streams"] >= self.min_samples:
+            if measured["ttft_p50_ms"] is not None:
+                ttft = measured["ttft_p50_ms"] / 1000.0
+            if measured["avg_tokens_per_second"]:
+                tps = measured["avg_tokens_per_second"]
+        return {"ttft": ttft, "tokens_per_second": tps}
+
+    def expected_latency(self, model: str, max_tokens: int) -> Optional[float]:
+        speed = self.speed(model)
+        if speed["ttft"] is None or not speed["tokens_per_second"]:
+            return None
+        return speed["ttft"] + max_tokens / speed["tokens_per_second"]
+
+    def route(self, configured: str, prompt_tokens: int, response_length: ResponseLengthEnum) -> str:
+        """
+        Fastest adequate model for one turn (routing_policy = fastest).
+
+        - Adequate: the prompt and the answer fit the model's context window, and its tier is at
+          least the configured model's tier - or one tier lower for short/medium answers to small prompts
+        - Among adequate models the lowest expected latency wins, then the lowest cost;
+          the configured model is kept when nothing else qualifies
+        """
+        spec = self._models.get(configured)
+        if spec is None:
+            return configured
+        required_tier = spec.tier
+        if response_length != ResponseLengthEnum.long and prompt_tokens <= self.small_prompt_tokens:
+            required_tier = max(1, spec.tier - 1)
+
+        best = configured
+        best_key = None
+        for candidate in self._models.values():
+            max_tokens = self.max_tokens_for(candidate.name, response_length)
+            if candidate.tier < required_tier or prompt_tokens + max_tokens > candidate.context_window:
+                continue
+            latency = self.expected_latency(candidate.name, max_tokens)
+            if latency is None:
+                continue
+            key = (latency, candidate.cost(prompt_tokens, max_tokens))
+            if best_key is None or key < best_key:
+                best, best_key = candidate.name, key
+
+        self.routed[best] = self.routed.get(best, 0) + 1
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for name in self._models:
+            speed = self.speed(name)
+            out[name] = {
+                "tier": self._models[name].tier,
+                "ttft": _round(speed["ttft"]),
+                "tokens_per_second": _round(speed["tokens_per_second"]),
+                "routed": self.routed.get(name, 0),
+            }
+        return out
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+model_catalog = ModelCatalog.from_settings()
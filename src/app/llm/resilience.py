@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker of this endpoint is open; the call was rejected without hitting the network."""
+
+    def __init__(self, base_url: str, retry_in: float):
+        super().__init__(f"circuit open for {base_url}, retry in {retry_in:.1f}s")
+        self.base_url = base_url
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    - closed: calls pass; `failure_threshold` consecutive failures open the circuit
+    - open: calls are rejected until `reset_timeout` has passed
+    - half_open: a single probe call is let through; success closes, failure re-opens
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def retry_in(self) -> float:
+        if self.state != self.OPEN or self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN:
+            if self.retry_in() > 0:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed again.")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(
+                    f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures."
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """Call was cancelled or failed for a reason unrelated to the endpoint: the half-open slot is freed."""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in": round(self.retry_in(), 2),
+        }
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    - Read `retry-after-ms` / `retry-after` (seconds or HTTP date) from the error response
+    - None if the provider did not send one
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """429، خطای اتصال/timeout و خطاهای 5xx (و 408/409) قابل تکرارند؛ بقیه (400، 401، ...) نه."""
+    if isinstance(exc, (RateLimitError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in (408, 409) or exc.status_code >= 500
+    return False
+
+
+def is_endpoint_failure(exc: BaseException) -> bool:
+    """فقط خطاهایی که نشانه خرابی endpoint هستند breaker را باز می‌کنند (429 یعنی شلوغی، نه خرابی)."""
+    if isinstance(exc, APIConnectionError):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+class LLMResilience:
+    """
+    Bounded retries with exponential backoff + full jitter, and one circuit breaker per base_url.
+
+    - Retry-After from the provider is honoured (capped at `max_delay`)
+    - Counters and breaker states are exposed through `stats()` for monitoring
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.calls = 0
+        self.retries = 0
+        self.retries_by_reason: Dict[str, int] = {}
+        self.gave_up = 0
+        self.rejected_open = 0
+
+    def breaker(self, base_url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(base_url)
+        if breaker is None:
+            breaker = CircuitBreaker(base_url, self.failure_threshold, self.reset_timeout)
+            self._breakers[base_url] = breaker
+        return breaker
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def call(self, base_url: str, make_call: Callable[[], Awaitable[T]]) -> T:
+        """
+        - Run `make_call` under the breaker of `base_url`, retrying retryable errors
+        - Raises CircuitOpenError when the breaker rejects, otherwise the last provider error
+        """
+        breaker = self.breaker(base_url)
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                self.rejected_open += 1
+                raise CircuitOpenError(base_url, breaker.retry_in())
+            self.calls += 1
+            try:
+                result = await make_call()
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                if is_endpoint_failure(e):
+                    breaker.record_failure()
+                else:
+                    # 4xx، 429 یا مهلت خودمان (DeadlineExceededError) درباره سلامت endpoint چیزی نمی‌گوید:
+                    # probe در half_open نه مدار را می‌بندد و نه باز می‌کند
+                    breaker.release_probe()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    if is_retryable(e):
+                        self.gave_up += 1
+                    raise
+                reason = type(e).__name__
+                self.retries += 1
+                self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+                delay = self.backoff_delay(attempt, retry_after_seconds(e))
+                logger.warning(
+                    f"LLM call to {base_url} failed ({reason}); retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+                )
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "retries_by_reason": dict(self.retries_by_reason),
+            "gave_up": self.gave_up,
+            "rejected_open": self.rejected_open,
+            "breakers": {url: b.snapshot() for url, b in self._breakers.items()},
+        }
+
+
+resilience = LLMResilience(
+    max_retries=settings.LLM_MAX_RETRIES,
+    base_delay=settings.LLM_RETRY_BASE_DELAY,
+    max_delay=settings.LLM_RETRY_MAX_DELAY,
+    failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.LLM_BREAKER_RESET_TIMEOUT,
+)
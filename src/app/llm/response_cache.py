@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from elasticsearch import NotFoundError
+
+from app.core.config import settings
+from app.db.indices.llm_cache import llm_cache_index_name
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCacheTier:
+    """
+    Persistent tier: one JSON file per key under `directory`.
+    File I/O runs in a worker thread so the event loop is not blocked.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _write(self, key: str, value: Dict[str, Any]) -> None:
+        path = self._path(key)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"expires_at": time.time() + self.ttl_seconds, "value": value}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._write, key, value)
+
+
+class ESCacheTier:
+    """
+    Persistent tier in the `llm_response_cache` index (see app.db.indices.llm_cache).
+    Expired documents are treated as misses; cleanup can be done with delete_by_query on expires_at.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _es():
+        # import محلی برای جلوگیری از import حلقوی (dependencies -> llm_client -> response_cache)
+        from app.core.dependencies import get_async_es_client
+        return get_async_es_client()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            res = await self._es().get(index=llm_cache_index_name, id=key)
+        except NotFoundError:
+            return None
+        src = res["_source"]
+        if datetime.fromisoformat(src["expires_at"]) < datetime.utcnow():
+            return None
+        return src.get("value")
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        doc = {
+            "model": value.get("full_response_data", {}).get("model"),
+            "created_at": now.isoformat(),
+            "expires_at": (now + timedelta(seconds=self.ttl_seconds)).isoformat(),
+            "value": value,
+        }
+        await self._es().index(index=llm_cache_index_name, id=key, document=doc)
+
+
+class LLMResponseCache:
+    """
+    Cache for deterministic LLM responses.
+
+    - Tier 1: bounded in-memory LRU with TTL
+    - Tier 2 (optional): disk or ES, populated on write and promoted to tier 1 on hit
+    - Only n == 1 requests with temperature <= max_temperature (or a fixed seed) are cacheable
+    - Streams are stored once complete and replayed as a single chunk on hit
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400.0,
+        max_temperature: float = 0.2,
+        persistent_tier=None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_temperature = max_temperature
+        self.persistent_tier = persistent_tier
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def is_cacheable(self, request_params: Dict[str, Any]) -> bool:
+        # stream هم cache می‌شود: متن کامل پس از پایان stream ذخیره و در hit یک‌جا برگردانده می‌شود
+        if request_params.get("n", 1) != 1:
+            return False
+        if request_params.get("seed") is not None:
+            return True
+        temperature = request_params.get("temperature")
+        return temperature is not None and temperature <= self.max_temperature
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return value
+        if self.persistent_tier is not None:
+            try:
+                value = await self.persistent_tier.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"LLM cache persistent tier read failed: {e}")
+                value = None
+            if value is not None:
+                self.hits += 1
+                self.persistent_hits += 1
+                self._set_memory(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._set_memory(key, value)
+        if self.persistent_tier is not None:
+            try:
+                await self.persistent_tier.set(key, value)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"LLM cache persistent tier write failed: {e}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.persistent_tier).__name__ if self.persistent_tier else "memory",
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _build_persistent_tier():
+    backend = settings.LLM_CACHE_BACKEND
+    if backend == "disk":
+        return DiskCacheTier(settings.LLM_CACHE_DIR, settings.LLM_CACHE_TTL_SECONDS)
+    if backend == "es":
+        return ESCacheTier(settings.LLM_CACHE_TTL_SECONDS)
+    return None
+
+
+response_cache = LLMResponseCache(
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+    max_temperature=settings.LLM_CACHE_MAX_TEMPERATURE,
+    persistent_tier=_build_persistent_tier(),
+)
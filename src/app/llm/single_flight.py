@@ -0,0 +1,196 @@
+import asyncio
+import copy
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.api.v1.schemas.llm_result import LLMCallResult
+
+logger = logging.getLogger(__name__)
+
+
+class StreamBroadcast:
+    """
+    Fan-out of one upstream stream to many subscribers.
+
+    - A pump task reads the upstream generator once and buffers every chunk
+    - Each subscriber replays the buffer from the start, then follows live chunks
+    - When the last subscriber leaves before the end, the pump (and upstream) is cancelled
+    """
+
+    def __init__(self, source: LLMCallResult, on_done: Optional[Callable[[], None]] = None):
+        self._source = source
+        self._on_done = on_done
+        self._chunks: List[str] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self._subscribers = 0
+        self._pump_task = asyncio.create_task(self._pump())
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self._source.stream_data:
+                self._chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self._error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._notify()
+            if self._on_done is not None:
+                self._on_done()
+
+    def subscribe(self, target: LLMCallResult) -> "_Subscription":
+        return _Subscription(self, target)
+
+    def _leave(self) -> None:
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self._done:
+            self._pump_task.cancel()
+
+
+class _Subscription:
+    """
+    Async iterator over a StreamBroadcast (replay + live).
+    Counted as a subscriber from creation until exhausted, aclose()d or garbage-collected,
+    so an abandoned, never-iterated subscription still lets the upstream be cancelled.
+    """
+
+    def __init__(self, broadcast: StreamBroadcast, target: LLMCallResult):
+        self._broadcast = broadcast
+        self._target = target
+        self._index = 0
+        self._closed = False
+        broadcast._subscribers += 1
+
+    def __aiter__(self) -> "_Subscription":
+        return self
+
+    async def __anext__(self) -> str:
+        b = self._broadcast
+        while not self._closed:
+            if self._index < len(b._chunks):
+                chunk = b._chunks[self._index]
+                self._index += 1
+                return chunk
+            if b._done:
+                self._leave()
+                if b._error is not None:
+                    raise b._error
+                self._target.usage = b._source.usage
+                self._target.stream_metrics = b._source.stream_metrics
+                self._target.tool_calls = b._source.tool_calls
+                break
+            try:
+                await b._changed.wait()
+            except asyncio.CancelledError:
+                self._leave()
+                raise
+        raise StopAsyncIteration
+
+    async def aclose(self) -> None:
+        self._leave()
+
+    def _leave(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self._broadcast._leave()
+
+    def __del__(self):
+        try:
+            self._leave()
+        except Exception:
+            pass
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.broadcast: Optional[StreamBroadcast] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical LLM requests into one upstream call.
+
+    - The first caller of a key starts the call in its own task; later callers await the same task
+    - Each caller gets its own LLMCallResult (streams are fanned out through StreamBroadcast)
+    - A streaming flight stays joinable until its stream ends, so late callers replay the buffer
+    - If every waiter is cancelled, the shared call is cancelled as well
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[LLMCallResult]]) -> LLMCallResult:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._start(key, fn)
+            self.leaders += 1
+            is_leader = True
+        else:
+            self.coalesced += 1
+            is_leader = False
+            logger.info(f"LLM request coalesced with in-flight call (key={key[-12:]})")
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        flight.waiters -= 1
+
+        if flight.broadcast is not None:
+            own = LLMCallResult(
+                success=result.success,
+                status_code=result.status_code,
+                message=result.message,
+                provider=result.provider,
+            )
+            own.stream_data = flight.broadcast.subscribe(own)
+            return own
+        return result if is_leader else copy.copy(result)
+
+    def _start(self, key: str, fn: Callable[[], Awaitable[LLMCallResult]]) -> _Flight:
+        async def run() -> LLMCallResult:
+            result = await fn()
+            if result.stream_data is not None:
+                flight.broadcast = StreamBroadcast(result, on_done=lambda: self._forget(key, flight))
+            return result
+
+        def on_task_done(task: asyncio.Task) -> None:
+            # stream: تا پایان broadcast قابل پیوستن می‌ماند
+            if task.cancelled() or task.exception() is not None or flight.broadcast is None:
+                self._forget(key, flight)
+
+        flight = _Flight(asyncio.ensure_future(run()))
+        self._flights[key] = flight
+        flight.task.add_done_callback(on_task_done)
+        return flight
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,97 @@
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+class StreamTimer:
+    """
+    Timing of one streamed completion.
+
+    - `started`: when the request was sent (after governor admission)
+    - Every content chunk calls `on_chunk()`; `finish()` turns the timings into metrics
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.monotonic()
+        self.first_chunk_at: Optional[float] = None
+        self.last_chunk_at: Optional[float] = None
+        self.chunks = 0
+
+    def on_chunk(self) -> None:
+        now = time.monotonic()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        self.last_chunk_at = now
+        self.chunks += 1
+
+    def finish(self, completion_tokens: Optional[int]) -> Dict[str, Any]:
+        """
+        - ttft_ms: time to first token
+        - inter_token_ms: mean time per output token after the first one
+        - tokens_per_second: output tokens per second after the first one (decode speed)
+        """
+        ended = time.monotonic()
+        metrics: Dict[str, Any] = {
+            "ttft_ms": None,
+            "inter_token_ms": None,
+            "tokens_per_second": None,
+            "duration_ms": _ms(ended - self.started),
+            "chunks": self.chunks,
+            "completion_tokens": completion_tokens,
+        }
+        if self.first_chunk_at is None:
+            return metrics
+        metrics["ttft_ms"] = _ms(self.first_chunk_at - self.started)
+        decode_seconds = self.last_chunk_at - self.first_chunk_at
+        if completion_tokens and completion_tokens > 1 and decode_seconds > 0:
+            metrics["inter_token_ms"] = _ms(decode_seconds / (completion_tokens - 1))
+            metrics["tokens_per_second"] = round((completion_tokens - 1) / decode_seconds, 2)
+        return metrics
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000.0, 1)
+
+
+class StreamStats:
+    """
+    Per-model window of recent stream metrics for /monitoring/llm (capacity sizing, slow models).
+    """
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: Dict[str, Deque[Dict[str, Any]]] = {}
+
+    def record(self, model: str, metrics: Dict[str, Any]) -> None:
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+            self._samples[model] = samples
+        samples.append(metrics)
+
+    def for_model(self, model: str) -> Optional[Dict[str, Any]]:
+        """خلاصه پنجره یک مدل (None اگر هنوز streamی ثبت نشده باشد)."""
+        samples = self._samples.get(model)
+        if not samples:
+            return None
+        ttft = sorted(m["ttft_ms"] for m in samples if m["ttft_ms"] is not None)
+        tps = [m["tokens_per_second"] for m in samples if m["tokens_per_second"] is not None]
+        return {
+            "streams": len(samples),
+            "ttft_p50_ms": _percentile(ttft, 0.5),
+            "ttft_p95_ms": _percentile(ttft, 0.95),
+            "avg_tokens_per_second": round(sum(tps) / len(tps), 2) if tps else None,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: self.for_model(model) for model in self._samples}
+
+
+def _percentile(ordered: list, q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+stream_stats = StreamStats()
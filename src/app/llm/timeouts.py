@@ -0,0 +1,191 @@
+import bisect
+import math
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+# مرزهای bucket اندازه prompt (توکن)؛ زمان پاسخ با طول prompt رشد می‌کند
+PROMPT_BUCKETS: Tuple[int, ...] = (1000, 4000, 16000, 64000)
+
+FIRST_TOKEN = "first_token"
+TOTAL = "total"
+
+TimeoutKey = Tuple[str, str, str]  # (model, bucket, kind)
+
+BUCKET_LABELS: Tuple[str, ...] = (*(f"<={edge}" for edge in PROMPT_BUCKETS), f">{PROMPT_BUCKETS[-1]}")
+
+
+# model → سرعت تولید (tokens/s) یا None
+DecodeSpeed = Callable[[str], Optional[float]]
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    A limit computed by AdaptiveTimeouts expired (waiting for the response or the stream ran too long).
+    It is this service's own deadline, not a sign that the endpoint is down: not retried,
+    not counted by the circuit breaker and no failover.
+    """
+
+    def __init__(self, model: str, limit: float, what: str = "response"):
+        super().__init__(f"LLM {what} exceeded the {limit:.1f}s deadline (model={model})")
+        self.model = model
+        self.limit = limit
+
+
+def prompt_bucket(prompt_tokens: int) -> str:
+    """برچسب bucket: "<=1000", "<=4000", ... و ">64000" برای بزرگ‌ترها."""
+    return BUCKET_LABELS[bisect.bisect_left(PROMPT_BUCKETS, prompt_tokens)]
+
+
+def _percentile(samples: Sequence[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+class AdaptiveTimeouts:
+    """
+    Per-request LLM timeouts derived from observed latencies.
+
+    - Rolling windows per (model, prompt-size bucket) of time-to-first-chunk (streams) and total duration
+    - timeout = percentile(q) × factor, clamped to [min_timeout, ceiling]
+    - A bucket with too few samples falls back to the model's larger-prompt buckets, then to the static ceiling
+      (never to smaller prompts, whose latencies would make the limit too tight)
+    - With `max_tokens`, total is at least first_token + max_tokens / decode speed × factor, so a long
+      answer is not cut off by a bucket whose samples are mostly short answers
+    - connect is fixed (the SDK does not expose connect time); it only bounds the TCP/TLS handshake
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        window: int = 500,
+        min_samples: int = 30,
+        quantile: float = 0.99,
+        factor: float = 2.0,
+        min_timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        default_timeout: float = 90.0,
+        decode_speed: Optional[DecodeSpeed] = None,
+    ):
+        self.enabled = enabled
+        self.window = window
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.connect_timeout = connect_timeout
+        self.default_timeout = default_timeout
+        self.decode_speed = decode_speed
+        self._samples: Dict[TimeoutKey, Deque[float]] = {}
+
+    @classmethod
+    def from_settings(cls) -> "AdaptiveTimeouts":
+        from app.llm.model_catalog import model_catalog
+
+        return cls(
+            enabled=settings.LLM_ADAPTIVE_TIMEOUTS,
+            window=settings.LLM_TIMEOUT_WINDOW,
+            min_samples=settings.LLM_TIMEOUT_MIN_SAMPLES,
+            quantile=settings.LLM_TIMEOUT_QUANTILE,
+            factor=settings.LLM_TIMEOUT_FACTOR,
+            min_timeout=settings.LLM_TIMEOUT_MIN,
+            connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+            default_timeout=settings.LLM_TIMEOUT,
+            # سرعت اندازه‌گیری‌شده stream‌ها، وگرنه prior کاتالوگ
+            decode_speed=lambda model: model_catalog.speed(model)["tokens_per_second"],
+        )
+
+    def record(self, model: str, prompt_tokens: int, kind: str, seconds: float) -> None:
+        key = (model, prompt_bucket(prompt_tokens), kind)
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = deque(maxlen=self.window)
+            self._samples[key] = samples
+        samples.append(seconds)
+
+    def _observed(self, model: str, bucket: str, kind: str) -> Optional[float]:
+        samples: Sequence[float] = self._samples.get((model, bucket, kind)) or ()
+        if len(samples) < self.min_samples:
+            merged: List[float] = []
+            larger = BUCKET_LABELS[BUCKET_LABELS.index(bucket):]
+            for (m, b, k), window in self._samples.items():
+                if m == model and k == kind and b in larger:
+                    merged.extend(window)
+            samples = merged
+        if len(samples) < self.min_samples:
+            return None
+        return _percentile(samples, self.quantile)
+
+    def _derive(self, observed: Optional[float], ceiling: float) -> float:
+        if observed is None:
+            return ceiling
+        return min(ceiling, max(self.min_timeout, observed * self.factor))
+
+    def limits(
+        self, model: str, prompt_tokens: int, ceiling: Optional[float] = None, max_tokens: Optional[int] = None
+    ) -> Dict[str, float]:
+        """
+        - connect / first_token / total (seconds) for one request
+        - `ceiling`: the caller's timeout (llm_async(timeout=...)); never exceeded
+        - `max_tokens`: the request's output cap; total leaves room to generate all of it
+        """
+        ceiling = ceiling or self.default_timeout
+        if not self.enabled:
+            return {"connect": min(self.connect_timeout, ceiling), "first_token": ceiling, "total": ceiling}
+        bucket = prompt_bucket(prompt_tokens)
+        first_token = self._derive(self._observed(model, bucket, FIRST_TOKEN), ceiling)
+        total = self._derive(self._observed(model, bucket, TOTAL), ceiling)
+        tps = self.decode_speed(model) if max_tokens and self.decode_speed is not None else None
+        if tps:
+            total = min(ceiling, max(total, first_token + max_tokens / tps * self.factor))
+        first_token = min(total, first_token)
+        return {"connect": min(self.connect_timeout, ceiling), "first_token": first_token, "total": total}
+
+    @staticmethod
+    def http_timeout(limits: Dict[str, float], stream: bool) -> httpx.Timeout:
+        """
+        - non-stream: the response arrives in one read after generation, so read = total
+        - stream: every read (the first chunk and each gap between chunks) is bounded by first_token
+        """
+        read = limits["first_token"] if stream else limits["total"]
+        return httpx.Timeout(read, connect=limits["connect"])
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"enabled": self.enabled, "models": {}}
+        buckets = sorted(
+            {(model, bucket) for model, bucket, _ in self._samples},
+            key=lambda item: (item[0], BUCKET_LABELS.index(item[1])),
+        )
+        for model, bucket in buckets:
+            first = self._samples.get((model, bucket, FIRST_TOKEN)) or ()
+            total = self._samples.get((model, bucket, TOTAL)) or ()
+            limits = self.limits(model, _bucket_probe(bucket))
+            out["models"].setdefault(model, {})[bucket] = {
+                "samples": len(total),
+                "first_token_samples": len(first),
+                f"first_token_p{_q_label(self.quantile)}": _round(_percentile(first, self.quantile)) if first else None,
+                f"total_p{_q_label(self.quantile)}": _round(_percentile(total, self.quantile)) if total else None,
+                "timeouts": {name: _round(value) for name, value in limits.items()},
+            }
+        return out
+
+
+def _bucket_probe(bucket: str) -> int:
+    """یک اندازه prompt نمونه در bucket، برای گزارش timeout جاری آن در stats."""
+    index = BUCKET_LABELS.index(bucket)
+    return PROMPT_BUCKETS[index] if index < len(PROMPT_BUCKETS) else PROMPT_BUCKETS[-1] + 1
+
+
+def _q_label(q: float) -> str:
+    return f"{q * 100:g}".replace(".", "_")
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+adaptive_timeouts = AdaptiveTimeouts.from_settings()
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken اختیاری است؛ در نبود آن از تخمین استفاده می‌شود
+    tiktoken = None
+
+DEFAULT_ENCODING = "o200k_base"
+
+# BPE هر مدل؛ deepseek توکنایزر عمومی ندارد و cl100k نزدیک‌ترین تقریب است
+MODEL_ENCODINGS: Dict[str, str] = {
+    "gpt-4o": "o200k_base",
+    "gpt-4o-mini": "o200k_base",
+    "deepseek-chat": "cl100k_base",
+}
+
+# سربار قالب chat برای هر پیام و برای شروع پاسخ (طبق مستندات OpenAI)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_MEMO_MAX_ENTRIES = 20000
+_memo: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str):
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed; token counts are estimated.")
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:  # مثلاً عدم دسترسی به فایل BPE
+        logger.warning(f"Could not load tokenizer '{name}' ({e}); token counts are estimated.")
+        return None
+
+
+def encoding_name_for_model(model: Optional[str]) -> str:
+    if not model:
+        return DEFAULT_ENCODING
+    return MODEL_ENCODINGS.get(model, DEFAULT_ENCODING)
+
+
+def _estimate(text: str) -> int:
+    """تخمین بدون BPE: حدود ۴ کاراکتر لاتین یا ۲ کاراکتر فارسی/غیرلاتین به ازای هر توکن."""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def _memo_key(encoding_name: str, text: str) -> Tuple[str, bytes]:
+    return encoding_name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _memo_get(key: Tuple[str, bytes]) -> Optional[int]:
+    count = _memo.get(key)
+    if count is not None:
+        _memo.move_to_end(key)
+    return count
+
+
+def _memo_set(key: Tuple[str, bytes], count: int) -> None:
+    _memo[key] = count
+    _memo.move_to_end(key)
+    while len(_memo) > _MEMO_MAX_ENTRIES:
+        _memo.popitem(last=False)
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> int:
+    """
+    - Token count of `text` with the model's BPE (memoized per content hash)
+    - Falls back to a script-aware estimate when the encoding is unavailable
+    """
+    if not text:
+        return 0
+    name = encoding_name_for_model(model)
+    key = _memo_key(name, text)
+    count = _memo_get(key)
+    if count is None:
+        enc = _get_encoding(name)
+        count = len(enc.encode_ordinary(text)) if enc is not None else _estimate(text)
+        _memo_set(key, count)
+    return count
+
+
+def count_tokens_batch(texts: Sequence[Optional[str]], model: Optional[str] = None) -> List[int]:
+    """
+    - Batch version of count_tokens; only cache misses are encoded, in one encode_batch call
+    """
+    name = encoding_name_for_model(model)
+    counts: List[Optional[int]] = [None] * len(texts)
+    missing: List[int] = []
+    for i, text in enumerate(texts):
+        if not text:
+            counts[i] = 0
+            continue
+        counts[i] = _memo_get(_memo_key(name, text))
+        if counts[i] is None:
+            missing.append(i)
+
+    if missing:
+        enc = _get_encoding(name)
+        if enc is not None:
+            encoded = enc.encode_ordinary_batch([texts[i] for i in missing])
+            fresh = [len(tokens) for tokens in encoded]
+        else:
+            fresh = [_estimate(texts[i]) for i in missing]
+        for i, count in zip(missing, fresh):
+            counts[i] = count
+            _memo_set(_memo_key(name, texts[i]), count)
+    return counts  # type: ignore[return-value]
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    """محتوای قابل شمارش یک پیام؛ برای پیام assistant با tool_calls، نام و آرگومان‌های tool هم شمرده می‌شوند."""
+    text = str(message.get("content") or "")
+    for call in message.get("tool_calls") or []:
+        function = call.get("function") or {}
+        text += f"{function.get('name', '')}{function.get('arguments', '')}"
+    return text
+
+
+def count_message_tokens(messages: Sequence[Dict[str, Any]], model: Optional[str] = None) -> int:
+    """
+    - Prompt tokens of a chat `messages` list, including the per-message chat framing
+    """
+    contents = [_message_text(m) for m in messages]
+    total = sum(count_tokens_batch(contents, model))
+    return total + len(messages) * TOKENS_PER_MESSAGE + TOKENS_PER_REPLY
+
+
+def preload_encodings() -> None:
+    """بارگذاری (و در صورت نیاز دانلود) همه BPEها؛ در lifespan و خارج از event loop صدا زده می‌شود."""
+    for name in set(MODEL_ENCODINGS.values()) | {DEFAULT_ENCODING}:
+        _get_encoding(name)
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ToolHandler = Callable[..., Awaitable[Any]]
+
+# سقف طول خروجی یک tool که به مدل برگردانده می‌شود (کاراکتر)
+MAX_TOOL_OUTPUT_CHARS = 8000
+
+
+class ToolError(Exception):
+    """خطای قابل گزارش به مدل (آرگومان نامعتبر، منبع پیدا نشد، ...)."""
+
+
+class Tool:
+    """
+    One function the model may call (OpenAI tool calling).
+
+    - `parameters`: JSON schema of the arguments object
+    - `handler`: async callable receiving the parsed arguments as keyword arguments
+    - `timeout`: per-call limit in seconds; a slow tool fails alone, the others still answer
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        parameters: Dict[str, Any],
+        handler: ToolHandler,
+        timeout: float = 10.0,
+    ):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.timeout = timeout
+
+    def spec(self) -> Dict[str, Any]:
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+def _tool_output(value: Any) -> str:
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) > MAX_TOOL_OUTPUT_CHARS:
+        text = text[:MAX_TOOL_OUTPUT_CHARS] + " …[truncated]"
+    return text
+
+
+class ToolRegistry:
+    """
+    Tools available to one agent turn.
+
+    - `specs()` is passed to llm_async(tools=...)
+    - `run_calls()` executes all tool calls of one model step concurrently (asyncio.gather),
+      each under its own timeout, and returns the `role=tool` messages in call order
+    """
+
+    def __init__(self, tools: Optional[List[Tool]] = None):
+        self._tools: Dict[str, Tool] = {}
+        for tool in tools or []:
+            self.register(tool)
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def register(self, tool: Tool) -> None:
+        self._tools[tool.name] = tool
+
+    def get(self, name: str) -> Optional[Tool]:
+        return self._tools.get(name)
+
+    def specs(self) -> List[Dict[str, Any]]:
+        return [tool.spec() for tool in self._tools.values()]
+
+    async def run_call(self, call: Dict[str, Any]) -> Dict[str, Any]:
+        function = call.get("function") or {}
+        name = function.get("name") or ""
+        started = time.monotonic()
+        try:
+            tool = self._tools.get(name)
+            if tool is None:
+                raise ToolError(f"Unknown tool: {name}")
+            try:
+                arguments = json.loads(function.get("arguments") or "{}")
+            except json.JSONDecodeError as e:
+                raise ToolError(f"Arguments are not valid JSON: {e}")
+            if not isinstance(arguments, dict):
+                raise ToolError("Arguments must be a JSON object")
+            output = _tool_output(await asyncio.wait_for(tool.handler(**arguments), timeout=tool.timeout))
+        except asyncio.TimeoutError:
+            output = _tool_output({"error": f"Tool '{name}' timed out"})
+        except (ToolError, TypeError) as e:
+            output = _tool_output({"error": str(e)})
+        except Exception as e:
+            logger.error(f"Tool '{name}' failed: {e}", exc_info=True)
+            output = _tool_output({"error": f"Tool '{name}' failed"})
+        logger.info(f"Tool '{name}' finished in {time.monotonic() - started:.2f}s")
+        return {"role": "tool", "tool_call_id": call.get("id"), "content": output}
+
+    async def run_calls(self, calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """زمان کل یک مرحله = کندترین tool، نه مجموع آن‌ها."""
+        return list(await asyncio.gather(*(self.run_call(call) for call in calls)))
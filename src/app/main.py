@@ -1,21 +1,60 @@
-import time
+import asyncio
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends
 from elasticsearch import Elasticsearch
 
 from app.core.config import settings
-from app.core.dependencies import get_es_client
+from app.core.dependencies import get_es_client, get_async_es_client
 from app.db.create_indices import create_indices
+from app.llm.client_pool import client_pool
+from app.llm.tokenizer import preload_encodings
+from app.services.message_writer import message_writer
 from app.api.v1.routers.agents import router as agents_router
 from app.api.v1.routers.conversations import router as conv_router
 from app.api.v1.routers.files import router as files_router
 from app.api.v1.routers.resume import router as resume_router
+from app.api.v1.routers.monitoring import router as monitoring_router
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup:
+    - Wait a few seconds for ES to be reachable, then create indices.
+    - Load tokenizer encodings in a worker thread (they may be downloaded on first use).
+    - Pre-warm the pooled LLM client (DNS + TLS) in the background, bounded by
+      LLM_POOL_PREWARM_TIMEOUT, so an unreachable provider never delays startup.
+    - Start the bulk message writer.
+    Shutdown:
+    - Flush and stop the message writer.
+    - Close pooled LLM connections and the async ES client.
+    """
+    await asyncio.sleep(5)
+    es = get_es_client()
+    await asyncio.to_thread(create_indices, es)
+    await asyncio.to_thread(preload_encodings)
+    prewarm = None
+    if settings.LLM_POOL_PREWARM:
+        prewarm = asyncio.create_task(client_pool.prewarm(
+            settings.OPENAI_BASE_URL, settings.OPENAI_API_KEY, settings.LLM_TIMEOUT,
+            max_wait=settings.LLM_POOL_PREWARM_TIMEOUT,
+        ))
+    if settings.MESSAGE_WRITER_ENABLED:
+        message_writer.start(get_async_es_client())
+    yield
+    if prewarm is not None and not prewarm.done():
+        prewarm.cancel()
+    await message_writer.stop()
+    await client_pool.aclose()
+    await get_async_es_client().close()
+
 
 app = FastAPI(
     title="AI Agent Backend",
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 @app.get("/health", tags=["health"])
@@ -37,16 +76,7 @@ app.include_router(agents_router, prefix="/api/v1")
 app.include_router(conv_router, prefix="/api/v1")
 app.include_router(files_router, prefix="/api/v1")
 app.include_router(resume_router, prefix="/api/v1")
-
-@app.on_event("startup")
-def on_startup():
-    """
-    Wait a few seconds for ES to be reachable, then create indices.
-    """
-    time.sleep(5)
-    es = get_es_client()
-    create_indices(es)
-
+app.include_router(monitoring_router, prefix="/api/v1")
 
 if __name__ == '__main__':
     uvicorn.run("main:app", host='0.0.0.0', port=9500, 
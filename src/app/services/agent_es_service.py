@@ -1,17 +1,22 @@
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from typing import Union
-from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch import Elasticsearch, AsyncElasticsearch, NotFoundError
 from app.api.v1.schemas.agents import AgentCreate, AgentInDB, AgentUpdate, AgentOut, ResponseSettings
 from app.db.indices.agents import agent_index_name
 from app.utils.deep_merge import deep_merge
+from app.utils.pagination import search_page_sync
+from app.services.prompt_cache import prompt_header_cache
+from app.services.conversation_manager import conversation_manager
 
 INDEX = agent_index_name
 
 class AgentService:
-    def __init__(self, es: Elasticsearch):
+    def __init__(self, es: Elasticsearch, async_es: Optional[AsyncElasticsearch] = None):
         self.es = es
+        # کلاینت async برای مسیر چت (ConversationService)
+        self.async_es = async_es
 
     def create_agent(self, data: AgentCreate) -> AgentInDB:
         """
@@ -28,6 +33,8 @@ class AgentService:
         # set timestamps
         doc["created_at"] = now
         doc["updated_at"] = now
+        # شمارنده‌های توکن همه مکالمه‌ها (ConversationService آن‌ها را افزایش می‌دهد)
+        doc.update({"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
 
         self.es.index(index=INDEX, id=agent_id, document=doc)
         # return a fully populated Pydantic instance
@@ -47,24 +54,33 @@ class AgentService:
         src = res["_source"]
         return AgentOut(id=res["_id"], **src)
 
-    def list_agents(self, size: int = 10, from_: int = 0) -> List[AgentOut]:
+    async def get_agent_async(self, agent_id: str) -> Optional[AgentOut]:
         """
-        - Paginated search sorted by created_at descending  
+        - Same as get_agent, over the async ES client  
+        - Used on the chat-turn path so the event loop is never blocked  
+        """
+        try:
+            res = await self.async_es.get(index=INDEX, id=agent_id)
+        except NotFoundError:
+            return None
+
+        src = res["_source"]
+        return AgentOut(id=res["_id"], **src)
+
+    def list_agents(self, size: int = 10, cursor: Optional[str] = None) -> Tuple[List[AgentOut], Optional[str]]:
+        """
+        - Cursor-paginated search (search_after + PIT) sorted by created_at descending  
         - Wrap each hit into AgentOut  
+        - Returns (agents, next_cursor); next_cursor is None on the last page  
         """
-        resp = self.es.search(
-            index=INDEX,
-            body={
-                "from": from_,
-                "size": size,
-                "sort": [{"created_at": {"order": "desc"}}],
-            },
+        hits, next_cursor = search_page_sync(
+            self.es, INDEX, [{"created_at": {"order": "desc"}}], size, cursor=cursor
         )
         agents: List[AgentOut] = []
-        for hit in resp["hits"]["hits"]:
+        for hit in hits:
             src = hit["_source"]
             agents.append(AgentOut(id=hit["_id"], **src))
-        return agents
+        return agents, next_cursor
 
     # def update_agent(self, agent_id: str, data: AgentUpdate) -> Optional[AgentOut]:
     #     """
@@ -115,6 +131,9 @@ class AgentService:
             return None
         src = existing.dict(by_alias=True)
         src.pop("id", None) 
+        # شمارنده‌های توکن فقط با script افزایش می‌یابند؛ بازنویسی آن‌ها افزایش‌های هم‌زمان را گم می‌کند
+        for counter in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            src.pop(counter, None)
 
         # 3. deep-merge
         merged = deep_merge(src, incoming)
@@ -126,6 +145,9 @@ class AgentService:
             id=agent_id,
             body={"doc": merged}
         )
+        # header کامپایل‌شده این worker؛ سایر workerها با updated_at جدید خودشان دوباره کامپایل می‌کنند
+        prompt_header_cache.invalidate(agent_id)
+        conversation_manager.invalidate_agent(agent_id)
         return self.get_agent(agent_id)
 
     def delete_agent_indices(
@@ -172,6 +194,8 @@ class AgentService:
             self.delete_agent_indices(self.es, agent_id, patterns)
         
             self.es.delete(index=INDEX, id=agent_id)
+            prompt_header_cache.invalidate(agent_id)
+            conversation_manager.invalidate_agent(agent_id)
             return True
         except NotFoundError:
             return False
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import posixpath
+from typing import Any, Dict, Iterable, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from app.api.v1.schemas.agents import AgentOut, AgentToolName
+from app.core.config import settings
+from app.llm.tools import Tool, ToolError, ToolRegistry
+from app.services.file_service import FileService
+
+logger = logging.getLogger(__name__)
+
+# محتوای فایل فقط برای این نوع‌ها به صورت متن به مدل داده می‌شود
+_TEXT_CONTENT_TYPES = ("text/", "application/json", "application/xml", "application/x-yaml")
+# سقف حجم فایلی که file_lookup می‌خواند (بایت)
+MAX_FILE_BYTES = 512 * 1024
+# سقف طول هر فیلد متنی در نتایج knowledge_search (کاراکتر)
+MAX_HIT_FIELD_CHARS = 1500
+
+
+def _attachment_field(att: Any, field: str) -> Optional[str]:
+    return att.get(field) if isinstance(att, dict) else getattr(att, field, None)
+
+
+def _file_lookup_tool(file_svc: FileService, agent_files: Iterable[str], attachments: Iterable[Any]) -> Tool:
+    """
+    - Every file is resolved by its exact object key (FileService.stat_file), never by listing the bucket
+    - Attachments are found by id or filename (both appear in their `[Attachment: ...]` line);
+      their key is "{upload_prefix}/{id}_{filename}"
+    - Agent files (AgentBase.files) are object keys, relative to the upload prefix unless they start with it;
+      matched by the entry, its base name or, for uploads ("{id}_{filename}"), the original filename
+    """
+    prefix = f"{file_svc.upload_prefix}/"
+    object_names: Dict[str, str] = {}  # id / filename / مسیر → کلید object
+    for att in attachments:
+        file_id = _attachment_field(att, "id")
+        filename = _attachment_field(att, "filename")
+        if not file_id or not filename:
+            continue
+        object_name = f"{prefix}{file_id}_{filename}"
+        object_names[file_id] = object_name
+        object_names.setdefault(filename, object_name)
+    agent_entries: List[str] = []
+    for entry in agent_files:
+        entry = entry.strip().lstrip("/")
+        if not entry:
+            continue
+        agent_entries.append(entry)
+        object_name = entry if entry.startswith(prefix) else prefix + entry
+        base = posixpath.basename(entry)
+        for name in (entry, base, base.split("_", 1)[1] if "_" in base else None):
+            if name:
+                object_names.setdefault(name, object_name)
+
+    async def file_lookup(file: str) -> Dict[str, Any]:
+        key = (file or "").strip()
+        object_name = object_names.get(key) or object_names.get(posixpath.basename(key))
+        if object_name is None:
+            raise ToolError(f"File {key} is not available to this agent")
+        info = await asyncio.to_thread(file_svc.stat_file, object_name)
+        if info is None:
+            raise ToolError(f"File {key} not found")
+        out: Dict[str, Any] = {
+            "id": info.id,
+            "filename": info.filename,
+            "content_type": info.content_type,
+            "size": info.size,
+            "url": info.url,
+        }
+        if info.content_type.startswith(_TEXT_CONTENT_TYPES) and info.size <= MAX_FILE_BYTES:
+            data = await asyncio.to_thread(file_svc.get_file_content, object_name)
+            if data is not None:
+                out["content"] = data.decode("utf-8", errors="replace")
+        return out
+
+    description = (
+        "Get a file available in this conversation: metadata, download URL and, for text files, the content. "
+        "User attachments are referenced by the id or filename shown in their [Attachment: ...] line."
+    )
+    if agent_entries:
+        description += " Agent files: " + ", ".join(sorted(set(agent_entries))) + "."
+    return Tool(
+        name=AgentToolName.file_lookup.value,
+        description=description,
+        parameters={
+            "type": "object",
+            "properties": {
+                "file": {"type": "string", "description": "Attachment id or filename, or one of the agent files"},
+            },
+            "required": ["file"],
+        },
+        handler=file_lookup,
+        timeout=settings.AGENT_TOOL_TIMEOUT,
+    )
+
+
+def _trim_source(source: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for key, value in source.items():
+        if isinstance(value, str) and len(value) > MAX_HIT_FIELD_CHARS:
+            value = value[:MAX_HIT_FIELD_CHARS] + " …"
+        elif isinstance(value, list) and value and isinstance(value[0], float):
+            continue  # بردارهای embedding برای مدل بی‌فایده‌اند
+        out[key] = value
+    return out
+
+
+def _knowledge_search_tool(es: AsyncElasticsearch, indices: List[str]) -> Tool:
+    async def knowledge_search(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        if not query.strip():
+            raise ToolError("query must not be empty")
+        res = await es.search(
+            index=",".join(indices),
+            body={"query": {"simple_query_string": {"query": query}}, "size": max(1, min(int(top_k), 10))},
+            ignore_unavailable=True,
+        )
+        return [
+            {"index": h["_index"], "id": h["_id"], "score": h.get("_score"), "source": _trim_source(h["_source"])}
+            for h in res["hits"]["hits"]
+        ]
+
+    return Tool(
+        name=AgentToolName.knowledge_search.value,
+        description="Full-text search in this agent's knowledge base. Returns the best matching documents.",
+        parameters={
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Search query in the language of the documents"},
+                "top_k": {"type": "integer", "description": "Number of results (1-10)", "default": 5},
+            },
+            "required": ["query"],
+        },
+        handler=knowledge_search,
+        timeout=settings.AGENT_TOOL_TIMEOUT,
+    )
+
+
+def build_agent_tools(
+    agent: AgentOut,
+    file_svc: FileService,
+    es: AsyncElasticsearch,
+    attachments: Optional[Iterable[Any]] = None,
+) -> ToolRegistry:
+    """
+    - Registry of the built-in tools enabled on the agent (`agent.tools`)
+    - file_lookup only sees the agent's files and the conversation's attachments
+      (`attachments`: FileAttachment models or {"id","filename","url"} dicts)
+    - knowledge_search is skipped when the agent has no `indices`
+    """
+    registry = ToolRegistry()
+    for name in agent.tools:
+        if name == AgentToolName.file_lookup:
+            registry.register(_file_lookup_tool(file_svc, agent.files, attachments or []))
+        elif name == AgentToolName.knowledge_search:
+            if agent.indices:
+                registry.register(_knowledge_search_tool(es, agent.indices))
+            else:
+                logger.warning(f"Agent {agent.id} enables knowledge_search but has no indices")
+    return registry
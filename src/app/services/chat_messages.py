@@ -0,0 +1,126 @@
+import bisect
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.api.v1.schemas.conversation import MessageOut
+from app.llm.tokenizer import count_tokens_batch
+from app.services.prompt_cache import CompiledPrompt
+
+ChatMessage = Dict[str, str]
+
+_ROLES = ("system", "user", "assistant")
+
+
+def serialize_message(role: str, content: str, attachments: Iterable[Any] = ()) -> ChatMessage:
+    """
+    - One chat-completions message; attachments are announced at the end of the content
+    - `attachments` items may be FileAttachment models or {"id","filename","url"} dicts
+    - The id is shown so the file_lookup tool can be called with it
+    """
+    lines = [content or ""]
+    for att in attachments or []:
+        file_id = att.get("id") if isinstance(att, dict) else att.id
+        filename = att["filename"] if isinstance(att, dict) else att.filename
+        url = att["url"] if isinstance(att, dict) else att.url
+        ref = f"{filename} (id: {file_id})" if file_id else filename
+        lines.append(f"[Attachment: {ref} -> {url}]")
+    return {"role": role if role in _ROLES else "user", "content": "\n".join(lines)}
+
+
+class HistoryEntry:
+    __slots__ = ("message", "payload", "tokens")
+
+    def __init__(self, message: MessageOut, payload: ChatMessage, tokens: int):
+        self.message = message
+        self.payload = payload
+        self.tokens = tokens
+
+
+class ConversationHistory:
+    """
+    Append-only, already-serialized history of one conversation.
+
+    - Every message is serialized and token-counted once, when it is appended
+    - Entries stay ordered by created_at; the oldest are dropped beyond `max_messages`
+    - `truncated`: older messages of the conversation exist that are not in the history
+    """
+
+    def __init__(self, conv_id: str, max_messages: int = 200):
+        self.conv_id = conv_id
+        self.max_messages = max_messages
+        self.model: Optional[str] = None
+        self.truncated = False
+        self._entries: List[HistoryEntry] = []
+        self._ids: set = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def last_created_at(self) -> Optional[datetime]:
+        return self._entries[-1].message.created_at if self._entries else None
+
+    @property
+    def messages(self) -> List[MessageOut]:
+        return [e.message for e in self._entries]
+
+    @property
+    def payloads(self) -> List[ChatMessage]:
+        return [e.payload for e in self._entries]
+
+    @property
+    def token_counts(self) -> List[int]:
+        return [e.tokens for e in self._entries]
+
+    def extend(self, messages: List[MessageOut], model: str) -> int:
+        """
+        - Appends messages not seen yet; returns how many were added
+        - A model change (agent edited) recounts the cached entries once
+        """
+        if model != self.model:
+            if self._entries:
+                counts = count_tokens_batch([e.payload["content"] for e in self._entries], model)
+                for entry, tokens in zip(self._entries, counts):
+                    entry.tokens = tokens
+            self.model = model
+
+        # پاسخ‌های خالی (نوبت لغوشده قبل از اولین توکن) در prompt نمی‌آیند
+        fresh = [m for m in messages if m.id not in self._ids and m.content]
+        if not fresh:
+            return 0
+        payloads = [serialize_message(m.role, m.content, m.attachments) for m in fresh]
+        counts = count_tokens_batch([p["content"] for p in payloads], model)
+        for message, payload, tokens in zip(fresh, payloads, counts):
+            entry = HistoryEntry(message, payload, tokens)
+            last = self.last_created_at
+            if last is None or message.created_at >= last:
+                self._entries.append(entry)
+            else:
+                # پیامی که دیرتر از ES رسیده (مثلاً از worker دیگر)
+                keys = [e.message.created_at for e in self._entries]
+                self._entries.insert(bisect.bisect_right(keys, message.created_at), entry)
+            self._ids.add(message.id)
+
+        while len(self._entries) > self.max_messages:
+            self._ids.discard(self._entries.pop(0).message.id)
+            self.truncated = True
+        return len(fresh)
+
+
+def build_chat_messages(
+    header: CompiledPrompt,
+    summary: Optional[str],
+    history: List[ChatMessage],
+    user_message: ChatMessage,
+) -> List[ChatMessage]:
+    """
+    - Order: agent header, rolling summary, recent turns, new user message
+    - The header is byte-identical across turns and the history is append-only,
+      so consecutive turns share the longest possible prompt prefix
+    """
+    messages: List[ChatMessage] = list(header.messages)
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    messages.extend(history)
+    messages.append(user_message)
+    return messages
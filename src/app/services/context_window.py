@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.api.v1.schemas.conversation import ConversationOut, MessageOut
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.core.config import settings
+from app.llm.governor import PRIORITY_LOW
+from app.llm.model_catalog import model_catalog
+from app.llm.tokenizer import count_tokens, count_tokens_batch
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_MESSAGE = (
+    "You maintain a running summary of a chat between a user and an AI assistant. "
+    "Merge the previous summary with the new messages into one updated summary. "
+    "Keep facts, names, numbers, decisions, open questions and user preferences; drop small talk. "
+    "Write in the language of the conversation, as compact bullet points."
+)
+
+SaveSummary = Callable[[str, str, datetime], Awaitable[None]]
+
+
+class ContextWindow:
+    """
+    What goes into the prompt of one turn.
+
+    - `summary`: rolling summary of turns older than the verbatim window (may be None)
+    - `messages`: the most recent messages, verbatim, oldest first
+    - `to_fold`: older messages not yet covered by the summary (to be summarized in the background)
+    """
+
+    def __init__(
+        self,
+        summary: Optional[str],
+        messages: List[MessageOut],
+        to_fold: List[MessageOut],
+        history_tokens: int,
+        budget: int,
+    ):
+        self.summary = summary
+        self.messages = messages
+        self.to_fold = to_fold
+        self.history_tokens = history_tokens
+        self.budget = budget
+
+
+class ContextManager:
+    """
+    Keeps the prompt of a turn roughly constant in size.
+
+    - The last `max_turns` turns are kept verbatim, newest first, within a per-model token budget
+    - Everything older is represented by the conversation's rolling summary
+    """
+
+    def __init__(
+        self,
+        max_turns: int,
+        history_tokens: int,
+        model_budgets: Optional[Dict[str, int]] = None,
+    ):
+        self.max_turns = max_turns
+        self.history_tokens = history_tokens
+        self.model_budgets = model_budgets or {}
+
+    def budget_for(self, model: str, reserved_tokens: int) -> int:
+        """
+        - Token budget of summary + verbatim history for `model`
+        - Never more than what is left of the model window after `reserved_tokens`
+          (header, new message and max_tokens of the answer)
+        """
+        configured = self.model_budgets.get(model, self.history_tokens)
+        return max(0, min(configured, model_catalog.context_window(model) - reserved_tokens))
+
+    def build(
+        self,
+        conv: ConversationOut,
+        history: List[MessageOut],
+        model: str,
+        reserved_tokens: int,
+        token_counts: Optional[List[int]] = None,
+    ) -> ContextWindow:
+        """
+        - `token_counts`: per-message counts of `history` when already known (cached history)
+        """
+        budget = self.budget_for(model, reserved_tokens)
+        summary = conv.summary or None
+        used = count_tokens(summary, model) if summary else 0
+
+        # فقط پیام‌های بعد از آخرین پیامی که در summary آمده
+        picked = [
+            i for i, m in enumerate(history)
+            if conv.summary_upto is None or m.created_at > conv.summary_upto
+        ]
+        candidates = [history[i] for i in picked]
+        if token_counts is not None:
+            counts = [token_counts[i] for i in picked]
+        else:
+            counts = count_tokens_batch([m.content for m in candidates], model)
+
+        kept = 0
+        for tokens in reversed(counts):
+            if kept >= self.max_turns * 2 or used + tokens > budget:
+                break
+            used += tokens
+            kept += 1
+
+        split = len(candidates) - kept
+        return ContextWindow(
+            summary=summary,
+            messages=candidates[split:],
+            to_fold=candidates[:split],
+            history_tokens=used,
+            budget=budget,
+        )
+
+
+class ConversationSummarizer:
+    """
+    Folds old turns into the conversation's rolling summary, in the background, with a cheap model.
+
+    - At most one summarization per conversation at a time (per worker)
+    - The summary is extended incrementally: previous summary + newly folded messages
+    """
+
+    def __init__(self, model: str, max_tokens: int):
+        self.model = model
+        self.max_tokens = max_tokens
+        self._in_flight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.completed = 0
+        self.failed = 0
+
+    def schedule(
+        self,
+        conv_id: str,
+        previous_summary: Optional[str],
+        messages: List[MessageOut],
+        llm: Callable[..., Awaitable[LLMCallResult]],
+        save: SaveSummary,
+    ) -> None:
+        if not messages or conv_id in self._in_flight:
+            return
+        self._in_flight.add(conv_id)
+        task = asyncio.create_task(self._run(conv_id, previous_summary, messages, llm, save))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(
+        self,
+        conv_id: str,
+        previous_summary: Optional[str],
+        messages: List[MessageOut],
+        llm: Callable[..., Awaitable[LLMCallResult]],
+        save: SaveSummary,
+    ) -> None:
+        try:
+            lines = [f"{m.role}: {m.content}" for m in messages]
+            prompt = (
+                f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+                "New messages:\n" + "\n".join(lines)
+            )
+            result = await llm(
+                prompt=prompt,
+                system_message=SUMMARY_SYSTEM_MESSAGE,
+                llm_model_name=self.model,
+                api_key=settings.OPENAI_API_KEY,
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+                priority=PRIORITY_LOW,
+                return_full_response_dict=False,
+            )
+            if not result.success or not isinstance(result.content, str):
+                self.failed += 1
+                logger.warning(f"Conversation summary failed for {conv_id}: {result.error_detail}")
+                return
+            await save(conv_id, result.content.strip(), messages[-1].created_at)
+            self.completed += 1
+            logger.info(f"Conversation {conv_id} summary updated ({len(messages)} messages folded)")
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Conversation summary failed for {conv_id}: {e}", exc_info=True)
+        finally:
+            self._in_flight.discard(conv_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._in_flight), "completed": self.completed, "failed": self.failed}
+
+
+context_manager = ContextManager(
+    max_turns=settings.CONTEXT_MAX_TURNS,
+    history_tokens=settings.CONTEXT_HISTORY_TOKENS,
+    model_budgets=settings.CONTEXT_MODEL_BUDGETS,
+)
+
+summarizer = ConversationSummarizer(
+    model=settings.CONTEXT_SUMMARY_MODEL,
+    max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS,
+)
@@ -1,21 +1,147 @@
-from .ai_client import AIClient
-from app.db.session import SessionLocal
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.api.v1.schemas.agents import AgentOut
+from app.api.v1.schemas.conversation import ConversationOut, MessageOut
+from app.core.config import settings
+from app.services.chat_messages import ConversationHistory
+
+ConversationLoader = Callable[[str], Awaitable[Optional[ConversationOut]]]
+# (conv_id, after) → پیام‌های جدیدتر از after (قدیمی‌ترین اول)
+MessagesLoader = Callable[[str, Optional[datetime]], Awaitable[List[MessageOut]]]
+AgentLoader = Callable[[str], Awaitable[Optional[AgentOut]]]
+
+
+class ActiveConversation:
+    """یک مکالمه فعال: metadata + تاریخچه سریال‌شده اخیر."""
+
+    __slots__ = ("conv", "history", "validated_at")
+
+    def __init__(self, conv: ConversationOut, history: ConversationHistory):
+        self.conv = conv
+        self.history = history
+        self.validated_at = 0.0
+
 
 class ConversationManager:
-    def __init__(self, db):
-        self.db = db
-        self.ai = AIClient()
-
-    def start_conversation(self, agent_id: int):
-        # ایجاد رکورد Conversation در DB
-        # اضافه کردن پیام system (system_prompt)
-        # بازگرداندن conversation_id و welcomeMessage
-        ...
-
-    def send_message(self, conv_id: int, user_message: str):
-        # واکشی تاریخچه پیام‌ها از DB
-        # ساخت prompt شامل system + تاریخچه + پیام کاربر
-        # فراخوانی OpenAI
-        # ذخیره پیام کاربر و پیام assistant با تعداد توکن
-        # بازگرداندن پاسخ
-        ...
\ No newline at end of file
+    """
+    In-process, LRU-bounded cache of active conversations (per worker).
+
+    - Entry: conversation metadata + serialized recent history (ConversationHistory)
+    - Populated on first read; every message indexed by this worker is appended (write-through),
+      so a hot conversation never re-queries Elasticsearch for its own history
+    - After `ttl` seconds an entry is revalidated: metadata is re-read and only messages newer than
+      the cached tail are fetched (turns served by other workers)
+    - Agents are kept for `agent_ttl` seconds and invalidated on update/delete in this worker
+    """
+
+    def __init__(self, max_entries: int = 1000, max_messages: int = 200, ttl: float = 30.0, agent_ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.agent_ttl = agent_ttl
+        self._entries: "OrderedDict[str, ActiveConversation]" = OrderedDict()
+        self._agents: "OrderedDict[str, Tuple[AgentOut, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.agent_hits = 0
+        self.agent_misses = 0
+
+    async def load(
+        self, conv_id: str, load_conversation: ConversationLoader, load_messages: MessagesLoader
+    ) -> Tuple[Optional[ActiveConversation], List[MessageOut]]:
+        """
+        - (entry, messages not yet in entry.history); None if the conversation does not exist
+        - The caller appends the messages with `entry.history.extend(messages, model)`,
+          since token counts depend on the agent's model
+        """
+        now = time.monotonic()
+        entry = self._entries.get(conv_id)
+        if entry is not None:
+            self._entries.move_to_end(conv_id)
+            if now - entry.validated_at < self.ttl:
+                self.hits += 1
+                return entry, []
+            self.revalidations += 1
+        else:
+            self.misses += 1
+
+        conv = await load_conversation(conv_id)
+        if conv is None:
+            self.invalidate(conv_id)
+            return None, []
+        if entry is None:
+            entry = ActiveConversation(conv, ConversationHistory(conv_id, max_messages=self.max_messages))
+            self._entries[conv_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        entry.conv = conv
+        # پیام‌های خلاصه‌شده هم می‌مانند (پاسخ send_message)؛ پنجره context با summary_upto کنارشان می‌گذارد
+        messages = await load_messages(conv_id, entry.history.last_created_at)
+        # یک بار کامل سقف: ممکن است پیام‌های قدیمی‌تری در ES باشد
+        if len(messages) >= self.max_messages:
+            entry.history.truncated = True
+        entry.validated_at = now
+        return entry, messages
+
+    def peek(self, conv_id: str) -> Optional[ActiveConversation]:
+        return self._entries.get(conv_id)
+
+    def append(self, conv_id: str, message: MessageOut) -> None:
+        """write-through پیام ایندکس‌شده؛ مکالمه‌ای که هنوز یک نوبت کامل ندیده (model نامعلوم) در اولین load خوانده می‌شود."""
+        entry = self._entries.get(conv_id)
+        if entry is not None and entry.history.model:
+            entry.history.extend([message], entry.history.model)
+
+    def set_summary(self, conv_id: str, summary: str, upto: datetime) -> None:
+        entry = self._entries.get(conv_id)
+        if entry is not None:
+            entry.conv = entry.conv.copy(update={"summary": summary, "summary_upto": upto})
+
+    def invalidate(self, conv_id: str) -> None:
+        self._entries.pop(conv_id, None)
+
+    async def agent(self, agent_id: str, load_agent: AgentLoader) -> Optional[AgentOut]:
+        cached = self._agents.get(agent_id)
+        if cached is not None and time.monotonic() - cached[1] < self.agent_ttl:
+            self._agents.move_to_end(agent_id)
+            self.agent_hits += 1
+            return cached[0]
+        self.agent_misses += 1
+        agent = await load_agent(agent_id)
+        if agent is None:
+            self._agents.pop(agent_id, None)
+            return None
+        self._agents[agent_id] = (agent, time.monotonic())
+        self._agents.move_to_end(agent_id)
+        while len(self._agents) > self.max_entries:
+            self._agents.popitem(last=False)
+        return agent
+
+    def invalidate_agent(self, agent_id: str) -> None:
+        self._agents.pop(agent_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses + self.revalidations
+        agent_total = self.agent_hits + self.agent_misses
+        return {
+            "conversations": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "agents": len(self._agents),
+            "agent_hit_ratio": round(self.agent_hits / agent_total, 4) if agent_total else 0.0,
+        }
+
+
+conversation_manager = ConversationManager(
+    max_entries=settings.CHAT_HISTORY_CACHE_SIZE,
+    max_messages=settings.CHAT_HISTORY_MAX_MESSAGES,
+    ttl=settings.CONVERSATION_CACHE_TTL,
+    agent_ttl=settings.AGENT_CACHE_TTL,
+)
@@ -1,86 +1,266 @@
+import asyncio
+import json
+import logging
 import uuid
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import Any, AsyncGenerator, Awaitable, Callable, List, Optional, Dict, Set, Tuple
 
-from elasticsearch import Elasticsearch, NotFoundError
-import openai
-import time
+from elasticsearch import AsyncElasticsearch, NotFoundError
 from app.api.v1.schemas.conversation import (
     ConversationCreate, ConversationInDB, ConversationOut, ConversationWithMessages,
-    MessageCreate, MessageInDB, MessageOut
+    MessageCreate, MessageInDB, MessageOut, MessageStatus, TokenUsage
 )
+from app.utils.pagination import cursor_scope, search_page, start_cursor
+from app.api.v1.schemas.agents import ReleaseType, RoutingPolicy
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.llm.governor import PRIORITY_HIGH, PRIORITY_NORMAL
+from app.llm.tokenizer import count_tokens, count_message_tokens
+from app.llm.model_catalog import model_catalog
+from app.core.config import settings
+from app.db.indices.agents import agent_index_name
+from app.db.indices.conversations import conversation_index_name, message_index_name
 from app.services.file_service import FileService
 from app.services.agent_es_service import AgentService
-from app.core.dependencies import get_es_client
+from app.services.prompt_cache import prompt_header_cache
+from app.services.context_window import context_manager, summarizer
+from app.services.chat_messages import build_chat_messages, serialize_message
+from app.services.conversation_manager import conversation_manager
+from app.services.message_writer import message_writer
+from app.services.agent_tools import build_agent_tools
+from app.llm.tools import ToolRegistry
+
+logger = logging.getLogger(__name__)
 
 # ایندکس‌ها
-CONV_INDEX = "conversations"
-MSG_INDEX  = "messages"
+CONV_INDEX = conversation_index_name
+MSG_INDEX  = message_index_name
+MSG_SORT = [{"created_at": {"order": "asc"}}]
+
+# افزایش اتمی شمارنده‌های توکن سند conversation/agent (در همان _bulk پیام)؛
+# سندهای ساخته‌شده پیش از شمارنده‌ها با اولین پیام شمرده‌شده از صفر شروع می‌کنند و
+# counters_since (created_at همان پیام) می‌گیرند؛ پیام‌های پیش از آن را token_usage یک بار جمع و fold می‌کند.
+# idempotent با کلید message_id: آخرین شناسه‌های شمرده‌شده در counted_messages می‌مانند تا
+# ارسال دوباره همان _bulk (خطای انتقال پس از اعمال در ES) شمارنده‌ها را دوبار افزایش ندهد
+TOKEN_COUNTERS_SCRIPT = (
+    "def seen = ctx._source.counted_messages;"
+    " if (seen == null) { seen = new ArrayList(); ctx._source.counted_messages = seen; }"
+    " if (seen.contains(params.message_id)) { ctx.op = 'noop'; } else {"
+    " if (ctx._source.total_tokens == null) { ctx._source.counters_since = params.created_at; }"
+    " for (def f : params.counters.keySet()) {"
+    " ctx._source[f] = (ctx._source[f] == null ? 0 : ctx._source[f]) + params.counters[f]; }"
+    " seen.add(params.message_id);"
+    " while (seen.size() > params.window) { seen.remove(0); } }"
+)
+# جمع پیام‌های پیش از counters_since به شمارنده‌ها اضافه و counters_since حذف می‌شود؛
+# فقط اگر counters_since همان مقداری باشد که جمع برایش گرفته شده (fold دوباره → noop)
+TOKEN_COUNTERS_FOLD_SCRIPT = (
+    "if (ctx._source.counters_since != null && ctx._source.counters_since == params.since) {"
+    " for (def f : params.counters.keySet()) {"
+    " ctx._source[f] = (ctx._source[f] == null ? 0 : ctx._source[f]) + params.counters[f]; }"
+    " ctx._source.remove('counters_since'); }"
+    " else { ctx.op = 'noop'; }"
+)
+TOKEN_COUNTERS_RETRY_ON_CONFLICT = 5
+# تعداد شناسه پیام‌هایی که هر سند برای تشخیص افزایش تکراری نگه می‌دارد
+TOKEN_COUNTERS_DEDUP_WINDOW = 200
+
+# Request.is_disconnected یا هر تابع async هم‌ارز
+DisconnectCheck = Callable[[], Awaitable[bool]]
+
+# taskهای pump پاسخ stream؛ تا پایان ذخیره پاسخ (حتی بعد از قطع کلاینت) نگه داشته می‌شوند
+_stream_pumps: Set[asyncio.Task] = set()
+
+
+class LLMCallFailedError(Exception):
+    """
+    فراخوانی LLM در یک نوبت چت ناموفق بود؛ LLMCallResult اصلی در `result` نگه داشته می‌شود.
+    """
+    def __init__(self, result: LLMCallResult):
+        super().__init__(result.error_detail or result.message)
+        self.result = result
+
+
+class TurnCancelledError(Exception):
+    """
+    کلاینت قبل از آماده شدن پاسخ قطع شد؛ فراخوانی LLM لغو و پیام با status=cancelled ذخیره شده است.
+    """
+    def __init__(self, message: MessageInDB):
+        super().__init__("Client disconnected before the answer was complete")
+        self.message = message
+
+
+class MessageWriteError(Exception):
+    """
+    پیامی که با refresh (read-your-writes) ذخیره می‌شد در ES ذخیره نشد
+    (ack ناموفق message_writer پس از همه retryها).
+    """
+
+
+def _add_usage(total: Optional[Dict[str, Any]], usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """جمع usage مراحل یک نوبت (فراخوانی‌های tool)."""
+    if not usage:
+        return total
+    if total is None:
+        return dict(usage)
+    merged = dict(total)
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        merged[key] = int(merged.get(key) or 0) + int(usage.get(key) or 0)
+    return merged
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """یک رویداد Server-Sent Events با داده JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 
 class ConversationService:
-    def __init__(self, es, llm_client, agent_svc: AgentService, file_svc: FileService):
+    def __init__(self, es: AsyncElasticsearch, llm_client, agent_svc: AgentService, file_svc: FileService):
         self.es = es
         self.llm = llm_client
         self.agent_svc = agent_svc
         self.file_svc = file_svc
 
     # 1. Conversation CRUD
-    def create_conversation(self, data: ConversationCreate) -> ConversationInDB:
+    async def create_conversation(self, data: ConversationCreate) -> ConversationInDB:
         conv_id = str(uuid.uuid4())
         now = datetime.utcnow()
-        doc = {"agent_id": data.agent_id, "title": data.title, "created_at": now}
-        self.es.index(index=CONV_INDEX, id=conv_id, document=doc)
+        doc = {
+            "agent_id": data.agent_id, "title": data.title, "created_at": now,
+            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+        }
+        await self.es.index(index=CONV_INDEX, id=conv_id, document=doc)
         return ConversationInDB(id=conv_id, **doc)
 
-    def get_conversation(self, conv_id: str) -> Optional[ConversationOut]:
+    async def get_conversation(self, conv_id: str) -> Optional[ConversationOut]:
         try:
-            res = self.es.get(index=CONV_INDEX, id=conv_id)
+            res = await self.es.get(index=CONV_INDEX, id=conv_id)
         except NotFoundError:
             return None
         src = res["_source"]
         return ConversationOut(id=res["_id"], **src)
 
-    def list_conversations(self, size: int=10, from_: int=0) -> List[ConversationOut]:
-        res = self.es.search(
-            index=CONV_INDEX,
-            body={"from": from_, "size": size, "sort":[{"created_at":{"order":"desc"}}]}
+    async def list_conversations(
+        self, size: int = 10, cursor: Optional[str] = None
+    ) -> Tuple[List[ConversationOut], Optional[str]]:
+        """جدیدترین اول؛ (conversations، next_cursor) با search_after + PIT."""
+        hits, next_cursor = await search_page(
+            self.es, CONV_INDEX, [{"created_at": {"order": "desc"}}], size, cursor=cursor
         )
         out = []
-        for h in res["hits"]["hits"]:
+        for h in hits:
             src = h["_source"]
             out.append(ConversationOut(id=h["_id"], **src))
-        return out
+        return out, next_cursor
 
     # 2. Message CRUD + LLM
-    def list_messages(self, conv_id: str, size:int=100, from_:int=0) -> List[MessageOut]:
-        res = self.es.search(
-            index=MSG_INDEX,
-            body={
-                "query": {"term": {"conversation_id": conv_id}},
-                "sort": [{"created_at": {"order": "asc"}}],
-                "from": from_, "size": size
-            }
+    @staticmethod
+    def _messages_query(conv_id: str, before: Optional[str] = None) -> Dict[str, Any]:
+        query: Dict[str, Any] = {"term": {"conversation_id": conv_id}}
+        if before is not None:
+            query = {"bool": {"filter": [query, {"range": {"created_at": {"lt": before}}}]}}
+        return query
+
+    def _older_messages_cursor(self, conv_id: str, history: List[MessageOut]) -> Optional[str]:
+        """
+        - Cursor of the messages older than `history` (list_messages narrowed with created_at < oldest)
+        - None if `history` starts at the first message of the conversation
+        """
+        if not history:
+            return None
+        before = history[0].created_at.isoformat()
+        return start_cursor(MSG_INDEX, MSG_SORT, self._messages_query(conv_id, before), {"before": before})
+
+    async def list_messages(
+        self, conv_id: str, size: int = 100, cursor: Optional[str] = None
+    ) -> Tuple[List[MessageOut], Optional[str]]:
+        """
+        قدیمی‌ترین اول؛ (messages، next_cursor) با search_after + PIT، بدون سقف روی طول مکالمه.
+        cursor حاصل از send_message فقط پیام‌های قدیمی‌تر از تاریخچه برگردانده‌شده را می‌دهد (scope.before).
+        """
+        scope = cursor_scope(cursor)
+        hits, next_cursor = await search_page(
+            self.es, MSG_INDEX, MSG_SORT, size,
+            query=self._messages_query(conv_id, scope.get("before")), cursor=cursor, scope=scope,
         )
         msgs = []
-        for h in res["hits"]["hits"]:
+        for h in hits:
             src = h["_source"]
             msgs.append(MessageOut(id=h["_id"], **src))
-        return msgs
+        return msgs, next_cursor
     
-    def token_calculator(self, content):
-        return int(len(content)/2)
+    async def list_recent_messages(
+        self, conv_id: str, size: int = 100, after: Optional[datetime] = None
+    ) -> List[MessageOut]:
+        """
+        - Newest `size` messages of a conversation (optionally only those after `after`)
+        - Returned oldest first, like list_messages
+        """
+        query: Dict[str, Any] = {"term": {"conversation_id": conv_id}}
+        if after is not None:
+            query = {"bool": {"filter": [query, {"range": {"created_at": {"gt": after}}}]}}
+        res = await self.es.search(
+            index=MSG_INDEX,
+            body={"query": query, "sort": [{"created_at": {"order": "desc"}}], "size": size}
+        )
+        msgs = [MessageOut(id=h["_id"], **h["_source"]) for h in res["hits"]["hits"]]
+        msgs.reverse()
+        return msgs
+
+    async def _save_summary(self, conv_id: str, summary: str, upto: datetime) -> None:
+        """ذخیره خلاصه غلتان روی سند conversation (تا پیام ایجادشده در upto را پوشش می‌دهد)."""
+        await self.es.update(
+            index=CONV_INDEX,
+            id=conv_id,
+            body={"doc": {"summary": summary, "summary_upto": upto}},
+        )
+        conversation_manager.set_summary(conv_id, summary, upto)
+
+    def token_calculator(self, content: Optional[str], model: Optional[str] = None) -> int:
+        return count_tokens(content, model)
+
+    def _turn_tokens(
+        self, llm_kwargs: Dict[str, Any], usage: Optional[Dict[str, Any]], assistant_text: str
+    ) -> Tuple[int, int]:
+        """
+        (prompt_tokens, completion_tokens) یک نوبت:
+        از usage ارائه‌دهنده در صورت وجود، وگرنه با tokenizer مدل روی همان پیام‌های ارسالی.
+        """
+        if usage and usage.get("prompt_tokens") is not None:
+            return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+        model = llm_kwargs.get("llm_model_name")
+        prompt_messages = llm_kwargs.get("messages")
+        if not prompt_messages:
+            prompt_messages = [{"role": "user", "content": llm_kwargs.get("prompt")}]
+            if llm_kwargs.get("system_message"):
+                prompt_messages.insert(0, {"role": "system", "content": llm_kwargs["system_message"]})
+        return count_message_tokens(prompt_messages, model), self.token_calculator(assistant_text, model)
 
-    def _index_message(
+    async def _index_message(
         self,
         conv_id: str,
         role: str,
         content: str,
         attachments: Optional[List[Dict]] = None,
-        token_usage: int = 0
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        stream_metrics: Optional[Dict[str, Any]] = None,
+        status: MessageStatus = MessageStatus.completed,
+        refresh: Optional[str] = None,
+        add_to_counters: bool = False,
+        acks: Optional[List[asyncio.Future]] = None
     ) -> MessageInDB:
         """
         ایندکس یک پیام در ES به همراه ضمیمه‌ها (در صورت وجود).
         attachments: لیستی از dictهای {"id","filename","url"}.
+        token_usage = prompt_tokens + completion_tokens
+        add_to_counters: شمارنده‌های توکن مکالمه و agent آن هم در همان _bulk افزایش می‌یابند؛
+        برای هر پاسخ assistant، لغوشده هم (prompt_tokens آن پیام کاربر را هم در بر دارد)
+        stream_metrics: زمان‌بندی پاسخ stream شده (TTFT، inter-token، tokens/s)
+        status: cancelled برای پاسخ ناقصی که کلاینتش قطع شده است
+        refresh: "wait_for" فقط وقتی فراخواننده خواندن فوری پیام از ES را لازم دارد (read-your-writes)
+        با message_writer فعال، پیام در _bulk بعدی ذخیره می‌شود و نوبت منتظر ES نمی‌ماند
+        (با refresh: flush و انتظار برای ack همین پیام؛ شکست → MessageWriteError)
+        acks: ack پیام به این لیست اضافه می‌شود تا پس از پاسخ در پس‌زمینه بررسی شود (_watch_writes)
         """
         msg_id = str(uuid.uuid4())
         now = datetime.utcnow()
@@ -92,22 +272,126 @@ class ConversationService:
             "content": content,
             "attachments": atts,
             "created_at": now,
-            "token_usage": token_usage
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "token_usage": prompt_tokens + completion_tokens,
+            "status": status.value
+        }
+        if stream_metrics:
+            doc["stream_metrics"] = stream_metrics
+        if message_writer.running:
+            ack = message_writer.index(MSG_INDEX, msg_id, doc, refresh=refresh)
+            if refresh:
+                await message_writer.flush()
+                try:
+                    await ack
+                except Exception as e:
+                    conversation_manager.invalidate(conv_id)
+                    raise MessageWriteError(f"Message could not be stored: {e}") from e
+            elif acks is not None:
+                acks.append(ack)
+        else:
+            await self.es.index(index=MSG_INDEX, id=msg_id, document=doc, refresh=refresh)
+        if add_to_counters and doc["token_usage"]:
+            await self._add_token_counters(conv_id, msg_id, now, prompt_tokens, completion_tokens)
+        msg = MessageInDB(id=msg_id, **doc)
+        # write-through به مکالمه فعال این worker (اگر در cache باشد)
+        conversation_manager.append(conv_id, MessageOut(**msg.dict()))
+        return msg
+
+    def _watch_writes(self, conv_id: str, acks: List[asyncio.Future]) -> None:
+        """
+        - The turn does not wait for Elasticsearch: the acks of its messages are checked in the background
+        - A message that could not be stored (after message_writer's retries) is logged and the cached
+          history (which already holds it through write-through) is dropped, so the next turn re-reads ES
+        """
+        if not acks:
+            return
+
+        def check(done: asyncio.Future) -> None:
+            if done.cancelled():
+                return
+            errors = [r for r in done.result() if isinstance(r, BaseException)]
+            if errors:
+                logger.error(f"Messages of conversation {conv_id} could not be stored: {errors[0]}")
+                conversation_manager.invalidate(conv_id)
+
+        asyncio.gather(*acks, return_exceptions=True).add_done_callback(check)
+
+    async def _add_token_counters(
+        self, conv_id: str, message_id: str, created_at: datetime, prompt_tokens: int, completion_tokens: int
+    ) -> None:
+        """
+        - Scripted increment of the conversation's and its agent's token counters
+        - Documents without counters (created before them) start at this message and record
+          its created_at as counters_since
+        - Keyed on message_id: applying the same message twice (a resent bulk) is a no-op
+        - Queued on message_writer (no extra round trip per message), else sent with es.update
+        - Failures are logged only: the message itself is already stored
+        """
+        body = {
+            "script": {
+                "source": TOKEN_COUNTERS_SCRIPT,
+                "lang": "painless",
+                "params": {
+                    "message_id": message_id,
+                    "created_at": created_at.isoformat(),
+                    "window": TOKEN_COUNTERS_DEDUP_WINDOW,
+                    "counters": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            }
         }
-        self.es.index(index=MSG_INDEX, id=msg_id, document=doc)
-        return MessageInDB(id=msg_id, **doc)
-            
-    def send_message(
-        self, conv_id: str, user_msg: MessageCreate
-    ) -> ConversationWithMessages:
-        """
-        1) ایندکس پیام کاربر به همراه attachments
-        2) ساخت prompt با system + history + user+attachments
-        3) فراخوانی LLM واسط شما
-        4) ایندکس پاسخ Assistant
-        5) بازیابی و برگرداندن کل مکالمه
-        """
-        # 1) آماده‌سازی لیست ضمیمه‌ها با presigned URL
+        # agent_id از مکالمه فعال این worker؛ در غیر این صورت یک get
+        active = conversation_manager.peek(conv_id)
+        conv = active.conv if active is not None else await self.get_conversation(conv_id)
+        targets = [(CONV_INDEX, conv_id)]
+        if conv is not None and conv.agent_id:
+            targets.append((agent_index_name, conv.agent_id))
+        for index, doc_id in targets:
+            if message_writer.running:
+                message_writer.update(index, doc_id, body, retry_on_conflict=TOKEN_COUNTERS_RETRY_ON_CONFLICT)
+                continue
+            try:
+                await self.es.update(
+                    index=index, id=doc_id, body=body, retry_on_conflict=TOKEN_COUNTERS_RETRY_ON_CONFLICT
+                )
+            except Exception as e:
+                logger.error(f"Token counters update failed for {index}/{doc_id}: {e}")
+
+    async def _prepare_turn(
+        self, conv_id: str, user_msg: MessageCreate, refresh: Optional[str] = None,
+        acks: Optional[List[asyncio.Future]] = None
+    ) -> Optional[Tuple[ConversationOut, List[MessageOut], Optional[str], MessageInDB, Dict[str, Any], ToolRegistry]]:
+        """
+        مراحل مشترک send_message و stream_message:
+        1) بارگذاری conversation و تاریخچه از conversation_manager (مکالمه فعال: بدون ES) و agent (هم‌زمان)
+        2) ایندکس پیام کاربر به همراه attachments (ack آن به acks اضافه می‌شود)
+        3) ساخت messages: header کامپایل‌شده agent + خلاصه غلتان + N نوبت آخر (در بودجه توکن مدل)
+           + user+attachments؛ پیام‌های قبلی یک بار سریال می‌شوند (ConversationHistory)
+           مدل: llm_model_name یا (routing_policy=fastest) انتخاب model_catalog؛ max_tokens از response_length
+        4) پیام‌های خارج از پنجره در پس‌زمینه به خلاصه اضافه می‌شوند
+        5) toolهای فعال agent (agent.tools) برای این نوبت
+        خروجی: (conversation، تاریخچه قبل از این نوبت، cursor پیام‌های قدیمی‌تر از آن (اگر تاریخچه بریده شده باشد)،
+        پیام کاربر ذخیره‌شده، پارامترهای llm_async، tool registry) یا None
+        """
+        # 1) بارگذاری conversation و agent
+        # تا سقف تاریخچه cache؛ پیام‌های جدیدتر از دنباله cache بدون شکاف خوانده می‌شوند
+        active, new_messages = await conversation_manager.load(
+            conv_id, self.get_conversation,
+            lambda cid, after: self.list_recent_messages(cid, size=settings.CHAT_HISTORY_MAX_MESSAGES, after=after),
+        )
+        if active is None:
+            return None
+        conv, cached = active.conv, active.history
+        agent = await conversation_manager.agent(conv.agent_id, self.agent_svc.get_agent_async)
+        if not agent:
+            return None
+
+        # 2) آماده‌سازی لیست ضمیمه‌ها با presigned URL
         atts_for_index: List[Dict] = []
         for a in user_msg.attachments or []:
             # a.id, a.filename
@@ -117,70 +401,397 @@ class ConversationService:
                 "filename": a.filename,
                 "url": url,
             })
-        # محاسبه توکن
-        token_usage = self.token_calculator(user_msg.content) or 0
-        # ذخیره پیام کاربر
-        self._index_message(conv_id, "user", user_msg.content, atts_for_index, token_usage)
-
-        # بارگذاری conversation و agent
-        conv = self.get_conversation(conv_id)
-        if not conv:
-            return None
-        agent = self.agent_svc.get_agent(conv.agent_id)
-        if not agent:
+        rs = agent.response_settings
+        # header ثابت agent (یک بار به ازای هر updated_at کامپایل می‌شود)
+        header = prompt_header_cache.get(agent)
+        model = header.model
+        # فقط پیام‌های جدید سریال و شمرده می‌شوند
+        cached.extend(new_messages, model)
+        history = cached.messages
+        # پیش از write-through پیام کاربر که ممکن است قدیمی‌ترین پیام را از cache بیرون کند
+        older_cursor = self._older_messages_cursor(conv_id, history) if cached.truncated else None
+        payloads = cached.payloads
+        token_counts = cached.token_counts
+        # ذخیره پیام کاربر (توکن‌های ورودی با tokenizer مدل agent)
+        user_tokens = self.token_calculator(user_msg.content, model)
+        user_message = await self._index_message(
+            conv_id, "user", user_msg.content, atts_for_index, prompt_tokens=user_tokens, refresh=refresh,
+            acks=acks,
+        )
+
+        # 3) ساخت messages (بودجه تاریخچه: پنجره مدل منهای header، پیام جدید و max_tokens پاسخ)
+        max_tokens = model_catalog.max_tokens_for(model, rs.response_length)
+        window = context_manager.build(
+            conv, history, model, reserved_tokens=header.tokens + user_tokens + max_tokens,
+            token_counts=token_counts,
+        )
+        # پنجره همیشه یک پسوند از تاریخچه است
+        recent = payloads[len(payloads) - len(window.messages):]
+        messages = build_chat_messages(
+            header, window.summary, recent,
+            serialize_message("user", user_msg.content, atts_for_index),
+        )
+
+        # routing_policy=fastest: سریع‌ترین مدل کافی برای اندازه این prompt و response_length
+        if rs.routing_policy == RoutingPolicy.fastest:
+            prompt_tokens = header.tokens + window.history_tokens + user_tokens
+            model = model_catalog.route(model, prompt_tokens, rs.response_length)
+            max_tokens = model_catalog.max_tokens_for(model, rs.response_length)
+
+        llm_kwargs: Dict[str, Any] = {
+            "messages": messages,
+            "llm_model_name": model,
+            "max_tokens": max_tokens,
+            "api_key": settings.OPENAI_API_KEY,
+            "temperature": float(rs.creativity),
+            "use_cache": rs.cache_responses,
+            # agentهای public در صف governor جلوتر از private هستند
+            "priority": PRIORITY_HIGH if rs.release_type == ReleaseType.public else PRIORITY_NORMAL,
+        }
+
+        # 4) پیام‌های بیرون مانده از پنجره → خلاصه غلتان (بدون انتظار)
+        summarizer.schedule(conv_id, window.summary, window.to_fold, self.llm, self._save_summary)
+
+        # 5) toolها؛ file_lookup به ضمیمه‌های همین مکالمه هم دسترسی دارد
+        attachments: List[Any] = [a for m in history for a in m.attachments or []]
+        attachments.extend(atts_for_index)
+        tools = build_agent_tools(agent, self.file_svc, self.es, attachments)
+        return conv, history, older_cursor, user_message, llm_kwargs, tools
+
+    async def _until_disconnected(self, task: asyncio.Task, is_disconnected: DisconnectCheck) -> bool:
+        """
+        - منتظر task می‌ماند و هر CHAT_DISCONNECT_POLL_INTERVAL ثانیه اتصال کلاینت را بررسی می‌کند
+        - اگر کلاینت قطع شده باشد task لغو می‌شود (فراخوانی upstream و ظرفیت governor آزاد می‌شوند) و True برمی‌گردد
+        """
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=settings.CHAT_DISCONNECT_POLL_INTERVAL)
+                if done:
+                    return False
+                if await is_disconnected():
+                    task.cancel()
+                    await asyncio.wait({task})
+                    return True
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    async def _index_cancelled(
+        self, conv_id: str, llm_kwargs: Dict[str, Any], partial_text: str,
+        stream_metrics: Optional[Dict[str, Any]] = None
+    ) -> MessageInDB:
+        """
+        ذخیره پاسخ ناقص با status=cancelled.
+        usage ارائه‌دهنده فقط در انتهای پاسخ می‌آید، پس توکن‌ها با tokenizer روی همان
+        پیام‌های ارسالی و متن تولیدشده تا لحظه قطع شمرده می‌شوند.
+        مثل هر پاسخ assistant در شمارنده‌ها هم حساب می‌شود (ارائه‌دهنده تا لحظه قطع را محاسبه کرده است).
+        """
+        prompt_tokens, completion_tokens = self._turn_tokens(llm_kwargs, None, partial_text)
+        return await self._index_message(
+            conv_id, "assistant", partial_text, [], prompt_tokens, completion_tokens,
+            stream_metrics=stream_metrics, status=MessageStatus.cancelled, add_to_counters=True,
+        )
+
+    async def _call_llm(
+        self, conv_id: str, llm_kwargs: Dict[str, Any], is_disconnected: Optional[DisconnectCheck], **call_kwargs
+    ) -> LLMCallResult:
+        """
+        فراخوانی llm_async؛ با is_disconnected، در صورت قطع کلاینت لغو می‌شود و TurnCancelledError بالا می‌رود.
+        """
+        if is_disconnected is None:
+            result: LLMCallResult = await self.llm(**call_kwargs, **llm_kwargs)
+        else:
+            task = asyncio.create_task(self.llm(**call_kwargs, **llm_kwargs))
+            if await self._until_disconnected(task, is_disconnected):
+                raise TurnCancelledError(await self._index_cancelled(conv_id, llm_kwargs, ""))
+            result = task.result()
+        if not result.success:
+            raise LLMCallFailedError(result)
+        return result
+
+    def _step_kwargs(self, llm_kwargs: Dict[str, Any], tools: ToolRegistry, step: int) -> Dict[str, Any]:
+        """پارامترهای یک مرحله: tools در صورت وجود؛ مرحله آخر با tool_choice=none تا پاسخ متنی قطعی باشد."""
+        if not tools:
+            return llm_kwargs
+        kwargs = {**llm_kwargs, "tools": tools.specs()}
+        if step >= settings.AGENT_MAX_TOOL_STEPS:
+            kwargs["tool_choice"] = "none"
+        return kwargs
+
+    async def _run_tools(
+        self, llm_kwargs: Dict[str, Any], tools: ToolRegistry,
+        content: Optional[str], tool_calls: List[Dict[str, Any]]
+    ) -> None:
+        """
+        اجرای هم‌زمان tool callهای یک مرحله (هر کدام با timeout خودش) و افزودن
+        پیام assistant (tool_calls) و نتایج role=tool به messages برای مرحله بعد.
+        """
+        messages = llm_kwargs["messages"]
+        messages.append({"role": "assistant", "content": content or None, "tool_calls": tool_calls})
+        messages.extend(await tools.run_calls(tool_calls))
+
+    async def _tool_loop(
+        self, conv_id: str, llm_kwargs: Dict[str, Any], tools: ToolRegistry
+    ) -> Tuple[LLMCallResult, Optional[Dict[str, Any]]]:
+        """
+        مراحل یک نوبت غیر stream تا پاسخ متنی: فراخوانی LLM، اجرای toolهای خواسته‌شده و مرحله بعد.
+        (آخرین LLMCallResult، مجموع usage همه مراحل)
+        """
+        usage: Optional[Dict[str, Any]] = None
+        step = 0
+        while True:
+            result = await self._call_llm(
+                conv_id, self._step_kwargs(llm_kwargs, tools, step), None,
+                return_full_response_dict=False,
+            )
+            usage = _add_usage(usage, result.usage)
+            if not (tools and result.tool_calls):
+                return result, usage
+            step += 1
+            await self._run_tools(llm_kwargs, tools, result.content, result.tool_calls)
+
+    async def send_message(
+        self,
+        conv_id: str,
+        user_msg: MessageCreate,
+        is_disconnected: Optional[DisconnectCheck] = None,
+        refresh: bool = False
+    ) -> Optional[ConversationWithMessages]:
+        """
+        1) آماده‌سازی نوبت (_prepare_turn)
+        2) فراخوانی llm_async و دریافت LLMCallResult
+           (با is_disconnected: اگر کلاینت قطع شود فراخوانی یا tool در حال اجرا لغو و TurnCancelledError بالا می‌رود)
+           اگر مدل tool بخواهد، toolهای هر مرحله هم‌زمان اجرا و نتیجه به مدل برگردانده می‌شود
+        3) ایندکس پاسخ Assistant؛ ack ذخیره پیام‌های نوبت در پس‌زمینه بررسی می‌شود (_watch_writes)
+           (با refresh: انتظار برای ack و MessageWriteError در صورت شکست)
+        4) برگرداندن مکالمه از تاریخچه در دست + دو پیام همین نوبت (بدون جستجوی دوباره در ES)؛
+           تاریخچه بریده‌شده: next_cursor به پیام‌های قدیمی‌تر در list_messages
+        refresh: پیام‌ها با refresh="wait_for" ذخیره می‌شوند تا بلافاصله در جستجوهای ES دیده شوند
+        """
+        refresh_policy = "wait_for" if refresh else None
+        acks: List[asyncio.Future] = []
+        turn = await self._prepare_turn(conv_id, user_msg, refresh=refresh_policy, acks=acks)
+        if turn is None:
             return None
+        conv, history, older_cursor, user_message, llm_kwargs, tools = turn
+
+        # 2) فراخوانی LLM واسط (coroutine)؛ با tool: تا پاسخ متنی، مرحله به مرحله
+        # قطع کلاینت کل حلقه (فراخوانی‌های LLM و اجرای toolها) را لغو می‌کند
+        if is_disconnected is None:
+            result, usage = await self._tool_loop(conv_id, llm_kwargs, tools)
+        else:
+            task = asyncio.create_task(self._tool_loop(conv_id, llm_kwargs, tools))
+            if await self._until_disconnected(task, is_disconnected):
+                raise TurnCancelledError(await self._index_cancelled(conv_id, llm_kwargs, ""))
+            result, usage = task.result()
+        assistant_text = result.content if isinstance(result.content, str) else ""
 
-        # 2) ساخت prompt
+        # توکن ورودی پرامپت و خروجی مدل (usage واقعی همه مراحل در صورت وجود)
+        prompt_tokens, completion_tokens = self._turn_tokens(llm_kwargs, usage, assistant_text)
+        # 3) ایندکس پاسخ
+        assistant_message = await self._index_message(
+            conv_id, "assistant", assistant_text, [], prompt_tokens, completion_tokens, refresh=refresh_policy,
+            add_to_counters=True, acks=acks,
+        )
+        # پاسخ منتظر ack نمی‌ماند؛ شکست ذخیره لاگ و تاریخچه cache شده دور ریخته می‌شود
+        self._watch_writes(conv_id, acks)
+
+        # 4) مکالمه: پیام‌های اخیر (تا CHAT_HISTORY_MAX_MESSAGES) + پیام کاربر و پاسخ
+        # اگر تاریخچه بریده شده باشد، next_cursor بقیه را (قدیمی‌تر از اولین پیام) از list_messages می‌دهد
+        msgs = [*history, MessageOut(**user_message.dict()), MessageOut(**assistant_message.dict())]
+        return ConversationWithMessages(**conv.dict(), messages=msgs, next_cursor=older_cursor)
+
+    async def _pump_stream(
+        self, conv_id: str, llm_kwargs: Dict[str, Any], tools: ToolRegistry,
+        result: LLMCallResult, queue: asyncio.Queue, acks: List[asyncio.Future]
+    ) -> None:
+        """
+        خواندن stream از LLM در task مستقل و ارسال به صف رویدادهای SSE.
+        - اگر مدل tool بخواهد: ("tool", نام‌ها)، اجرای هم‌زمان toolها و stream مرحله بعد
+        - پایان عادی: ایندکس پاسخ کامل با usage واقعی، سپس ("done", {...}) بدون انتظار برای ack پیام‌ها
+        - لغو (قطع کلاینت): بستن stream upstream، ایندکس پاسخ ناقص با status=cancelled، سپس ("cancelled", msg)
+        """
         parts: List[str] = []
+        usage: Optional[Dict[str, Any]] = None
+        step = 0
+        try:
+            while True:
+                step_parts: List[str] = []
+                async for delta in result.stream_data:
+                    step_parts.append(delta)
+                    parts.append(delta)
+                    queue.put_nowait(("delta", delta))
+                usage = _add_usage(usage, result.usage)
+                if not (tools and result.tool_calls):
+                    break
+                step += 1
+                queue.put_nowait(("tool", [c["function"]["name"] for c in result.tool_calls]))
+                await self._run_tools(llm_kwargs, tools, "".join(step_parts), result.tool_calls)
+                result = await self._call_llm(
+                    conv_id, self._step_kwargs(llm_kwargs, tools, step), None,
+                    stream=True, stream_options={"include_usage": True},
+                )
+        except asyncio.CancelledError:
+            # بستن ژنراتور → بستن اتصال upstream و آزاد شدن ظرفیت governor
+            await result.stream_data.aclose()
+            msg = await asyncio.shield(self._index_cancelled(conv_id, llm_kwargs, "".join(parts)))
+            queue.put_nowait(("cancelled", msg))
+            return
+        except Exception as e:
+            queue.put_nowait(("error", str(e)))
+            return
+
+        assistant_text = "".join(parts)
+        prompt_tokens, completion_tokens = self._turn_tokens(llm_kwargs, usage, assistant_text)
+        # stream کامل شده است؛ لغو دیرهنگام نباید ذخیره پاسخ را نیمه‌کاره بگذارد
+        msg = await asyncio.shield(self._index_message(
+            conv_id, "assistant", assistant_text, [], prompt_tokens, completion_tokens,
+            stream_metrics=result.stream_metrics, add_to_counters=True, acks=acks,
+        ))
+        self._watch_writes(conv_id, acks)
+        queue.put_nowait(("done", {"message_id": msg.id, "usage": usage, "metrics": result.stream_metrics}))
+
+    async def _watch_disconnect(self, task: asyncio.Task, is_disconnected: DisconnectCheck) -> None:
+        while not task.done():
+            await asyncio.sleep(settings.CHAT_DISCONNECT_POLL_INTERVAL)
+            if not task.done() and await is_disconnected():
+                task.cancel()
+                return
+
+    async def stream_message(
+        self, conv_id: str, user_msg: MessageCreate, is_disconnected: Optional[DisconnectCheck] = None
+    ) -> Optional[AsyncGenerator[str, None]]:
+        """
+        نسخه stream از send_message:
+        - llm_async با stream=True و include_usage فراخوانی می‌شود
+        - خروجی یک ژنراتور از رویدادهای SSE است (event: delta / tool / done / error)
+        - پس از اتمام stream، پاسخ کامل با usage واقعی ایندکس می‌شود (done منتظر ack ذخیره نمی‌ماند)
+        - اگر کلاینت قطع شود (is_disconnected یا بسته شدن ژنراتور)، stream upstream بسته
+          و پاسخ ناقص با status=cancelled ذخیره می‌شود
+        خطای LLM قبل از شروع stream به صورت LLMCallFailedError بالا می‌رود.
+        """
+        acks: List[asyncio.Future] = []
+        turn = await self._prepare_turn(conv_id, user_msg, acks=acks)
+        if turn is None:
+            return None
+        conv, history, _, user_message, llm_kwargs, tools = turn
+
+        result = await self._call_llm(
+            conv_id, self._step_kwargs(llm_kwargs, tools, 0), is_disconnected,
+            stream=True, stream_options={"include_usage": True},
+        )
+
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(self._pump_stream(conv_id, llm_kwargs, tools, result, queue, acks))
+        _stream_pumps.add(pump)
+        pump.add_done_callback(_stream_pumps.discard)
+        watcher = asyncio.create_task(self._watch_disconnect(pump, is_disconnected)) if is_disconnected else None
+
+        async def events() -> AsyncGenerator[str, None]:
+            try:
+                while True:
+                    kind, data = await queue.get()
+                    if kind == "delta":
+                        yield _sse_event("delta", {"content": data})
+                    elif kind == "tool":
+                        yield _sse_event("tool", {"names": data})
+                    elif kind == "done":
+                        yield _sse_event("done", data)
+                        return
+                    elif kind == "error":
+                        yield _sse_event("error", {"detail": data})
+                        return
+                    else:
+                        return
+            finally:
+                # ژنراتور زودتر بسته شد (مثلاً قطع اتصال در ارسال) → لغو تولید
+                if not pump.done():
+                    pump.cancel()
+                if watcher is not None:
+                    watcher.cancel()
 
-        # system prompt اگر وجود دارد
-        if getattr(agent, "systemPrompt", None):
-            parts.append(f"SYSTEM: {agent.systemPrompt}")
-
-        # تاریخچه پیام‌ها
-        history: List[MessageOut] = self.list_messages(conv_id)
-        for m in history:
-            parts.append(f"{m.role.upper()}: {m.content}")
-            # اگر ضمیمه‌ای داشته باشند، در prompt اعلام می‌کنیم
-            for att in m.attachments or []:
-                parts.append(f"[Attachment: {att.filename} -> {att.url}]")
-
-        # پیام جدید کاربر
-        parts.append(f"USER: {user_msg.content}")
-        for att in atts_for_index:
-            parts.append(f"[Attachment: {att['filename']} -> {att['url']}]")
-
-        prompt_text = "\n".join(parts)
-        # 3) فراخوانی LLM واسط
-        model_name = agent.responseSettings.model or "gpt-4o-mini"
-        code, status_msg, assistant_text = self.llm(prompt_text, model_name)
-        # جمع توکن ورودی پرامپت و خروجی مدل
-        token_usage = (self.token_calculator(prompt_text) or 0) + (self.token_calculator(assistant_text) or 0)
-        # 4) ایندکس پاسخ
-        self._index_message(conv_id, "assistant", assistant_text, [], token_usage)
-
-        # (اختیاری) کمی تأخیر برای همگام‌سازی
-        time.sleep(2)
-
-        # 5) بازگرداندن کل مکالمه
-        msgs = self.list_messages(conv_id)
-        return ConversationWithMessages(**conv.dict(), messages=msgs)
-
-    def total_token_usage(self, conv_id: str) -> int:
-        res = self.es.search(
+        return events()
+
+    async def token_usage(self, conv_id: str) -> Optional[TokenUsage]:
+        """
+        - Token counters of the conversation document (a single get); None if it does not exist
+        - Every assistant message counts, cancelled replies included, both in the counters and in
+          the sums below (the prompt of each turn already includes the user message)
+        - Conversations created before the counters: sum aggregation over their assistant messages;
+          once a turn has started their counters (counters_since), the messages before it are summed
+          and folded into the counters once, after which this is a single get again
+        """
+        try:
+            res = await self.es.get(index=CONV_INDEX, id=conv_id)
+        except NotFoundError:
+            return None
+        src = res["_source"]
+        since = src.get("counters_since")
+        counters = TokenUsage(
+            prompt_tokens=src.get("prompt_tokens") or 0,
+            completion_tokens=src.get("completion_tokens") or 0,
+            total_tokens=src.get("total_tokens") or 0,
+        )
+        if src.get("total_tokens") is not None and since is None:
+            return counters
+        # پیام‌هایی که در شمارنده‌ها هستند (پس از counters_since یا شمرده‌شده در counted_messages) کنار می‌روند
+        legacy = await self._sum_message_tokens(conv_id, before=since, exclude=src.get("counted_messages") or [])
+        if since is None:
+            return legacy
+        await self._fold_token_counters(conv_id, since, legacy)
+        return TokenUsage(
+            prompt_tokens=counters.prompt_tokens + legacy.prompt_tokens,
+            completion_tokens=counters.completion_tokens + legacy.completion_tokens,
+            total_tokens=counters.total_tokens + legacy.total_tokens,
+        )
+
+    async def _sum_message_tokens(
+        self, conv_id: str, before: Optional[str] = None, exclude: Optional[List[str]] = None
+    ) -> TokenUsage:
+        """sum aggregation روی پیام‌های assistant مکالمه (پیش از before و بدون شناسه‌های exclude)."""
+        filters: List[Dict[str, Any]] = [
+            {"term": {"conversation_id": conv_id}},
+            {"term": {"role": "assistant"}},
+        ]
+        if before is not None:
+            filters.append({"range": {"created_at": {"lt": before}}})
+        query: Dict[str, Any] = {"bool": {"filter": filters}}
+        if exclude:
+            query["bool"]["must_not"] = [{"ids": {"values": exclude}}]
+        res = await self.es.search(
             index=MSG_INDEX,
             body={
                 "size": 0,  # نیازی به برگرداندن داکیومنت نیست
-                "query": {
-                    "term": {"conversation_id": conv_id}
-                },
+                "query": query,
                 "aggs": {
-                    "total_tokens": {
-                        "sum": {
-                            "field": "token_usage"
-                        }
-                    }
+                    "prompt_tokens": {"sum": {"field": "prompt_tokens"}},
+                    "completion_tokens": {"sum": {"field": "completion_tokens"}},
                 }
             }
         )
-        return int(res["aggregations"]["total_tokens"]["value"] or 0)
+        aggs = res["aggregations"]
+        prompt_tokens = int(aggs["prompt_tokens"]["value"] or 0)
+        completion_tokens = int(aggs["completion_tokens"]["value"] or 0)
+        return TokenUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    async def _fold_token_counters(self, conv_id: str, since: str, legacy: TokenUsage) -> None:
+        """
+        - Adds the sum of the messages before counters_since to the conversation's counters (backfill)
+        - A no-op if another request has already folded them; failures are logged and retried on the next read
+        """
+        try:
+            await self.es.update(
+                index=CONV_INDEX, id=conv_id,
+                body={"script": {
+                    "source": TOKEN_COUNTERS_FOLD_SCRIPT,
+                    "lang": "painless",
+                    "params": {"since": since, "counters": legacy.dict()},
+                }},
+                retry_on_conflict=TOKEN_COUNTERS_RETRY_ON_CONFLICT,
+            )
+        except Exception as e:
+            logger.error(f"Token counters backfill failed for {CONV_INDEX}/{conv_id}: {e}")
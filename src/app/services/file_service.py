@@ -1,3 +1,5 @@
+import mimetypes
+import posixpath
 import uuid
 from datetime import datetime, timedelta
 from typing import List, Optional
@@ -151,6 +153,41 @@ class FileService:
             )
         return None
 
+    def stat_file(self, object_name: str) -> Optional[FileOut]:
+        """
+        متادیتای یک object با کلید دقیقش (stat_object، بدون list).
+        - content_type از stat؛ اگر خالی یا octet-stream بود، از پسوند نام فایل
+        - برای کلیدهای "{prefix}/{file_id}_{filename}" همان id و filename آپلود برگردانده می‌شود
+        """
+        try:
+            stat = self.client.stat_object(self.bucket, object_name)
+        except S3Error as e:
+            if getattr(e, "code", None) in ("NoSuchKey", "NoSuchObject"):
+                return None
+            raise
+        rest = posixpath.basename(object_name)
+        if object_name.startswith(f"{self.upload_prefix}/") and "_" in rest:
+            file_id, filename = rest.split("_", 1)
+        else:
+            file_id, filename = object_name, rest
+        content_type = stat.content_type
+        if not content_type or content_type == "application/octet-stream":
+            content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+        url = self.presign_client.presigned_get_object(
+            bucket_name=self.bucket,
+            object_name=object_name,
+            expires=timedelta(seconds=36000)
+        )
+        return FileOut(
+            id=file_id,
+            filename=filename,
+            content_type=content_type,
+            size=stat.size,
+            uploaded_at=stat.last_modified or datetime.utcnow(),
+            url=url
+        )
+
     def get_file_content(self, object_name: str) -> bytes | None:
         response = None
         try:
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# وضعیت‌های آیتم bulk که دوباره ارسال می‌شوند (صف پر / shard در دسترس نیست)
+_RETRY_STATUSES = (429, 503)
+
+
+class BulkItemError(Exception):
+    """ES یک آیتم bulk را رد کرد؛ `item` پاسخ همان آیتم است."""
+
+    def __init__(self, item: Dict[str, Any]):
+        error = item.get("error") or {}
+        reason = error.get("reason") if isinstance(error, dict) else error
+        super().__init__(f"{item.get('_index')}/{item.get('_id')}: status {item.get('status')} {reason or ''}".strip())
+        self.item = item
+
+
+class _Op:
+    __slots__ = ("action", "source", "future", "refresh", "attempts")
+
+    def __init__(self, action: Dict[str, Any], source: Optional[Dict[str, Any]], refresh: Optional[str]):
+        self.action = action
+        self.source = source
+        self.refresh = refresh
+        self.attempts = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.future.add_done_callback(_log_failure)
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    # خطا بازیابی می‌شود تا ack بدون منتظر، هشدار "exception was never retrieved" ندهد
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Bulk write failed: {future.exception()}")
+
+
+class MessageWriter:
+    """
+    Write-behind batching of message writes from all conversations into `_bulk` requests (per worker).
+
+    - `index()` / `update()` queue one operation and return its future: resolved with the bulk item
+      once Elasticsearch acknowledged it, failed with BulkItemError (or the transport error) otherwise
+    - A batch is sent when `max_batch` operations are queued or `max_delay` seconds after the first one
+    - `flush()` sends everything queued now and waits for it (read-your-writes callers)
+    - An operation queued with refresh="wait_for" makes its whole batch wait for the refresh
+    - Only the rejected items (429/503) of a bulk are retried, and a failed request retries its whole batch,
+      up to `max_retries` times with exponential backoff (`retry_backoff` * 2^n seconds); every operation
+      must therefore be idempotent (documents by _id, scripted updates keyed on their own id)
+    - Bulks are sent one at a time; a flush therefore also waits for the batch already in flight
+    """
+
+    def __init__(self, max_batch: int = 500, max_delay: float = 0.05, max_retries: int = 3, retry_backoff: float = 0.2):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._es: Optional[AsyncElasticsearch] = None
+        self._pending: List[_Op] = []
+        self._has_pending: Optional[asyncio.Event] = None
+        self._send_now: Optional[asyncio.Event] = None
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        # عملیات‌هایی که در backoff منتظر retry هستند
+        self._backoff: Dict[_Op, asyncio.TimerHandle] = {}
+        self.bulks = 0
+        self.operations = 0
+        self.retries = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, es: AsyncElasticsearch) -> None:
+        self._es = es
+        self._has_pending = asyncio.Event()
+        self._send_now = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """توقف حلقه پس‌زمینه و ارسال هر چه در صف مانده است."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # retryها تا سقف max_retries در همین‌جا ارسال می‌شوند (هنگام توقف بدون backoff)
+        while self._pending or self._backoff:
+            for op, handle in list(self._backoff.items()):
+                handle.cancel()
+                self._requeue(op)
+            await self.flush()
+
+    def index(
+        self, index: str, doc_id: str, document: Dict[str, Any], refresh: Optional[str] = None
+    ) -> asyncio.Future:
+        return self._enqueue(_Op({"index": {"_index": index, "_id": doc_id}}, document, refresh))
+
+    def update(
+        self,
+        index: str,
+        doc_id: str,
+        body: Dict[str, Any],
+        refresh: Optional[str] = None,
+        retry_on_conflict: Optional[int] = None,
+    ) -> asyncio.Future:
+        """
+        body مثل es.update: {"doc": ...} یا {"script": ..., "upsert": ...}
+        retry_on_conflict: برای scriptهای افزایشی روی یک سند پرترافیک (چند worker هم‌زمان)
+        """
+        meta: Dict[str, Any] = {"_index": index, "_id": doc_id}
+        if retry_on_conflict:
+            meta["retry_on_conflict"] = retry_on_conflict
+        return self._enqueue(_Op({"update": meta}, body, refresh))
+
+    def _enqueue(self, op: _Op) -> asyncio.Future:
+        if not self.running:
+            raise RuntimeError("MessageWriter is not running")
+        self._pending.append(op)
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._send_now.set()
+        return op.future
+
+    async def flush(self) -> None:
+        """ارسال عملیات‌های در صف (به صورت batchهای max_batch)؛ retryها در دور بعد ارسال می‌شوند."""
+        if self._send_lock is None:
+            return
+        async with self._send_lock:
+            ops, self._pending = self._pending, []
+            for start in range(0, len(ops), self.max_batch):
+                await self._send(ops[start:start + self.max_batch])
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            # تا پر شدن batch یا max_delay پس از اولین عملیات صبر می‌شود
+            try:
+                await asyncio.wait_for(self._send_now.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._has_pending.clear()
+            self._send_now.clear()
+            try:
+                # stop() وسط ارسال، bulk در جریان را نیمه‌کاره نمی‌گذارد
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                logger.error(f"MessageWriter flush failed: {e}", exc_info=True)
+
+    async def _send(self, batch: List[_Op]) -> None:
+        operations: List[Dict[str, Any]] = []
+        for op in batch:
+            operations.append(op.action)
+            operations.append(op.source)
+        refresh = next((op.refresh for op in batch if op.refresh), None)
+        self.bulks += 1
+        self.operations += len(batch)
+        try:
+            res = await self._es.bulk(operations=operations, refresh=refresh)
+        except Exception as e:
+            logger.warning(f"Bulk request with {len(batch)} operations failed: {e}")
+            for op in batch:
+                self._retry_or_fail(op, e)
+            return
+
+        for op, item in zip(batch, res["items"]):
+            result = next(iter(item.values()))
+            status = result.get("status", 500)
+            if status < 300:
+                if not op.future.done():
+                    op.future.set_result(result)
+            elif status in _RETRY_STATUSES:
+                self._retry_or_fail(op, BulkItemError(result))
+            else:
+                self._fail(op, BulkItemError(result))
+
+    def _retry_or_fail(self, op: _Op, error: Exception) -> None:
+        op.attempts += 1
+        if op.attempts > self.max_retries:
+            self._fail(op, error)
+            return
+        self.retries += 1
+        delay = self.retry_backoff * (2 ** (op.attempts - 1))
+        self._backoff[op] = asyncio.get_running_loop().call_later(delay, self._requeue, op)
+
+    def _requeue(self, op: _Op) -> None:
+        self._backoff.pop(op, None)
+        self._pending.append(op)
+        if self._has_pending is not None:
+            self._has_pending.set()
+
+    def _fail(self, op: _Op, error: Exception) -> None:
+        self.failed += 1
+        if not op.future.done():
+            op.future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pending": len(self._pending),
+            "backoff": len(self._backoff),
+            "bulks": self.bulks,
+            "operations": self.operations,
+            "avg_batch": round(self.operations / self.bulks, 2) if self.bulks else 0.0,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+
+message_writer = MessageWriter(
+    max_batch=settings.MESSAGE_WRITER_MAX_BATCH,
+    max_delay=settings.MESSAGE_WRITER_MAX_DELAY,
+    max_retries=settings.MESSAGE_WRITER_MAX_RETRIES,
+    retry_backoff=settings.MESSAGE_WRITER_RETRY_BACKOFF,
+)
@@ -0,0 +1,115 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.api.v1.schemas.agents import AgentOut, LanguageEnum, ResponseLengthEnum
+from app.core.config import settings
+from app.llm.tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_LANGUAGE_RULES = {
+    LanguageEnum.en: "Always reply in English.",
+    LanguageEnum.fa: "Always reply in Persian (فارسی).",
+}
+
+_LENGTH_RULES = {
+    ResponseLengthEnum.short: "Keep answers short: a few sentences at most.",
+    ResponseLengthEnum.medium: "Keep answers reasonably concise: one to three short paragraphs.",
+    ResponseLengthEnum.long: "Give complete, detailed answers when the question needs it.",
+}
+
+
+class CompiledPrompt:
+    """
+    Ready-to-send instruction header of one agent version.
+
+    - `messages` is the static message prefix placed before any conversation turn
+    - `tokens` is counted once at compile time (used for context budgeting)
+    """
+
+    def __init__(self, agent_id: str, version: datetime, model: str, system_message: str):
+        self.agent_id = agent_id
+        self.version = version
+        self.model = model
+        self.system_message = system_message
+        self.messages: List[Dict[str, str]] = [{"role": "system", "content": system_message}]
+        self.tokens = count_tokens(system_message, model)
+
+
+def compile_agent_prompt(agent: AgentOut) -> CompiledPrompt:
+    """
+    - Builds the system header from systemPrompt, role, response settings and keyword rules
+    - The text depends only on the agent document, so it is byte-identical on every turn and
+      the provider's prompt-prefix cache can hit across turns and conversations
+    """
+    rs = agent.response_settings
+    sections: List[str] = []
+    if agent.system_prompt:
+        sections.append(agent.system_prompt.strip())
+
+    sections.append(f"## Role\nYou act as: {agent.role.value}")
+    sections.append(
+        "## Response style\n"
+        f"- Tone: {rs.tone.value}\n"
+        f"- {_LANGUAGE_RULES.get(rs.language, _LANGUAGE_RULES[LanguageEnum.en])}\n"
+        f"- {_LENGTH_RULES.get(rs.response_length, _LENGTH_RULES[ResponseLengthEnum.medium])}"
+    )
+
+    keyword_rules: List[str] = []
+    if agent.keywords_list:
+        keyword_rules.append(f"- Stay focused on these topics: {', '.join(agent.keywords_list)}")
+    if agent.exception_words:
+        keyword_rules.append(f"- Never use these words: {', '.join(agent.exception_words)}")
+    if keyword_rules:
+        sections.append("## Keywords\n" + "\n".join(keyword_rules))
+
+    model = rs.model.value if rs.model else "gpt-4o-mini"
+    return CompiledPrompt(agent.id, agent.updated_at, model, "\n\n".join(sections))
+
+
+class PromptHeaderCache:
+    """
+    In-process LRU of compiled agent headers.
+
+    - Keyed by agent id; an entry is valid only for the agent's current `updated_at`
+    - An edited agent is recompiled on its next turn, even when it was updated by another worker
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CompiledPrompt]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, agent: AgentOut) -> CompiledPrompt:
+        compiled = self._entries.get(agent.id)
+        if compiled is not None and compiled.version == agent.updated_at:
+            self._entries.move_to_end(agent.id)
+            self.hits += 1
+            return compiled
+
+        self.misses += 1
+        compiled = compile_agent_prompt(agent)
+        self._entries[agent.id] = compiled
+        self._entries.move_to_end(agent.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, agent_id: str) -> None:
+        self._entries.pop(agent_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+prompt_header_cache = PromptHeaderCache(max_entries=settings.PROMPT_HEADER_CACHE_SIZE)
@@ -0,0 +1,53 @@
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import pytest
+
+# Settings این متغیرها را اجباری می‌داند؛ تست‌های واحد به MinIO/OpenAI واقعی وصل نمی‌شوند
+os.environ.setdefault("MINIO_KEY", "test")
+os.environ.setdefault("MINIO_SECRET", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def run_mock_llm(config=None) -> Iterator[Any]:
+    """
+    app.llm.mock_server روی یک پورت آزاد در thread جدا.
+    app برگردانده می‌شود: app.state.base_url آدرس سازگار با OpenAI و app.state.mock شمارنده‌ها.
+    """
+    import uvicorn
+    from app.llm.mock_server import MockLLMConfig, create_mock_app
+
+    app = create_mock_app(config or MockLLMConfig(ttft=0.0, tokens_per_second=0.0))
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("mock LLM server did not start")
+        time.sleep(0.01)
+    try:
+        app.state.base_url = f"http://127.0.0.1:{port}/v1"
+        yield app
+    finally:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+
+@pytest.fixture
+def mock_llm():
+    """سرور mock با پاسخ فوری؛ برای تنظیمات دیگر از run_mock_llm(MockLLMConfig(...)) استفاده کنید."""
+    with run_mock_llm() as app:
+        yield app
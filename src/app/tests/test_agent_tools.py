@@ -0,0 +1,180 @@
+import asyncio
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from minio.datatypes import Object
+from minio.error import S3Error
+
+from app.api.v1.schemas.agents import AgentOut, AgentToolName
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.core.config import settings
+from app.llm.tools import Tool, ToolRegistry
+from app.services.agent_tools import build_agent_tools
+from app.services.conversation_service import ConversationService
+from app.services.file_service import FileService
+
+T0 = datetime(2024, 10, 10, 14, 0)
+
+
+class FakeMinio:
+    """MinIO ساختگی: فقط stat/get/presign با کلید دقیق؛ list_objects عمداً پیاده نشده است."""
+
+    def __init__(self, objects: Dict[str, Tuple[bytes, Optional[str]]]):
+        self.objects = objects
+        self.stats: List[str] = []
+
+    def stat_object(self, bucket_name: str, object_name: str) -> Object:
+        self.stats.append(object_name)
+        if object_name not in self.objects:
+            raise S3Error(None, "NoSuchKey", "not found", object_name, "req", "host")
+        data, content_type = self.objects[object_name]
+        return Object(bucket_name, object_name, last_modified=T0, size=len(data), content_type=content_type)
+
+    def get_object(self, bucket_name: str, object_name: str):
+        data = self.objects[object_name][0]
+
+        class Response:
+            def read(self):
+                return data
+
+            def close(self):
+                pass
+
+            def release_conn(self):
+                pass
+
+        return Response()
+
+    def presigned_get_object(self, bucket_name: str, object_name: str, expires=None) -> str:
+        return f"https://files.example/{object_name}"
+
+
+def _file_svc(objects: Dict[str, Tuple[bytes, Optional[str]]]) -> FileService:
+    svc = FileService()
+    svc.client = svc.presign_client = FakeMinio(objects)
+    return svc
+
+
+def _lookup(svc: FileService, agent_files: List[str], attachments: List[Dict[str, str]], file: str) -> Dict[str, Any]:
+    agent = AgentOut(
+        id="a1", name="bot", created_at=T0, updated_at=T0, tools=[AgentToolName.file_lookup], files=agent_files
+    )
+    registry = build_agent_tools(agent, svc, None, attachments)
+    call = {"id": "c1", "function": {"name": "file_lookup", "arguments": json.dumps({"file": file})}}
+    return json.loads(asyncio.run(registry.run_call(call))["content"])
+
+
+def test_attachment_is_read_by_its_exact_key():
+    prefix = settings.MINIO_BUCKET
+    svc = _file_svc({f"{prefix}/f1_notes.txt": (b"meeting at 10", "text/plain")})
+    attachments = [{"id": "f1", "filename": "notes.txt", "url": "x"}]
+
+    by_name = _lookup(svc, [], attachments, "notes.txt")
+    assert by_name["id"] == "f1" and by_name["filename"] == "notes.txt"
+    assert by_name["content"] == "meeting at 10"
+    assert _lookup(svc, [], attachments, "f1")["content"] == "meeting at 10"
+    assert svc.client.stats == [f"{prefix}/f1_notes.txt"] * 2
+
+
+def test_agent_file_content_type_falls_back_to_the_extension():
+    prefix = settings.MINIO_BUCKET
+    svc = _file_svc({
+        f"{prefix}/u1_guide.md": (b"# Guide", "application/octet-stream"),
+        f"{prefix}/docs/report.pdf": (b"%PDF", None),
+    })
+    agent_files = ["u1_guide.md", f"{prefix}/docs/report.pdf"]
+
+    guide = _lookup(svc, agent_files, [], "guide.md")
+    assert guide["content_type"] == "text/markdown"
+    assert guide["content"] == "# Guide"
+    assert (guide["id"], guide["filename"]) == ("u1", "guide.md")
+
+    report = _lookup(svc, agent_files, [], "report.pdf")
+    assert report["content_type"] == "application/pdf"
+    assert "content" not in report
+    assert report["url"].endswith("docs/report.pdf")
+
+
+def test_files_outside_the_agent_are_not_available():
+    prefix = settings.MINIO_BUCKET
+    svc = _file_svc({f"{prefix}/other_secret.txt": (b"secret", "text/plain")})
+    result = _lookup(svc, ["guide.md"], [], "other_secret.txt")
+    assert "not available" in result["error"]
+    assert svc.client.stats == []
+
+    missing = _lookup(svc, ["guide.md"], [], "guide.md")
+    assert "not found" in missing["error"]
+
+
+def test_tool_calls_of_a_step_run_concurrently_with_their_own_timeouts():
+    async def slow(seconds: float) -> str:
+        await asyncio.sleep(seconds)
+        return f"slept {seconds}"
+
+    registry = ToolRegistry([Tool("slow", "", {}, slow, timeout=0.3)])
+    calls = [
+        {"id": "a", "function": {"name": "slow", "arguments": '{"seconds": 0.2}'}},
+        {"id": "b", "function": {"name": "slow", "arguments": '{"seconds": 0.2}'}},
+        {"id": "c", "function": {"name": "slow", "arguments": '{"seconds": 5}'}},
+        {"id": "d", "function": {"name": "missing", "arguments": "{}"}},
+        {"id": "e", "function": {"name": "slow", "arguments": "not json"}},
+    ]
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await registry.run_calls(calls)
+        return results, loop.time() - started
+
+    results, elapsed = asyncio.run(run())
+    assert elapsed < 1.0
+    assert [r["tool_call_id"] for r in results] == ["a", "b", "c", "d", "e"]
+    assert [r["content"] for r in results[:2]] == ["slept 0.2", "slept 0.2"]
+    assert "timed out" in results[2]["content"]
+    assert "Unknown tool" in results[3]["content"]
+    assert "not valid JSON" in results[4]["content"]
+
+
+def test_tool_loop_feeds_results_back_until_a_text_answer(monkeypatch):
+    monkeypatch.setattr(settings, "AGENT_MAX_TOOL_STEPS", 2)
+    steps: List[Dict[str, Any]] = []
+
+    async def llm(**kwargs):
+        steps.append({**kwargs, "messages": list(kwargs["messages"])})
+        usage = {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12}
+        if kwargs.get("tool_choice") == "none":
+            return LLMCallResult(success=True, status_code=200, content="final answer", usage=usage)
+        call = {"id": f"c{len(steps)}", "type": "function",
+                "function": {"name": "echo", "arguments": json.dumps({"text": f"step {len(steps)}"})}}
+        return LLMCallResult(success=True, status_code=200, content=None, tool_calls=[call], usage=usage)
+
+    async def echo(text: str) -> str:
+        return text.upper()
+
+    svc = ConversationService(None, llm, None, None)
+    registry = ToolRegistry([Tool("echo", "", {}, echo)])
+    llm_kwargs = {"messages": [{"role": "user", "content": "hi"}]}
+    result, usage = asyncio.run(svc._tool_loop("c1", llm_kwargs, registry))
+
+    assert result.content == "final answer"
+    assert usage["total_tokens"] == 36
+    # مرحله آخر (AGENT_MAX_TOOL_STEPS) بدون اجازه tool call
+    assert [s.get("tool_choice") for s in steps] == [None, None, "none"]
+    assert all(s["tools"][0]["function"]["name"] == "echo" for s in steps)
+    last = steps[-1]["messages"]
+    assert [m["role"] for m in last] == ["user", "assistant", "tool", "assistant", "tool"]
+    assert [m["content"] for m in last if m["role"] == "tool"] == ["STEP 1", "STEP 2"]
+    assert last[1]["tool_calls"][0]["id"] == last[2]["tool_call_id"] == "c1"
+
+
+@pytest.mark.parametrize("tools, indices, expected", [
+    ([AgentToolName.file_lookup, AgentToolName.knowledge_search], ["kb"], ["file_lookup", "knowledge_search"]),
+    ([AgentToolName.knowledge_search], [], []),
+    ([], ["kb"], []),
+])
+def test_only_enabled_tools_are_registered(tools, indices, expected):
+    agent = AgentOut(id="a1", name="bot", created_at=T0, updated_at=T0, tools=tools, indices=indices)
+    registry = build_agent_tools(agent, _file_svc({}), None)
+    assert [spec["function"]["name"] for spec in registry.specs()] == expected
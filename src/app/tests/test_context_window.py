@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List
+
+from app.api.v1.schemas.conversation import ConversationOut, MessageOut
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.llm.model_catalog import model_catalog
+from app.services.context_window import ContextManager, ConversationSummarizer
+
+MODEL = "gpt-4o-mini"
+T0 = datetime(2024, 10, 10, 14, 0)
+
+
+def _history(n: int) -> List[MessageOut]:
+    return [
+        MessageOut(
+            id=f"m{i}", conversation_id="c1", role="user" if i % 2 == 0 else "assistant",
+            content=f"message {i}", created_at=T0 + timedelta(minutes=i),
+        )
+        for i in range(n)
+    ]
+
+
+def _conv(**kwargs) -> ConversationOut:
+    return ConversationOut(id="c1", agent_id="a1", created_at=T0, **kwargs)
+
+
+def _ids(messages: List[MessageOut]) -> List[str]:
+    return [m.id for m in messages]
+
+
+def test_keeps_the_last_turns_and_folds_the_rest():
+    manager = ContextManager(max_turns=2, history_tokens=10_000)
+    history = _history(10)
+    window = manager.build(_conv(), history, MODEL, reserved_tokens=0, token_counts=[5] * 10)
+    assert _ids(window.messages) == ["m6", "m7", "m8", "m9"]
+    assert _ids(window.to_fold) == _ids(history[:6])
+    assert window.history_tokens == 20
+    assert window.summary is None
+
+
+def test_token_budget_limits_the_verbatim_window():
+    manager = ContextManager(max_turns=10, history_tokens=25)
+    counts = [10, 10, 10, 10, 8, 7]
+    window = manager.build(_conv(), _history(6), MODEL, reserved_tokens=0, token_counts=counts)
+    # جدیدترین‌ها اول: 7 + 8 + 10 = 25
+    assert _ids(window.messages) == ["m3", "m4", "m5"]
+    assert window.history_tokens == 25
+    assert window.budget == 25
+
+
+def test_budget_leaves_room_for_the_rest_of_the_prompt():
+    manager = ContextManager(max_turns=10, history_tokens=10_000, model_budgets={MODEL: 3_000})
+    window_size = model_catalog.context_window(MODEL)
+    assert manager.budget_for(MODEL, reserved_tokens=1_000) == 3_000
+    assert manager.budget_for(MODEL, reserved_tokens=window_size - 500) == 500
+    assert manager.budget_for(MODEL, reserved_tokens=window_size + 1) == 0
+    assert manager.budget_for("other-model", reserved_tokens=0) == min(10_000, model_catalog.context_window("other-model"))
+
+
+def test_summarized_messages_are_left_out_and_the_summary_uses_the_budget():
+    manager = ContextManager(max_turns=10, history_tokens=10_000)
+    history = _history(8)
+    conv = _conv(summary="- user asked about Shiraz", summary_upto=history[4].created_at)
+    window = manager.build(conv, history, MODEL, reserved_tokens=0, token_counts=[5] * 8)
+    # پیام‌های تا summary_upto نه در پنجره می‌آیند و نه دوباره خلاصه می‌شوند
+    assert _ids(window.messages) == ["m5", "m6", "m7"]
+    assert window.to_fold == []
+    assert window.summary == conv.summary
+    assert window.history_tokens > 15
+
+    tight = ContextManager(max_turns=10, history_tokens=window.history_tokens - 1)
+    window = tight.build(conv, history, MODEL, reserved_tokens=0, token_counts=[5] * 8)
+    assert _ids(window.messages) == ["m6", "m7"]
+    assert _ids(window.to_fold) == ["m5"]
+
+
+def test_summarizer_folds_messages_once_per_conversation():
+    summarizer = ConversationSummarizer(model=MODEL, max_tokens=100)
+    saved = []
+    prompts = []
+
+    async def llm(**kwargs):
+        prompts.append(kwargs["prompt"])
+        await asyncio.sleep(0.01)
+        return LLMCallResult(success=True, content=" - new summary \n")
+
+    async def save(conv_id, summary, upto):
+        saved.append((conv_id, summary, upto))
+
+    async def run():
+        history = _history(4)
+        summarizer.schedule("c1", "- old", history, llm, save)
+        # همان مکالمه تا پایان خلاصه‌سازی قبلی دوباره زمان‌بندی نمی‌شود
+        summarizer.schedule("c1", "- old", history, llm, save)
+        summarizer.schedule("c1", None, [], llm, save)
+        assert summarizer.stats()["in_flight"] == 1
+        await asyncio.gather(*summarizer._tasks)
+
+    asyncio.run(run())
+    assert saved == [("c1", "- new summary", T0 + timedelta(minutes=3))]
+    assert "- old" in prompts[0] and "assistant: message 3" in prompts[0]
+    assert summarizer.stats() == {"in_flight": 0, "completed": 1, "failed": 0}
+
+
+def test_failed_summary_is_not_saved():
+    summarizer = ConversationSummarizer(model=MODEL, max_tokens=100)
+    saved = []
+
+    async def llm(**kwargs):
+        return LLMCallResult(success=False, status_code=502, error_detail="upstream down")
+
+    async def save(*args):
+        saved.append(args)
+
+    async def run():
+        summarizer.schedule("c1", None, _history(2), llm, save)
+        await asyncio.gather(*summarizer._tasks)
+
+    asyncio.run(run())
+    assert saved == []
+    assert summarizer.stats() == {"in_flight": 0, "completed": 0, "failed": 1}
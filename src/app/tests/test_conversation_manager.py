@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.api.v1.schemas.agents import AgentOut
+from app.api.v1.schemas.conversation import ConversationOut, MessageOut
+from app.services.conversation_manager import ConversationManager
+
+MODEL = "gpt-4o-mini"
+T0 = datetime(2024, 10, 10, 14, 0)
+
+
+class Store:
+    """ES ساختگی برای loaderها: شمارش خواندن‌ها و پارامتر after."""
+
+    def __init__(self):
+        self.convs: Dict[str, ConversationOut] = {}
+        self.messages: Dict[str, List[MessageOut]] = {}
+        self.conv_reads = 0
+        self.message_reads: List[Optional[datetime]] = []
+
+    def add_message(self, conv_id: str, content: str) -> MessageOut:
+        msgs = self.messages.setdefault(conv_id, [])
+        msg = MessageOut(
+            id=f"{conv_id}-{len(msgs)}", conversation_id=conv_id, role="user",
+            content=content, created_at=T0 + timedelta(minutes=len(msgs)),
+        )
+        msgs.append(msg)
+        return msg
+
+    async def load_conversation(self, conv_id: str) -> Optional[ConversationOut]:
+        self.conv_reads += 1
+        return self.convs.get(conv_id)
+
+    async def load_messages(self, conv_id: str, after: Optional[datetime], size: int = 200) -> List[MessageOut]:
+        self.message_reads.append(after)
+        msgs = [m for m in self.messages.get(conv_id, []) if after is None or m.created_at > after]
+        return msgs[-size:]
+
+
+def _store(*conv_ids: str) -> Store:
+    store = Store()
+    for conv_id in conv_ids:
+        store.convs[conv_id] = ConversationOut(id=conv_id, agent_id="a1", created_at=T0)
+    return store
+
+
+def _load(manager: ConversationManager, store: Store, conv_id: str = "c1"):
+    async def run():
+        entry, new = await manager.load(conv_id, store.load_conversation, store.load_messages)
+        if entry is not None:
+            entry.history.extend(new, MODEL)
+        return entry, new
+    return asyncio.run(run())
+
+
+def test_active_conversation_is_served_from_memory_within_ttl():
+    manager = ConversationManager(ttl=1000)
+    store = _store("c1")
+    store.add_message("c1", "hi")
+    entry, new = _load(manager, store)
+    assert [m.content for m in new] == ["hi"]
+    assert (store.conv_reads, store.message_reads) == (1, [None])
+
+    again, new = _load(manager, store)
+    assert again is entry and new == []
+    assert (store.conv_reads, len(store.message_reads)) == (1, 1)
+    assert manager.stats()["hits"] == 1
+
+
+def test_expired_entry_reads_metadata_and_only_newer_messages():
+    manager = ConversationManager(ttl=1000)
+    store = _store("c1")
+    store.add_message("c1", "hi")
+    store.add_message("c1", "hello")
+    _load(manager, store)
+
+    # نوبتی که worker دیگری ذخیره کرده و عنوانی که تغییر کرده است
+    store.add_message("c1", "from another worker")
+    store.convs["c1"] = store.convs["c1"].copy(update={"title": "renamed"})
+    manager.ttl = 0
+    entry, new = _load(manager, store)
+
+    assert store.message_reads[-1] == store.messages["c1"][1].created_at
+    assert [m.content for m in new] == ["from another worker"]
+    assert entry.conv.title == "renamed"
+    assert [m.content for m in entry.history.messages] == ["hi", "hello", "from another worker"]
+    assert manager.stats()["revalidations"] == 1
+
+
+def test_deleted_conversation_is_dropped_on_revalidation():
+    manager = ConversationManager(ttl=0)
+    store = _store("c1")
+    _load(manager, store)
+    del store.convs["c1"]
+    entry, _ = _load(manager, store)
+    assert entry is None
+    assert manager.peek("c1") is None
+
+
+def test_write_through_and_lru_eviction():
+    manager = ConversationManager(max_entries=2, ttl=1000)
+    store = _store("c1", "c2", "c3")
+    store.add_message("c1", "hi")
+    entry, _ = _load(manager, store, "c1")
+    manager.append("c1", store.add_message("c1", "indexed by this worker"))
+    assert [m.content for m in entry.history.messages] == ["hi", "indexed by this worker"]
+
+    _load(manager, store, "c2")
+    _load(manager, store, "c1")  # c1 تازه‌ترین استفاده
+    _load(manager, store, "c3")
+    assert manager.peek("c2") is None
+    assert manager.peek("c1") is entry
+
+
+def test_full_load_marks_the_history_truncated():
+    manager = ConversationManager(max_messages=3, ttl=1000)
+    store = _store("c1", "c2")
+    for i in range(5):
+        store.add_message("c1", f"m{i}")
+    store.add_message("c2", "only one")
+
+    async def run(conv_id):
+        entry, new = await manager.load(
+            conv_id, store.load_conversation, lambda cid, after: store.load_messages(cid, after, size=3)
+        )
+        entry.history.extend(new, MODEL)
+        return entry
+
+    assert asyncio.run(run("c1")).history.truncated
+    assert not asyncio.run(run("c2")).history.truncated
+
+
+def test_agents_expire_and_are_invalidated():
+    manager = ConversationManager(agent_ttl=1000)
+    reads = []
+
+    async def load_agent(agent_id):
+        reads.append(agent_id)
+        return AgentOut(id=agent_id, name="bot", created_at=T0, updated_at=T0)
+
+    async def run():
+        await manager.agent("a1", load_agent)
+        await manager.agent("a1", load_agent)
+        manager.invalidate_agent("a1")
+        await manager.agent("a1", load_agent)
+        manager.agent_ttl = 0
+        await manager.agent("a1", load_agent)
+
+    asyncio.run(run())
+    assert reads == ["a1", "a1", "a1"]
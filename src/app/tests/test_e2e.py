@@ -95,9 +95,9 @@ def test_full_flow(client):
     # 6) Check token usage summary
     toks = client.get(f"/api/v1/conversations/{conv_id}/tokens")
     assert toks.status_code == 200  # بررسی موفق بودن پاسخ
-    total_tokens = toks.json()  # چون json() مقدار عددی برمی‌گرداند
-    assert isinstance(total_tokens, int)
-    assert total_tokens > 0
+    usage = toks.json()
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+    assert usage["total_tokens"] > 0
 
     # 7) Health endpoint
     health = client.get("/health").json()
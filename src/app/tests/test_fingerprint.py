@@ -0,0 +1,57 @@
+import asyncio
+
+from app.llm.fingerprint import request_fingerprint
+from app.llm.llm_client import llm_async
+from app.llm.response_cache import response_cache
+
+MESSAGES = [{"role": "user", "content": "What is the weather in Shiraz?"}]
+TOOLS = [{
+    "type": "function",
+    "function": {
+        "name": "get_weather",
+        "description": "Current weather of a city",
+        "parameters": {"type": "object", "properties": {"city": {"type": "string"}}, "required": ["city"]},
+    },
+}]
+
+
+def test_tool_fields_change_the_fingerprint():
+    base = {"model": "gpt-4o-mini", "messages": MESSAGES, "temperature": 0.0}
+    with_tools = {**base, "tools": TOOLS}
+    keys = {
+        request_fingerprint(base),
+        request_fingerprint(with_tools),
+        request_fingerprint({**with_tools, "tool_choice": "none"}),
+        request_fingerprint({**with_tools, "parallel_tool_calls": False}),
+    }
+    assert len(keys) == 4
+    # stream و timeout خروجی را تغییر نمی‌دهند
+    assert request_fingerprint(base) == request_fingerprint({**base, "stream": True, "timeout": 5})
+
+
+def test_requests_differing_only_in_tools_share_no_cache_entry_or_flight(mock_llm):
+    mock_llm.state.mock.config.ttft = 0.3  # دو فراخوانی هم‌زمان حتماً هم‌پوشانی دارند
+    response_cache.clear()
+    kwargs = dict(
+        messages=MESSAGES,
+        llm_model_name="gpt-4o-mini",
+        api_key="test",
+        base_url=mock_llm.state.base_url,
+        temperature=0.0,
+        use_cache=True,
+        hedge=False,
+        return_full_response_dict=False,
+    )
+
+    async def run():
+        first = await asyncio.gather(llm_async(**kwargs), llm_async(**kwargs, tools=TOOLS))
+        # هر کدام از cache خودش؛ بدون فراخوانی upstream جدید
+        second = await asyncio.gather(llm_async(**kwargs), llm_async(**kwargs, tools=TOOLS))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert all(r.success for r in first + second)
+    # نه coalesce شدند و نه cache مشترک داشتند
+    assert mock_llm.state.mock.requests == 2
+    assert not first[0].cached and not first[1].cached
+    assert second[0].cached and second[1].cached
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import pytest
+
+from app.llm.governor import (
+    PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, GovernorTimeoutError, ModelGovernor, TokenBucket, governor
+)
+from app.llm.llm_client import llm_async
+from app.llm.mock_server import MockLLMConfig
+from app.tests.conftest import run_mock_llm
+
+
+def _governor(max_concurrency: int = 1, rpm: int = 1000, tpm: int = 1_000_000) -> ModelGovernor:
+    return ModelGovernor("m", max_concurrency=max_concurrency, rpm=rpm, tpm=tpm)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    gov = _governor()
+    order = []
+
+    async def call(name: str, priority: int):
+        ticket = await gov.acquire(priority, 1, None)
+        order.append(name)
+        ticket.release()
+
+    async def run():
+        holder = await gov.acquire(PRIORITY_NORMAL, 1, None)
+        tasks = []
+        for name, priority in (("a", PRIORITY_NORMAL), ("b", PRIORITY_LOW), ("c", PRIORITY_HIGH), ("d", PRIORITY_NORMAL)):
+            tasks.append(asyncio.create_task(call(name, priority)))
+            await asyncio.sleep(0)  # ترتیب ورود به صف
+        assert gov.stats()["queued"] == 4
+        holder.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["c", "a", "d", "b"]
+    assert gov.in_flight == 0
+
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(per_minute=600)  # 10 در ثانیه
+    assert bucket.wait_time(600) == 0.0
+    bucket.consume(600)
+    assert bucket.wait_time(50) == pytest.approx(5.0, abs=0.05)
+    # مصرف واقعی بیشتر از برآورد: موجودی منفی، انتظار بیشتر
+    bucket.adjust(100)
+    assert bucket.wait_time(50) == pytest.approx(15.0, abs=0.05)
+    # درخواست بزرگ‌تر از ظرفیت فقط تا پر شدن کامل منتظر می‌ماند
+    assert bucket.wait_time(10_000) == pytest.approx(bucket.wait_time(600))
+
+
+def test_tpm_bucket_delays_admission_until_refilled():
+    gov = _governor(max_concurrency=10, tpm=6000)  # 100 توکن در ثانیه
+
+    async def run():
+        (await gov.acquire(PRIORITY_NORMAL, 6000, None)).release()
+        started = time.monotonic()
+        ticket = await gov.acquire(PRIORITY_NORMAL, 30, None)
+        ticket.release()
+        return time.monotonic() - started
+
+    assert 0.2 <= asyncio.run(run()) < 1.0
+
+
+def test_max_wait_raises_and_frees_the_queue_slot():
+    gov = _governor()
+
+    async def run():
+        holder = await gov.acquire(PRIORITY_NORMAL, 1, None)
+        with pytest.raises(GovernorTimeoutError):
+            await gov.acquire(PRIORITY_HIGH, 1, 0.05)
+        assert gov.stats()["queued"] == 0
+        holder.release()
+        # waiter منقضی‌شده ظرفیتی نگرفته است
+        ticket = await gov.acquire(PRIORITY_NORMAL, 1, 0.05)
+        ticket.release()
+
+    asyncio.run(run())
+    assert gov.timed_out == 1
+    assert gov.admitted == 2
+    assert gov.in_flight == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    gov = _governor()
+
+    async def run():
+        holder = await gov.acquire(PRIORITY_NORMAL, 1, None)
+        waiter = asyncio.create_task(gov.acquire(PRIORITY_NORMAL, 1, None))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        holder.release()
+        (await gov.acquire(PRIORITY_NORMAL, 1, 0.05)).release()
+
+    asyncio.run(run())
+    assert gov.in_flight == 0
+
+
+def _one_slot(monkeypatch, model: str, max_wait: float) -> None:
+    monkeypatch.setitem(governor.model_limits, model, {"max_concurrency": 1})
+    monkeypatch.setattr(governor, "max_wait", max_wait)
+    monkeypatch.delitem(governor._models, model, raising=False)
+
+
+def _llm_kwargs(model: str, base_url: str):
+    return dict(
+        llm_model_name=model, api_key="test", base_url=base_url,
+        use_cache=False, coalesce=False, hedge=False, return_full_response_dict=False,
+    )
+
+
+def test_llm_async_maps_admission_timeout_to_429(mock_llm, monkeypatch):
+    model = "deepseek-chat"
+    mock_llm.state.mock.config.ttft = 0.5  # فراخوانی اول ظرفیت را نگه می‌دارد
+    _one_slot(monkeypatch, model, max_wait=0.1)
+    kwargs = _llm_kwargs(model, mock_llm.state.base_url)
+
+    async def run():
+        slow = asyncio.create_task(llm_async(prompt="first", **kwargs))
+        await asyncio.sleep(0.05)
+        queued = await llm_async(prompt="second", **kwargs)
+        return await slow, queued
+
+    first, second = asyncio.run(run())
+    governor._models.pop(model, None)
+    assert first.success
+    assert not second.success
+    assert second.status_code == 429
+    assert mock_llm.state.mock.requests == 1
+
+
+def test_slot_is_free_while_a_call_waits_to_retry(monkeypatch):
+    model = "deepseek-chat"
+    _one_slot(monkeypatch, model, max_wait=0.2)
+    config = MockLLMConfig(ttft=0.0, tokens_per_second=0.0, error_429_rate=1.0, retry_after=0.5)
+
+    with run_mock_llm(config) as app:
+        kwargs = _llm_kwargs(model, app.state.base_url)
+
+        async def run():
+            retrying = asyncio.create_task(llm_async(prompt="first", **kwargs))
+            await asyncio.sleep(0.2)  # پاسخ 429 گرفته و منتظر Retry-After است
+            config.error_429_rate = 0.0
+            other = await llm_async(prompt="second", **kwargs)
+            return await retrying, other
+
+        first, second = asyncio.run(run())
+        requests = app.state.mock.requests
+    governor._models.pop(model, None)
+    assert first.success and second.success
+    assert requests == 3
@@ -0,0 +1,141 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.llm.hedging import HedgedCaller, Provider, ProviderPool
+from app.llm.latency import LatencyTracker
+from app.llm.resilience import resilience
+
+MODEL = "gpt-4o-mini"
+PRIMARY, SECONDARY, THIRD = "http://primary", "http://secondary", "http://third"
+
+
+def _error(cls, status: int, base_url: str):
+    response = httpx.Response(status, request=httpx.Request("POST", f"{base_url}/chat/completions"))
+    return cls(f"{base_url} failed", response=response, body=None)
+
+
+class Endpoints:
+    """providerهای ساختگی: هر base_url پس از `delay` ثانیه پاسخ می‌دهد یا خطای `error` را برمی‌گرداند."""
+
+    def __init__(self, plan: Dict[str, Tuple[float, Optional[Exception]]]):
+        self.plan = plan
+        self.started: List[str] = []
+        self.cancelled: List[str] = []
+
+    async def run(self, base_url: str, api_key: str) -> LLMCallResult:
+        self.started.append(base_url)
+        delay, error = self.plan[base_url]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(base_url)
+            raise
+        if error is not None:
+            raise error
+        return LLMCallResult(success=True, status_code=200, content=f"from {base_url}")
+
+
+def _hedger(**kwargs) -> HedgedCaller:
+    params = dict(default_delay=0.05, min_delay=0.01, max_ratio=1.0)
+    params.update(kwargs)
+    return HedgedCaller(LatencyTracker(min_samples=1), **params)
+
+
+def _call(hedger: HedgedCaller, endpoints: Endpoints, targets=(PRIMARY, SECONDARY)) -> LLMCallResult:
+    return asyncio.run(hedger.call(MODEL, [(t, "key") for t in targets], endpoints.run, stream=False))
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    hedger = _hedger()
+    endpoints = Endpoints({PRIMARY: (1.0, None), SECONDARY: (0.0, None)})
+    result = _call(hedger, endpoints)
+    assert result.content == f"from {SECONDARY}"
+    assert result.provider == SECONDARY
+    assert endpoints.cancelled == [PRIMARY]
+    assert (hedger.hedged, hedger.hedge_wins, hedger.failovers) == (1, 1, 0)
+    # بازنده به صورت نمونه سانسورشده ثبت شده است (دست‌کم به اندازه hedge delay)
+    assert hedger.tracker.percentile(PRIMARY, MODEL, 0.95) >= 0.05
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = _hedger()
+    endpoints = Endpoints({PRIMARY: (0.0, None), SECONDARY: (0.0, None)})
+    assert _call(hedger, endpoints).provider == PRIMARY
+    assert endpoints.started == [PRIMARY]
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_endpoint_failure_fails_over_at_once():
+    hedger = _hedger(default_delay=10.0)
+    endpoints = Endpoints({
+        PRIMARY: (0.0, _error(InternalServerError, 503, PRIMARY)),
+        SECONDARY: (0.0, _error(RateLimitError, 429, SECONDARY)),
+        THIRD: (0.0, None),
+    })
+    result = _call(hedger, endpoints, targets=(PRIMARY, SECONDARY, THIRD))
+    assert result.provider == THIRD
+    assert endpoints.started == [PRIMARY, SECONDARY, THIRD]
+    assert hedger.failovers == 2
+
+
+def test_request_errors_do_not_fail_over():
+    hedger = _hedger(default_delay=10.0)
+    endpoints = Endpoints({PRIMARY: (0.0, _error(BadRequestError, 400, PRIMARY)), SECONDARY: (0.0, None)})
+    with pytest.raises(BadRequestError):
+        _call(hedger, endpoints)
+    assert endpoints.started == [PRIMARY]
+
+
+def test_when_every_attempt_fails_the_primary_error_is_raised():
+    hedger = _hedger()
+    # secondary (hedge) زودتر شکست می‌خورد؛ خطای برگشتی باز هم مال primary است
+    endpoints = Endpoints({
+        PRIMARY: (0.2, _error(InternalServerError, 502, PRIMARY)),
+        SECONDARY: (0.0, _error(RateLimitError, 429, SECONDARY)),
+    })
+    with pytest.raises(InternalServerError, match=PRIMARY):
+        _call(hedger, endpoints)
+    assert endpoints.started == [PRIMARY, SECONDARY]
+
+
+def test_hedges_are_capped_by_the_budget():
+    hedger = _hedger(max_ratio=0.0)
+    endpoints = Endpoints({PRIMARY: (0.1, None), SECONDARY: (0.0, None)})
+    assert _call(hedger, endpoints).provider == PRIMARY
+    assert endpoints.started == [PRIMARY]
+    assert hedger.budget_exhausted == 1
+
+
+def test_censored_samples_raise_the_percentile():
+    tracker = LatencyTracker(min_samples=1)
+    for _ in range(18):
+        tracker.record(PRIMARY, MODEL, 1.0)
+    tracker.record(PRIMARY, MODEL, 2.0)
+    tracker.record(PRIMARY, MODEL, 3.0)
+    assert tracker.percentile(PRIMARY, MODEL, 0.95) == 2.0
+    assert tracker.percentile(PRIMARY, MODEL, 0.5) == 1.0
+
+    # بازنده‌های لغوشده در 5s: بدون آن‌ها p95 بی‌دلیل پایین می‌ماند
+    for _ in range(5):
+        tracker.record(PRIMARY, MODEL, 5.0, censored=True)
+    assert tracker.percentile(PRIMARY, MODEL, 0.95) == 5.0
+    assert tracker.percentile(PRIMARY, MODEL, 0.5) == 1.0
+
+
+def test_route_puts_the_primary_first_and_open_breakers_last(monkeypatch):
+    pool = ProviderPool([
+        Provider("primary", PRIMARY),
+        Provider("down", "http://down"),
+        Provider("other-models", "http://other", models=["gpt-4o"]),
+        Provider("secondary", SECONDARY, api_key="secondary-key"),
+    ])
+    breaker = resilience.breaker("http://down")
+    monkeypatch.setattr(breaker, "state", breaker.OPEN)
+    assert pool.route(PRIMARY, "caller-key", MODEL) == [
+        (PRIMARY, "caller-key"), (SECONDARY, "secondary-key"), ("http://down", "caller-key"),
+    ]
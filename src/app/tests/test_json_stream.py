@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+
+from app.llm.json_stream import IncrementalJSONParser, JSONStreamError, aiter_json_events, iter_json_events
+
+DOC = {
+    "name": "Sara",
+    "skills": [{"n": "py", "tags": ["a", "}"]}, {"n": "go\"{"}],
+    "meta": {"x": {"deep": True, "n": -1.5e3}, "empty": [], "none": None},
+}
+
+
+def _events(chunks, max_depth=2):
+    return [(e.kind, e.path, e.value) for e in iter_json_events(chunks, max_depth)]
+
+
+def test_events_are_emitted_as_containers_close():
+    events = _events([json.dumps(DOC)])
+    assert [(kind, path) for kind, path, _ in events] == [
+        ("key", ("name",)),
+        ("key", ("skills",)),
+        ("value", ("skills", 0)),
+        ("value", ("skills", 1)),
+        ("value", ("skills",)),
+        ("key", ("meta",)),
+        ("key", ("meta", "x")),
+        ("value", ("meta", "x")),
+        ("key", ("meta", "empty")),
+        ("value", ("meta", "empty")),
+        ("key", ("meta", "none")),
+        ("value", ("meta",)),
+        ("value", ()),
+    ]
+    assert events[2][2] == DOC["skills"][0]
+    assert events[-1][2] == DOC
+
+
+def test_chunk_boundaries_do_not_change_the_events():
+    text = json.dumps(DOC, indent=2, ensure_ascii=False)
+    assert _events(list(text)) == _events([text])
+    # مرز chunk درست وسط یک escape
+    cut = text.index('\\"') + 1
+    assert _events([text[:cut], text[cut:]]) == _events([text])
+
+
+def test_value_events_are_available_before_the_document_ends():
+    parser = IncrementalJSONParser()
+    events = parser.feed('{"skills": [{"n": 1}, {"n"')
+    assert [(e.kind, e.path, e.value) for e in events] == [
+        ("key", ("skills",), None), ("value", ("skills", 0), {"n": 1}),
+    ]
+    assert not parser.done
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ('{"a" 1}', "expected ':'"),
+        ('{"a": 1,}', "expected an object key"),
+        ('[1 2]', "expected ',' or closing bracket"),
+        ('{"a": tru}', "Invalid literal"),
+        ('{"a": 1]', "expected ',' or closing bracket"),
+        ('{"a": 1} {', "after the end of the document"),
+        ('[,]', "expected a value"),
+    ],
+)
+def test_malformed_documents_raise_with_position(text, message):
+    with pytest.raises(JSONStreamError, match=message) as info:
+        _events(list(text))
+    assert 0 < info.value.position <= len(text)
+
+
+def test_truncated_document_fails_on_close():
+    parser = IncrementalJSONParser()
+    parser.feed('{"a": [1, 2')
+    with pytest.raises(JSONStreamError, match="Unexpected end"):
+        parser.close()
+
+
+def test_async_stream_stops_at_the_first_error():
+    consumed = []
+
+    async def chunks():
+        for chunk in ['{"a": ', "1", "}", "}", '{"b": 2}']:
+            consumed.append(chunk)
+            yield chunk
+
+    async def run():
+        kinds = []
+        with pytest.raises(JSONStreamError):
+            async for event in aiter_json_events(chunks()):
+                kinds.append(event.kind)
+        return kinds
+
+    assert asyncio.run(run()) == ["key", "value"]
+    # chunk بعد از خطا خوانده نشده است
+    assert consumed == ['{"a": ', "1", "}", "}"]
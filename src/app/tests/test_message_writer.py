@@ -0,0 +1,290 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from app.services.conversation_manager import conversation_manager
+from app.services.conversation_service import ConversationService, MessageWriteError
+from app.services.message_writer import BulkItemError, MessageWriter, message_writer
+
+
+class FakeBulkES:
+    """_bulk ساختگی: هر درخواست ثبت می‌شود؛ `reject[_id]` لیست وضعیت‌های پیاپی همان آیتم است."""
+
+    def __init__(self):
+        self.requests: List[Dict[str, Any]] = []
+        self.docs: Dict[str, Any] = {}
+        self.reject: Dict[str, List[int]] = {}
+        self.transport_errors = 0
+
+    async def bulk(self, operations, refresh=None):
+        if self.transport_errors:
+            self.transport_errors -= 1
+            raise ConnectionError("connection reset")
+        actions = operations[::2]
+        self.requests.append({"ids": [next(iter(a.values()))["_id"] for a in actions], "refresh": refresh,
+                              "actions": actions, "sources": operations[1::2], "at": time.monotonic()})
+        items = []
+        for action, source in zip(actions, operations[1::2]):
+            (kind, meta), = action.items()
+            statuses = self.reject.get(meta["_id"])
+            status = statuses.pop(0) if statuses else (201 if kind == "index" else 200)
+            if status < 300:
+                self.docs[meta["_id"]] = source
+            items.append({kind: {"_index": meta["_index"], "_id": meta["_id"], "status": status,
+                                 "error": {"reason": "rejected"} if status >= 300 else None}})
+        return {"errors": any(next(iter(i.values()))["status"] >= 300 for i in items), "items": items}
+
+
+def _run(coro_fn, es, **kwargs):
+    writer = MessageWriter(**{"max_batch": 100, "max_delay": 0.02, "max_retries": 2, "retry_backoff": 0.01, **kwargs})
+
+    async def run():
+        writer.start(es)
+        try:
+            return await coro_fn(writer)
+        finally:
+            await writer.stop()
+
+    return writer, asyncio.run(run())
+
+
+def test_concurrent_writes_share_one_bulk():
+    es = FakeBulkES()
+
+    async def scenario(writer):
+        acks = [writer.index("messages", f"m{i}", {"i": i}) for i in range(5)]
+        return await asyncio.gather(*acks)
+
+    writer, results = _run(scenario, es)
+    assert [r["status"] for r in results] == [201] * 5
+    assert [r["ids"] for r in es.requests] == [[f"m{i}" for i in range(5)]]
+    assert writer.stats()["avg_batch"] == 5.0
+
+
+def test_full_batch_is_sent_without_waiting_for_max_delay():
+    es = FakeBulkES()
+
+    async def scenario(writer):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(writer.index("messages", f"m{i}", {}) for i in range(3)))
+        return loop.time() - started
+
+    _, elapsed = _run(scenario, es, max_batch=3, max_delay=5.0)
+    assert elapsed < 1.0
+    assert len(es.requests) == 1
+
+
+def test_rejected_items_are_retried_in_a_later_bulk_with_backoff():
+    es = FakeBulkES()
+    es.reject = {"m1": [429, 503]}
+
+    async def scenario(writer):
+        return await asyncio.gather(writer.index("messages", "m0", {}), writer.index("messages", "m1", {}))
+
+    writer, results = _run(scenario, es, retry_backoff=0.1)
+    assert [r["_id"] for r in results] == ["m0", "m1"]
+    # فقط آیتم ردشده دوباره ارسال می‌شود
+    assert [r["ids"] for r in es.requests] == [["m0", "m1"], ["m1"], ["m1"]]
+    gaps = [b["at"] - a["at"] for a, b in zip(es.requests, es.requests[1:])]
+    assert gaps[0] >= 0.1 and gaps[1] >= 0.2
+    assert writer.stats()["retries"] == 2
+    assert writer.stats()["failed"] == 0
+
+
+def test_items_fail_after_max_retries_or_on_a_permanent_error():
+    es = FakeBulkES()
+    es.reject = {"busy": [429, 429, 429], "bad": [400]}
+
+    async def scenario(writer):
+        return await asyncio.gather(
+            writer.index("messages", "busy", {}), writer.index("messages", "bad", {}),
+            writer.index("messages", "ok", {}), return_exceptions=True,
+        )
+
+    writer, (busy, bad, ok) = _run(scenario, es)
+    assert isinstance(busy, BulkItemError) and busy.item["status"] == 429
+    assert isinstance(bad, BulkItemError) and bad.item["status"] == 400
+    assert ok["status"] == 201
+    assert "busy" not in es.docs and "ok" in es.docs
+    assert writer.stats()["failed"] == 2
+
+
+def test_failed_bulk_request_is_retried():
+    es = FakeBulkES()
+    es.transport_errors = 1
+
+    async def scenario(writer):
+        return await writer.index("messages", "m0", {})
+
+    writer, result = _run(scenario, es)
+    assert result["status"] == 201
+    assert writer.stats()["retries"] == 1
+
+
+def test_stop_sends_retries_still_in_backoff():
+    es = FakeBulkES()
+    es.reject = {"m0": [429]}
+
+    async def scenario(writer):
+        ack = writer.index("messages", "m0", {})
+        await writer.flush()
+        assert writer.stats()["backoff"] == 1
+        return ack
+
+    _, ack = _run(scenario, es, retry_backoff=60.0)
+    assert ack.result()["status"] == 201
+    assert [r["ids"] for r in es.requests] == [["m0"], ["m0"]]
+
+
+def test_stop_flushes_what_is_still_queued():
+    es = FakeBulkES()
+
+    async def scenario(writer):
+        writer.index("messages", "late", {"x": 1})
+        writer.update("conversations", "c1", {"script": {"source": "..."}}, retry_on_conflict=5)
+
+    _, _ = _run(scenario, es, max_delay=60.0)
+    assert es.requests[0]["ids"] == ["late", "c1"]
+    assert es.requests[0]["actions"][1]["update"]["retry_on_conflict"] == 5
+
+
+def test_flush_with_refresh_waits_for_the_whole_batch():
+    es = FakeBulkES()
+
+    async def scenario(writer):
+        other = writer.index("messages", "m0", {})
+        ack = writer.index("messages", "m1", {}, refresh="wait_for")
+        await writer.flush()
+        return other.done(), await ack
+
+    _, (other_done, ack) = _run(scenario, es, max_delay=60.0)
+    assert other_done and ack["status"] == 201
+    assert es.requests[0]["refresh"] == "wait_for"
+
+
+def _shared_writer(monkeypatch) -> None:
+    monkeypatch.setattr(message_writer, "max_retries", 0)
+    monkeypatch.setattr(message_writer, "max_delay", 0.01)
+
+
+def test_turn_does_not_wait_for_acks_and_drops_the_cache_on_failure(monkeypatch):
+    es = FakeBulkES()
+    svc = ConversationService(es, None, None, None)
+    _shared_writer(monkeypatch)
+    invalidated: List[str] = []
+    monkeypatch.setattr(conversation_manager, "invalidate", invalidated.append)
+
+    async def run():
+        message_writer.start(es)
+        try:
+            acks: List[asyncio.Future] = []
+            stored = await svc._index_message("c1", "user", "hi", acks=acks)
+            lost = await svc._index_message("c1", "assistant", "answer", acks=acks)
+            es.reject[lost.id] = [503]
+            svc._watch_writes("c1", acks)
+            assert not any(ack.done() for ack in acks)  # نوبت پیش از ack تمام شده است
+            await asyncio.gather(*acks, return_exceptions=True)
+            await asyncio.sleep(0)
+            return stored
+        finally:
+            await message_writer.stop()
+
+    stored = asyncio.run(run())
+    assert list(es.docs) == [stored.id]
+    assert invalidated == ["c1"]
+
+
+def test_read_your_writes_message_fails_loudly(monkeypatch):
+    es = FakeBulkES()
+    es.transport_errors = 1
+    svc = ConversationService(es, None, None, None)
+    _shared_writer(monkeypatch)
+
+    async def run():
+        message_writer.start(es)
+        try:
+            with pytest.raises(MessageWriteError):
+                await svc._index_message("c1", "user", "hi", refresh="wait_for")
+        finally:
+            await message_writer.stop()
+
+    asyncio.run(run())
+    assert es.docs == {}
+
+
+def test_resent_counter_updates_carry_the_message_id(monkeypatch):
+    es = FakeBulkES()
+    es.transport_errors = 1
+    svc = ConversationService(es, None, None, None)
+    monkeypatch.setattr(message_writer, "max_delay", 0.01)
+    monkeypatch.setattr(message_writer, "retry_backoff", 0.01)
+    active = SimpleNamespace(conv=SimpleNamespace(agent_id="a1"))
+    monkeypatch.setattr(conversation_manager, "peek", lambda conv_id: active)
+
+    async def run():
+        message_writer.start(es)
+        try:
+            msg = await svc._index_message("c1", "assistant", "answer", [], 10, 5, add_to_counters=True)
+            await message_writer.flush()
+            return msg
+        finally:
+            await message_writer.stop()
+
+    msg = asyncio.run(run())
+    # درخواست اول پس از خطای انتقال کامل دوباره فرستاده شده است؛ script با همان message_id تکرار را نادیده می‌گیرد
+    (sent,) = es.requests
+    assert sent["ids"] == [msg.id, "c1", "a1"]
+    for source in sent["sources"][1:]:
+        assert source["script"]["params"]["message_id"] == msg.id
+        assert source["script"]["params"]["counters"]["total_tokens"] == 15
+        # سند بدون شمارنده از همین پیام شروع می‌کند (counters_since)
+        assert source["script"]["params"]["created_at"] == msg.created_at.isoformat()
+
+
+class FakeTokensES:
+    """get مکالمه، sum aggregation پیام‌ها و update (fold) ساختگی."""
+
+    def __init__(self, conv: Dict[str, Any], sums: Dict[str, int]):
+        self.conv = conv
+        self.sums = sums
+        self.searches: List[Dict[str, Any]] = []
+        self.updates: List[Dict[str, Any]] = []
+
+    async def get(self, index, id):
+        return {"_id": id, "_source": self.conv}
+
+    async def search(self, index=None, body=None):
+        self.searches.append(body["query"])
+        return {"aggregations": {f: {"value": v} for f, v in self.sums.items()}}
+
+    async def update(self, index, id, body, retry_on_conflict=None):
+        self.updates.append(body["script"]["params"])
+        for f, v in body["script"]["params"]["counters"].items():
+            self.conv[f] += v
+        self.conv.pop("counters_since")
+
+
+def test_messages_before_the_counters_are_folded_in_once():
+    since = "2024-10-10T14:00:00"
+    es = FakeTokensES(
+        {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15,
+         "counters_since": since, "counted_messages": ["m9"]},
+        {"prompt_tokens": 100, "completion_tokens": 40},
+    )
+    svc = ConversationService(es, None, None, None)
+
+    usage = asyncio.run(svc.token_usage("c1"))
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.total_tokens) == (110, 45, 155)
+    (query,) = es.searches
+    assert {"range": {"created_at": {"lt": since}}} in query["bool"]["filter"]
+    assert query["bool"]["must_not"] == [{"ids": {"values": ["m9"]}}]
+    assert es.updates == [{"since": since, "counters": {"prompt_tokens": 100, "completion_tokens": 40,
+                                                         "total_tokens": 140}}]
+
+    # پس از fold فقط یک get
+    assert asyncio.run(svc.token_usage("c1")).total_tokens == 155
+    assert len(es.searches) == 1
@@ -0,0 +1,157 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from elasticsearch import NotFoundError
+
+from app.utils.pagination import InvalidCursorError, cursor_scope, search_page, search_page_sync, start_cursor
+
+SORT = [{"created_at": {"order": "asc"}}]
+
+
+class FakeES:
+    """search با/بدون PIT، search_after و term روی یک ایندکس درون‌حافظه‌ای."""
+
+    def __init__(self, docs: Dict[str, List[Dict[str, Any]]]):
+        self.docs = docs
+        self.calls: List[str] = []
+        self.pits: Dict[str, str] = {}
+        self._next_pit = 0
+
+    async def open_point_in_time(self, index: str, keep_alive: str):
+        self.calls.append("open_pit")
+        self._next_pit += 1
+        pit_id = f"pit-{self._next_pit}"
+        self.pits[pit_id] = index
+        return {"id": pit_id}
+
+    async def close_point_in_time(self, id: str):
+        self.calls.append("close_pit")
+        if self.pits.pop(id, None) is None:
+            raise NotFoundError("not found", None, {})
+
+    async def search(self, index: str = None, body: Dict[str, Any] = None):
+        self.calls.append("search")
+        with_pit = "pit" in body
+        if with_pit:
+            if body["pit"]["id"] not in self.pits:
+                raise NotFoundError("pit expired", None, {})
+            index = self.pits[body["pit"]["id"]]
+        rows = [(d["created_at"], seq, d) for seq, d in enumerate(self.docs[index])]
+        term = (body.get("query") or {}).get("term")
+        if term:
+            (field, value), = term.items()
+            rows = [r for r in rows if r[2].get(field) == value]
+        rows.sort(key=lambda r: (r[0], r[1]))
+        if "search_after" in body:
+            after = tuple(body["search_after"])
+            rows = [r for r in rows if (r[0], r[1]) > after]
+        hits = [
+            {"_id": d["id"], "_source": d, "sort": [created, seq] if with_pit else [created]}
+            for created, seq, d in rows[:body["size"]]
+        ]
+        return {"hits": {"hits": hits}}
+
+
+class SyncES:
+    """همان FakeES با رابط کلاینت sync."""
+
+    def __init__(self, es: FakeES):
+        self.es = es
+
+    def __getattr__(self, name):
+        method = getattr(self.es, name)
+        return lambda *args, **kwargs: asyncio.run(method(*args, **kwargs))
+
+
+def _messages(n: int, conv: str = "c1", per_value: int = 2) -> List[Dict[str, Any]]:
+    # هر per_value پیام یک created_at دارند: tiebreaker لازم است
+    return [{"id": f"{conv}-{i:03d}", "conversation_id": conv, "created_at": i // per_value} for i in range(n)]
+
+
+def _page_all(es: FakeES, size: int, query=None, expire_after: int = None) -> List[str]:
+    async def run():
+        seen, cursor, pages = [], None, 0
+        while True:
+            hits, cursor = await search_page(es, "messages", SORT, size, query=query, cursor=cursor)
+            seen.extend(h["_id"] for h in hits)
+            pages += 1
+            if pages == expire_after:
+                es.pits.clear()  # keep_alive گذشته است
+            if cursor is None:
+                return seen
+    return asyncio.run(run())
+
+
+def test_single_page_is_one_search_without_pit():
+    es = FakeES({"messages": _messages(5)})
+    assert len(_page_all(es, 10)) == 5
+    assert es.calls == ["search"]
+
+
+def test_pages_cover_every_hit_once_and_close_the_pit():
+    es = FakeES({"messages": _messages(25) + _messages(3, conv="c2")})
+    seen = _page_all(es, 10, query={"term": {"conversation_id": "c1"}})
+    assert seen == [f"c1-{i:03d}" for i in range(25)]
+    # صفحه اول یک search؛ PIT با صفحه دوم باز و با صفحه آخر بسته می‌شود
+    assert es.calls == ["search", "open_pit", "search", "search", "close_pit"]
+    assert es.pits == {}
+
+
+@pytest.mark.parametrize("expire_after", [None, 1, 2, 3])
+def test_ties_longer_than_a_page_are_neither_lost_nor_repeated(expire_after):
+    es = FakeES({"messages": _messages(10, per_value=10)})
+    assert _page_all(es, 3, expire_after=expire_after) == [f"c1-{i:03d}" for i in range(10)]
+
+
+def test_cursor_of_another_listing_is_rejected():
+    es = FakeES({"messages": _messages(25), "conversations": _messages(25)})
+    query = {"term": {"conversation_id": "c1"}}
+
+    async def run():
+        _, cursor = await search_page(es, "messages", SORT, 10, query=query)
+        with pytest.raises(InvalidCursorError):
+            await search_page(es, "conversations", SORT, 10, query=query, cursor=cursor)
+        with pytest.raises(InvalidCursorError):
+            await search_page(es, "messages", SORT, 10, query={"term": {"conversation_id": "c2"}}, cursor=cursor)
+        with pytest.raises(InvalidCursorError):
+            await search_page(es, "messages", SORT, 10, query=query, cursor="not-a-cursor")
+
+    asyncio.run(run())
+
+
+def test_expired_pit_is_reopened_after_the_last_returned_hit():
+    es = FakeES({"messages": _messages(35)})
+    assert _page_all(es, 10, expire_after=2) == [f"c1-{i:03d}" for i in range(35)]
+    assert es.calls.count("open_pit") == 2
+    assert es.pits == {}
+
+
+def test_sync_version_pages_the_same_way():
+    es = FakeES({"messages": _messages(25)})
+    sync_es = SyncES(es)
+    seen, cursor = [], None
+    while True:
+        hits, cursor = search_page_sync(sync_es, "messages", SORT, 10, cursor=cursor)
+        seen.extend(h["_id"] for h in hits)
+        if cursor is None:
+            break
+    assert seen == [f"c1-{i:03d}" for i in range(25)]
+    assert es.calls == ["search", "open_pit", "search", "search", "close_pit"]
+
+
+def test_start_cursor_carries_its_scope():
+    es = FakeES({"messages": _messages(5)})
+    scope = {"before": "2024-01-01T00:00:00"}
+    cursor = start_cursor("messages", SORT, {"term": {"conversation_id": "c1"}}, scope)
+    assert cursor_scope(cursor) == scope
+
+    async def run():
+        hits, _ = await search_page(
+            es, "messages", SORT, 10, query={"term": {"conversation_id": "c1"}}, cursor=cursor, scope=scope
+        )
+        with pytest.raises(InvalidCursorError):
+            await search_page(es, "messages", SORT, 10, query={"term": {"conversation_id": "c1"}}, cursor=cursor)
+        return hits
+
+    assert len(asyncio.run(run())) == 5
@@ -0,0 +1,131 @@
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+from app.llm.resilience import CircuitBreaker, CircuitOpenError, LLMResilience
+
+URL = "http://llm"
+
+
+def _error(cls, status: int, headers: Optional[Dict[str, str]] = None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", f"{URL}/chat/completions"))
+    return cls("error", response=response, body=None)
+
+
+class Endpoint:
+    """endpoint ساختگی: خطاهای `errors` به ترتیب، سپس پاسخ موفق."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def _expire(breaker: CircuitBreaker) -> None:
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_consecutive_failures_open_the_circuit():
+    breaker = CircuitBreaker(URL, failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # موفقیت شمارنده را صفر می‌کند
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()["times_opened"] == 1
+    assert breaker.snapshot()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(URL, failure_threshold=1, reset_timeout=30.0)
+    breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()  # probe دوم تا پایان اولی رد می‌شود
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_failed_probe_reopens_and_cancelled_probe_frees_the_slot():
+    breaker = CircuitBreaker(URL, failure_threshold=5, reset_timeout=30.0)
+    for _ in range(5):
+        breaker.record_failure()
+    _expire(breaker)
+    assert breaker.allow_request()
+    breaker.record_failure()  # یک خطا در half_open کافی است
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_in() > 0
+
+    _expire(breaker)
+    assert breaker.allow_request()
+    breaker.release_probe()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_open_circuit_rejects_without_calling_the_endpoint():
+    resilience = LLMResilience(max_retries=0, base_delay=0.0, failure_threshold=2)
+    endpoint = Endpoint(*[_error(InternalServerError, 500) for _ in range(2)])
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(InternalServerError):
+                await resilience.call(URL, endpoint)
+        with pytest.raises(CircuitOpenError) as info:
+            await resilience.call(URL, endpoint)
+        return info.value
+
+    error = asyncio.run(run())
+    assert endpoint.calls == 2
+    assert error.base_url == URL and error.retry_in > 0
+    assert resilience.stats()["rejected_open"] == 1
+    # breakerها برای هر base_url جدا هستند
+    assert resilience.breaker("http://other").allow_request()
+
+
+def test_retries_recover_and_rate_limits_do_not_open_the_circuit():
+    resilience = LLMResilience(max_retries=3, base_delay=0.0, failure_threshold=1)
+    endpoint = Endpoint(
+        _error(RateLimitError, 429, {"retry-after-ms": "10"}), _error(RateLimitError, 429, {"retry-after": "0"})
+    )
+    assert asyncio.run(resilience.call(URL, endpoint)) == "ok"
+    assert endpoint.calls == 3
+    assert resilience.breaker(URL).state == CircuitBreaker.CLOSED
+    assert resilience.stats()["retries_by_reason"] == {"RateLimitError": 2}
+
+
+def test_client_errors_are_not_retried_and_retries_are_bounded():
+    resilience = LLMResilience(max_retries=2, base_delay=0.0, failure_threshold=10)
+    bad = Endpoint(_error(BadRequestError, 400))
+    with pytest.raises(BadRequestError):
+        asyncio.run(resilience.call(URL, bad))
+    assert bad.calls == 1
+
+    down = Endpoint(*[_error(InternalServerError, 503) for _ in range(5)])
+    with pytest.raises(InternalServerError):
+        asyncio.run(resilience.call(URL, down))
+    assert down.calls == 3
+    assert resilience.stats()["gave_up"] == 1
+    assert resilience.breaker(URL).consecutive_failures == 3
+
+
+def test_backoff_honours_retry_after_up_to_the_cap():
+    resilience = LLMResilience(base_delay=1.0, max_delay=5.0)
+    assert resilience.backoff_delay(0, retry_after=2.5) == 2.5
+    assert resilience.backoff_delay(0, retry_after=60.0) == 5.0
+    assert all(0.0 <= resilience.backoff_delay(10) <= 5.0 for _ in range(20))
@@ -0,0 +1,172 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from app.api.v1.schemas.llm_result import LLMCallResult
+from app.llm.single_flight import SingleFlight, StreamBroadcast
+
+
+class Upstream:
+    """فراخوانی upstream ساختگی: شمارش فراخوانی‌ها و (برای stream) بسته شدن ژنراتور."""
+
+    def __init__(self, chunks: List[str] = (), delay: float = 0.05, fail: bool = False):
+        self.chunks = list(chunks)
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+        self.closed = False
+        self.gate = asyncio.Event()  # stream: chunkها فقط پس از set شدن ادامه می‌یابند
+
+    async def call(self) -> LLMCallResult:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return LLMCallResult(success=True, status_code=200, content="answer", usage={"total_tokens": 3})
+
+    async def stream(self) -> LLMCallResult:
+        self.calls += 1
+        result = LLMCallResult(success=True, status_code=200)
+
+        async def gen():
+            try:
+                for i, chunk in enumerate(self.chunks):
+                    if i == 1:
+                        await self.gate.wait()
+                    yield chunk
+                result.usage = {"total_tokens": len(self.chunks)}
+            finally:
+                self.closed = True
+
+        result.stream_data = gen()
+        return result
+
+
+async def _drain(result: LLMCallResult) -> List[str]:
+    return [chunk async for chunk in result.stream_data]
+
+
+def test_concurrent_identical_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    upstream = Upstream()
+
+    async def run():
+        return await asyncio.gather(*(flights.do("k", upstream.call) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert upstream.calls == 1
+    assert [r.content for r in results] == ["answer"] * 3
+    # هر فراخواننده LLMCallResult خودش را می‌گیرد
+    assert len({id(r) for r in results}) == 3
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2}
+
+
+def test_errors_reach_every_waiter_and_the_key_is_released():
+    flights = SingleFlight()
+    upstream = Upstream(fail=True)
+
+    async def run():
+        results = await asyncio.gather(*(flights.do("k", upstream.call) for _ in range(2)), return_exceptions=True)
+        upstream.fail = False
+        return results, await flights.do("k", upstream.call)
+
+    errors, retried = asyncio.run(run())
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert retried.success
+    assert upstream.calls == 2
+
+
+def test_shared_call_is_cancelled_only_with_its_last_waiter():
+    flights = SingleFlight()
+    upstream = Upstream(delay=0.2)
+
+    async def run():
+        first = asyncio.create_task(flights.do("k", upstream.call))
+        second = asyncio.create_task(flights.do("k", upstream.call))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        result = await second
+        assert upstream.cancelled == 0
+        assert result.success
+
+        third = asyncio.create_task(flights.do("k2", upstream.call))
+        await asyncio.sleep(0.05)
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert upstream.cancelled == 1
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_late_stream_subscriber_replays_the_buffer():
+    flights = SingleFlight()
+    upstream = Upstream(chunks=["a", "b", "c"])
+
+    async def run():
+        leader = await flights.do("k", upstream.stream)
+        leader_chunks = [await leader.stream_data.__anext__()]
+        # دیر رسیده: stream هنوز تمام نشده و flight قابل پیوستن است
+        late = await flights.do("k", upstream.stream)
+        upstream.gate.set()
+        leader_chunks += await _drain(leader)
+        return leader, leader_chunks, late, await _drain(late)
+
+    leader, leader_chunks, late, late_chunks = asyncio.run(run())
+    assert upstream.calls == 1
+    assert leader_chunks == late_chunks == ["a", "b", "c"]
+    # usage و متریک‌ها پس از پایان به نتیجه هر subscriber منتقل می‌شوند
+    assert leader.usage == late.usage == {"total_tokens": 3}
+    assert upstream.closed
+
+
+def test_upstream_is_closed_when_every_subscriber_leaves():
+    upstream = Upstream(chunks=["a", "b", "c"])
+
+    async def run():
+        source = await upstream.stream()
+        broadcast = StreamBroadcast(source)
+        first = broadcast.subscribe(LLMCallResult(success=True))
+        second = broadcast.subscribe(LLMCallResult(success=True))
+        assert await first.__anext__() == "a"
+
+        # subscriber در انتظار chunk بعدی لغو می‌شود
+        waiting = asyncio.create_task(first.__anext__())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not broadcast._pump_task.done()
+
+        await second.aclose()
+        await asyncio.sleep(0.01)
+        return broadcast
+
+    broadcast = asyncio.run(run())
+    assert broadcast._pump_task.cancelled()
+    assert upstream.closed
+
+
+def test_stream_error_is_raised_to_subscribers():
+    async def run():
+        async def gen():
+            yield "a"
+            raise RuntimeError("stream broke")
+
+        broadcast = StreamBroadcast(LLMCallResult(success=True, stream_data=gen()))
+        sub = broadcast.subscribe(LLMCallResult(success=True))
+        chunks = []
+        with pytest.raises(RuntimeError, match="stream broke"):
+            async for chunk in sub:
+                chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(run()) == ["a"]
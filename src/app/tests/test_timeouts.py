@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from app.llm.resilience import LLMResilience
+from app.llm.timeouts import FIRST_TOKEN, TOTAL, AdaptiveTimeouts, DeadlineExceededError
+
+
+def _timeouts(**kwargs) -> AdaptiveTimeouts:
+    params = dict(window=100, min_samples=5, quantile=0.99, factor=2.0, min_timeout=1.0, default_timeout=90.0)
+    params.update(kwargs)
+    timeouts = AdaptiveTimeouts(**params)
+    for _ in range(20):  # پاسخ‌های کوتاه: اولین توکن 0.5s، کل 3s
+        timeouts.record("m", 500, FIRST_TOKEN, 0.5)
+        timeouts.record("m", 500, TOTAL, 3.0)
+    return timeouts
+
+
+def test_limits_follow_observed_latency():
+    limits = _timeouts().limits("m", 500)
+    assert limits["first_token"] == pytest.approx(1.0)
+    assert limits["total"] == pytest.approx(6.0)
+
+
+def test_long_answer_gets_room_to_decode():
+    timeouts = _timeouts(decode_speed=lambda model: 50.0)
+    # 4000 توکن با 50 tok/s: 80s تولید × factor، محدود به سقف 90s
+    assert timeouts.limits("m", 500, max_tokens=4000)["total"] == pytest.approx(90.0)
+    assert timeouts.limits("m", 500, max_tokens=100)["total"] == pytest.approx(6.0)
+    assert timeouts.limits("m", 500, max_tokens=500)["total"] == pytest.approx(1.0 + 500 / 50.0 * 2.0)
+
+
+def test_own_deadline_is_not_an_endpoint_failure():
+    resilience = LLMResilience(max_retries=3, base_delay=0.0, failure_threshold=1)
+    calls = 0
+
+    async def deadline():
+        nonlocal calls
+        calls += 1
+        raise DeadlineExceededError("m", 1.0)
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(resilience.call("http://llm", deadline))
+    assert calls == 1  # بدون retry
+    assert resilience.breaker("http://llm").allow_request()
+
+    # probe در half_open که به مهلت خودمان می‌خورد مدار را نمی‌بندد
+    breaker = resilience.breaker("http://llm")
+    breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(resilience.call("http://llm", deadline))
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.consecutive_failures == 1
+    assert breaker.allow_request()  # جای probe آزاد شده است
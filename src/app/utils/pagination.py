@@ -0,0 +1,231 @@
+import base64
+import binascii
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from elasticsearch import AsyncElasticsearch, Elasticsearch, NotFoundError
+
+# مدت زنده ماندن point-in-time بین دو صفحه (PIT کلاینتی که ادامه نمی‌دهد پس از این مدت آزاد می‌شود)
+PIT_KEEP_ALIVE = "1m"
+MAX_PAGE_SIZE = 1000
+# بزرگ‌ترین مقدار _shard_doc (long)؛ برای ادامه از ابتدای یک گروه هم‌مقدار در ترتیب نزولی
+_MAX_SHARD_DOC = 2 ** 63 - 1
+
+Hit = Dict[str, Any]
+Sort = List[Dict[str, Any]]
+
+
+class InvalidCursorError(ValueError):
+    """cursor دست‌کاری‌شده یا ناسازگار با این endpoint (index، query یا ترتیب دیگر)."""
+
+
+def encode_cursor(state: Dict[str, Any]) -> str:
+    raw = json.dumps(state, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(raw)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursorError("Invalid cursor") from e
+    resume = state.get("resume") if isinstance(state, dict) else None
+    if (
+        not isinstance(state, dict)
+        or not isinstance(state.get("index"), str)
+        or not isinstance(state.get("query"), str)
+        or (state.get("pit") is not None and (not isinstance(state.get("after"), list) or resume is None))
+        or (resume is not None and not (
+            isinstance(resume, dict) and isinstance(resume.get("values"), list) and isinstance(resume.get("skip"), list)
+        ))
+        or not isinstance(state.get("scope") or {}, dict)
+    ):
+        raise InvalidCursorError("Invalid cursor")
+    return state
+
+
+def listing_key(sort: Sort, query: Optional[Dict[str, Any]], scope: Optional[Dict[str, Any]] = None) -> str:
+    """hash ترتیب + query (+ scope)؛ cursor فقط برای همان listing پذیرفته می‌شود."""
+    raw = json.dumps({"sort": sort, "query": query, "scope": scope or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def start_cursor(
+    index: str, sort: Sort, query: Optional[Dict[str, Any]] = None, scope: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    - Cursor of the first page of a narrowed listing (no PIT yet)
+    - `scope`: parameters the service needs to rebuild `query` on the next request
+      (e.g. {"before": ...}); it travels in every following cursor
+    """
+    return encode_cursor({"index": index, "query": listing_key(sort, query, scope), "scope": scope or None})
+
+
+def cursor_scope(cursor: Optional[str]) -> Dict[str, Any]:
+    """scope ذخیره‌شده در cursor (خالی برای cursorهای معمولی)؛ صحت cursor در search_page بررسی می‌شود."""
+    if not cursor:
+        return {}
+    return decode_cursor(cursor).get("scope") or {}
+
+
+def _check_state(cursor: Optional[str], index: str, key: str) -> Optional[Dict[str, Any]]:
+    if not cursor:
+        return None
+    state = decode_cursor(cursor)
+    if state["index"] != index or state["query"] != key:
+        raise InvalidCursorError("Cursor does not belong to this listing")
+    return state
+
+
+class _Listing:
+    """
+    State of one search_page call, shared by the async and sync versions (which only make the ES calls).
+
+    - No cursor (or a start_cursor): plain search without PIT
+    - A cursor without a PIT (the first page had more hits) or whose PIT expired: a new PIT, resumed from the
+      primary sort values of the last hit; hits sharing them that were already returned are skipped by _id
+    - Otherwise: search_after inside the cursor's PIT (`_shard_doc` tiebreaker)
+    """
+
+    def __init__(
+        self, index: str, sort: Sort, size: int, query: Optional[Dict[str, Any]],
+        cursor: Optional[str], scope: Optional[Dict[str, Any]],
+    ):
+        self.index = index
+        self.sort = sort
+        self.size = max(1, min(size, MAX_PAGE_SIZE))
+        self.query = query
+        self.scope = scope
+        self.key = listing_key(sort, query, scope)
+        self.state = _check_state(cursor, index, self.key) or {}
+        self.pit_id: Optional[str] = self.state.get("pit")
+        self.resume: Optional[Dict[str, Any]] = self.state.get("resume")
+
+    @property
+    def first_page(self) -> bool:
+        return self.pit_id is None and self.resume is None
+
+    def first_page_body(self) -> Dict[str, Any]:
+        body: Dict[str, Any] = {"size": self.size + 1, "sort": self.sort, "track_total_hits": False}
+        if self.query:
+            body["query"] = self.query
+        return body
+
+    def pit_body(self, resumed: bool) -> Dict[str, Any]:
+        # _shard_doc: tiebreaker یکتای PIT، تا اسناد با created_at برابر بین صفحه‌ها گم یا تکرار نشوند
+        order = next(iter(self.sort[-1].values())).get("order", "asc") if self.sort else "asc"
+        body: Dict[str, Any] = {
+            "size": self.size + 1,  # یک سند اضافه: آیا صفحه بعدی وجود دارد؟
+            "sort": [*self.sort, {"_shard_doc": {"order": order}}],
+            "pit": {"id": self.pit_id, "keep_alive": PIT_KEEP_ALIVE},
+            "track_total_hits": False,
+        }
+        if self.query:
+            body["query"] = self.query
+        if resumed:
+            # _shard_doc کمینه/بیشینه: همه اسناد هم‌مقدار با آخرین سند برمی‌گردند و دیده‌شده‌ها حذف می‌شوند
+            body["search_after"] = [*self.resume["values"], -1 if order == "asc" else _MAX_SHARD_DOC]
+            body["size"] += len(self.resume["skip"])
+        else:
+            body["search_after"] = self.state["after"]
+        return body
+
+    def page(self, res: Dict[str, Any], resumed: bool = False) -> Tuple[List[Hit], Optional[str]]:
+        """(hits این صفحه، cursor بعدی یا None)"""
+        self.pit_id = res.get("pit_id") or self.pit_id
+        hits = res["hits"]["hits"]
+        if resumed:
+            seen = set(self.resume["skip"])
+            hits = [h for h in hits if h["_id"] not in seen]
+        if len(hits) <= self.size:
+            return hits, None
+        hits = hits[:self.size]
+        last = hits[-1]["sort"]
+        values = last[:len(self.sort)]
+        skip = [h["_id"] for h in hits if h["sort"][:len(self.sort)] == values]
+        if self.resume is not None and self.resume["values"] == values:
+            # گروه هم‌مقدار از صفحه قبل ادامه دارد
+            skip = self.resume["skip"] + [i for i in skip if i not in self.resume["skip"]]
+        state: Dict[str, Any] = {
+            "index": self.index, "query": self.key,
+            "resume": {"values": values, "skip": skip}, "scope": self.scope or None,
+        }
+        if self.pit_id is not None:
+            state.update({"pit": self.pit_id, "after": last})
+        return hits, encode_cursor(state)
+
+
+async def search_page(
+    es: AsyncElasticsearch,
+    index: str,
+    sort: Sort,
+    size: int,
+    query: Optional[Dict[str, Any]] = None,
+    cursor: Optional[str] = None,
+    scope: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Hit], Optional[str]]:
+    """
+    - One page of hits with search_after over a point-in-time (consistent across pages, no max_result_window)
+    - `cursor`: opaque value returned by the previous page; None for the first page.
+      It is bound to `index`, `sort`, `query` and `scope`: a cursor of another listing raises InvalidCursorError
+    - The first page is one plain search; the PIT is opened by the second page, which resumes after the
+      first page's last hit, so a single-page listing costs one request and every later page one search
+    - Returns (hits, next_cursor); next_cursor is None on the last page, whose PIT is closed
+    - An expired PIT is reopened and the listing resumes after the last returned hit
+    """
+    listing = _Listing(index, sort, size, query, cursor, scope)
+    if listing.first_page:
+        return listing.page(await es.search(index=index, body=listing.first_page_body()))
+    resumed = listing.pit_id is None
+    if resumed:
+        listing.pit_id = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    try:
+        res = await es.search(body=listing.pit_body(resumed))
+    except NotFoundError:
+        if resumed:
+            raise
+        listing.pit_id = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+        resumed = True
+        res = await es.search(body=listing.pit_body(resumed))
+    hits, next_cursor = listing.page(res, resumed)
+    if next_cursor is None:
+        try:
+            await es.close_point_in_time(id=listing.pit_id)
+        except NotFoundError:
+            pass
+    return hits, next_cursor
+
+
+def search_page_sync(
+    es: Elasticsearch,
+    index: str,
+    sort: Sort,
+    size: int,
+    query: Optional[Dict[str, Any]] = None,
+    cursor: Optional[str] = None,
+    scope: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Hit], Optional[str]]:
+    """نسخه همگام search_page برای سرویس‌هایی که با کلاینت sync کار می‌کنند."""
+    listing = _Listing(index, sort, size, query, cursor, scope)
+    if listing.first_page:
+        return listing.page(es.search(index=index, body=listing.first_page_body()))
+    resumed = listing.pit_id is None
+    if resumed:
+        listing.pit_id = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        res = es.search(body=listing.pit_body(resumed))
+    except NotFoundError:
+        if resumed:
+            raise
+        listing.pit_id = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+        resumed = True
+        res = es.search(body=listing.pit_body(resumed))
+    hits, next_cursor = listing.page(res, resumed)
+    if next_cursor is None:
+        try:
+            es.close_point_in_time(id=listing.pit_id)
+        except NotFoundError:
+            pass
+    return hits, next_cursor